@@ -23,6 +23,18 @@ class AI:
             dx = dy = 0
         return self.owner.move(dx, dy)
 
+    def move_along_path(self, pos):
+        """
+        Move one step on the way to the position, going around the walls (see pathfinding).
+        If there is no way, try in straight line.
+        :param pos: the target position
+        :return: True if the move was successful
+        """
+        next_pos = self.owner.game.pathfinder.next_step(self.owner.pos, pos)
+        if next_pos is None:
+            return self.move_towards(pos)
+        return self.owner.move(next_pos[0] - self.owner.x, next_pos[1] - self.owner.y)
+
     def move_randomly(self):
         """
         Move by 1 around the current position. The destination should be non blocking.
@@ -110,7 +122,7 @@ class FollowingAIEntity(AI):
 
     def take_turn(self):
         if self.owner.distance_to(self.owner.game.player) > 2:
-            self.move_towards(self.owner.game.player.pos)
+            self.move_along_path(self.owner.game.player.pos)
         self.owner.game.ticker.schedule_turn(self.speed, self)
 
 
@@ -134,6 +146,6 @@ class CloseFightingCompanionAIEntity(AI):
         """
 
         if self.owner.distance_to(self.owner.game.player) > 2:
-            self.move_towards(self.owner.game.player.pos)
+            self.move_along_path(self.owner.game.player.pos)
         self.owner.game.ticker.schedule_turn(self.speed, self)
 
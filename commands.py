@@ -0,0 +1,248 @@
+import json
+import time
+from collections import deque
+
+import pygame as pg
+
+import constants as c
+from settings import *
+
+from entities import ThrowableHelper, NPCHelper
+
+"""
+The player commands.
+In the playing screen, the keys (and the mouse clicks) that act on the game are translated, with the key maps below,
+into command objects put in a queue. The queue is executed by the screen update: a command is executed once the
+previous one is over (its ticks advanced, its multi-turn action done), so several commands can be executed before the
+next frame is drawn.
+The commands executed are logged with the tick they were executed at. Together with the game seed, the log is
+enough to play the game again: it is written with F8 in the game, and replayed when the LORDCROCKET_REPLAY
+environment variable gives its file.
+"""
+
+REPLAY_VARIABLE = "LORDCROCKET_REPLAY"
+
+MOVE_KEYS = {pg.K_LEFT: (-1, 0), pg.K_q: (-1, 0), pg.K_KP4: (-1, 0),
+             pg.K_RIGHT: (1, 0), pg.K_d: (1, 0), pg.K_KP6: (1, 0),
+             pg.K_UP: (0, -1), pg.K_z: (0, -1), pg.K_KP8: (0, -1),
+             pg.K_DOWN: (0, 1), pg.K_x: (0, 1), pg.K_KP2: (0, 1),
+             pg.K_KP7: (-1, -1), pg.K_a: (-1, -1),
+             pg.K_KP9: (1, -1), pg.K_e: (1, -1),
+             pg.K_KP1: (-1, 1), pg.K_w: (-1, 1),
+             pg.K_KP3: (1, 1), pg.K_c: (1, 1)}
+
+
+class Command:
+    """
+    An action of the player. The arguments are plain data, as they are logged.
+    """
+
+    name = None
+
+    def __init__(self, *args):
+        self.args = args
+
+    def execute(self, game):
+        """
+        :param game: the game
+        :return: False if nothing was done (the command is then not logged)
+        """
+        raise NotImplementedError
+
+
+class Move(Command):
+    name = "move"
+
+    def execute(self, game):
+        (dx, dy) = self.args
+        game.player.move(dx=dx, dy=dy)
+
+
+class Run(Command):
+    name = "run"
+
+    def execute(self, game):
+        (dx, dy) = self.args
+        game.player.start_activity("running", lambda player=game.player: player.run(dx=dx, dy=dy), RUN_TURNS)
+
+
+class Rest(Command):
+    name = "rest"
+
+    def execute(self, game):
+        game.player.start_activity("resting", game.player.rest, REST_TURNS)
+
+
+class Explore(Command):
+    name = "explore"
+
+    def execute(self, game):
+        if not game.player.start_exploration():
+            print("No unexplored place can be reached")
+            return False
+
+
+class Travel(Command):
+    name = "travel"
+
+    def execute(self, game):
+        (x, y) = self.args
+        if not (0 <= x < game.map.tile_width and 0 <= y < game.map.tile_height):
+            return False
+        return game.player.start_travel((x, y))
+
+
+class StopActivity(Command):
+    """
+    Stop the multi-turn action in progress. Its argument is the tick to stop at: none when the player asks for it
+    (the action stops now, and the tick is then kept for the log), the logged one when replayed.
+    """
+    name = "stop"
+
+    def execute(self, game):
+        activity = game.player.activity
+        if activity is None:
+            return False
+        if self.args:
+            activity.stop_tick = self.args[0]
+        else:
+            game.player.stop_activity()
+            self.args = (game.ticker.ticks,)
+
+
+class CastFireball(Command):
+    name = "fireball"
+
+    def execute(self, game):
+        ThrowableHelper(game, game.player.pos, "FIREBALL", tuple(self.args), ThrowableHelper.light_damage,
+                        stopped_by=[c.T_WALL, c.T_VOID])
+        game.ticker.ticks_to_advance += game.player.speed_cost_for(c.AC_SPELL)
+
+
+class PickUp(Command):
+    name = "pick_up"
+
+    def execute(self, game):
+        for item in game.objects:
+            if (item.x, item.y) == (game.player.x, game.player.y) and item.item:
+                item.item.pick_up()
+
+
+class NextLevel(Command):
+    name = "next_level"
+
+    def execute(self, game):
+        game.go_next_level()
+
+
+class Companion(Command):
+    name = "companion"
+
+    def execute(self, game):
+        (x, y) = game.player.pos
+        NPCHelper(game, "{} the companion".format(game.new_npc_name()), (x + 1, y), "GUARD_M")
+
+
+class SaveAndQuit(Command):
+    name = "save_quit"
+
+    def execute(self, game):
+        print("SAVING and EXIT")
+        game.save()
+        game.quit()
+
+
+ACTION_KEYS = {pg.K_PERIOD: Rest,
+               pg.K_o: Explore,
+               pg.K_g: PickUp,
+               pg.K_n: NextLevel,
+               pg.K_h: Companion,
+               pg.K_s: SaveAndQuit}
+
+COMMANDS = {command.name: command for command in (Move, Run, Rest, Explore, Travel, StopActivity, CastFireball,
+                                                  PickUp, NextLevel, Companion, SaveAndQuit)}
+
+
+def command_for_key(key, mod=0, spell_mode=False):
+    """
+    Translate a key
+    :param key: the key
+    :param mod: the modifiers (shift + direction runs)
+    :param spell_mode: True if the player is choosing the direction of a spell
+    :return: the command, None if the key is not one of a command
+    """
+    if key in MOVE_KEYS:
+        (dx, dy) = MOVE_KEYS[key]
+        if spell_mode:
+            return CastFireball(dx, dy)
+        if mod & pg.KMOD_SHIFT:
+            return Run(dx, dy)
+        return Move(dx, dy)
+    if not spell_mode and key in ACTION_KEYS:
+        return ACTION_KEYS[key]()
+    return None
+
+
+class CommandQueue:
+    """
+    The commands waiting to be executed, and the log of the ones executed: [tick, command name, arguments]
+    """
+
+    def __init__(self, size=COMMAND_QUEUE_SIZE):
+        """
+        :param size: the maximum number of commands waiting (the keys pressed when it is full are dropped)
+        """
+        self.size = size
+        self.pending = deque()
+        self.log = []
+
+    def push(self, command):
+        """
+        :return: False if the queue is full
+        """
+        if len(self.pending) >= self.size:
+            return False
+        self.pending.append(command)
+        return True
+
+    def execute(self, game, budget=None):
+        """
+        Execute the commands waiting, each one followed by the ticks it costs, until one has to wait: the ticks of
+        the previous one are not all advanced, or a multi-turn action is in progress (only a StopActivity is then
+        executed).
+        :param game: the game
+        :param budget: the time allowed, in seconds, None for no limit
+        """
+        deadline = None if budget is None else time.perf_counter() + budget
+        while self.pending and game.playing and not game.ticker.busy:
+            command = self.pending[0]
+            if game.player.activity is not None and not isinstance(command, StopActivity):
+                break
+            self.pending.popleft()
+            tick = game.ticker.ticks
+            if command.execute(game) is not False:
+                self.log.append([tick, command.name, list(command.args)])
+            if deadline is None:
+                game.ticker.advance_ticks()
+            else:
+                game.ticker.advance_ticks(budget=max(0, deadline - time.perf_counter()))
+                if time.perf_counter() > deadline:
+                    break
+
+    def save_log(self, filename, game_seed):
+        with open(filename, "w") as f:
+            json.dump({"game_seed": game_seed, "commands": self.log}, f, indent=1)
+        print("Commands written to {}".format(filename))
+
+    def replay(self, filename):
+        """
+        Put the commands of a log in the queue (whatever its size)
+        :param filename: the log file (see save_log)
+        :return: the seed of the game logged
+        """
+        with open(filename) as f:
+            data = json.load(f)
+        for (tick, name, args) in data["commands"]:
+            self.pending.append(COMMANDS[name](*args))
+        print("Replaying {} commands from {}".format(len(data["commands"]), filename))
+        return data["game_seed"]
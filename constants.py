@@ -81,6 +81,8 @@ P_CAT_ENV = "environment"
 # Sub
 AC_ENV_MOVE = "move"  # Used for quest purpose, and also to heal
 AC_ENV_OPEN = "open"  # Door
+AC_ENV_REST = "rest"
+AC_ENV_INTERRUPT = "interrupt"  # An action over several turns was stopped: "activity" and "reason" are given
 AC_QUEST = "quest"
 
 # QUESTS STATES
@@ -93,3 +95,14 @@ QUEST_FINISHED = "quest_finished"
 NOT_IDENTIFIED_NAME = "not_identified_name"
 NOT_IDENTIFIED_DESC = "not_identified_description"
 IDENTIFICATION_MODIFIER = "identification_modifier"
+
+# Persistence - kind of entity records in the save games
+SAVE_KIND_PLAYER = "player"
+SAVE_KIND_MONSTER = "monster"
+SAVE_KIND_REMAINS = "remains"
+SAVE_KIND_NPC = "npc"
+SAVE_KIND_DOOR = "door"
+SAVE_KIND_STAIRS = "stairs"
+SAVE_KIND_OPENABLE = "openable"
+SAVE_KIND_ITEM = "item"
+SAVE_KIND_EQUIPMENT = "equipment"
@@ -7,6 +7,7 @@ from ai import AIEntity, FollowingAIEntity
 from tilemap import FieldOfView
 from os import path
 from utilities import TemporaryAction
+from utilities_ui import FontManager
 
 import pygame
 import random as rd
@@ -55,6 +56,7 @@ class Entity(Sprite):
 
         self.groups = groups
         self.image_ref = image_ref
+        self.template = None  # (template key, seed) when built by a factory
 
         self.image = None
         self.animated = False
@@ -150,9 +152,9 @@ class Entity(Sprite):
         if self.distance_to(other_entity) > self.vision:
             return False
 
-        vision_matrix = FieldOfView(self.game).get_vision_matrix_for(
+        visible_tiles = FieldOfView(self.game).get_visible_tiles_for(
             self, radius=self.vision, ignore_entity_at=[self.pos])
-        return vision_matrix[other_entity.x][other_entity.y]
+        return other_entity.pos in visible_tiles
 
     def distance_to(self, other):
         # return the distance to another object
@@ -371,8 +373,7 @@ class SpecialVisualTextEffect(Entity):
     Small text, attached to an entity, display damage...
     """
     def __init__(self, game, pos, text, seconds=2, color=WHITE, rel_pos="MIDTOP"):
-        self.font = pygame.font.Font(path.join(path.join(path.dirname(__file__), FONT_FOLDER), FONT_NAME), 10)
-        image = self.font.render(text, 1, color)
+        image = FontManager.render(text, 10, color)
         Entity.__init__(self, game, "Effect", pos, image, groups=game.player_plus1_sprite_group)
         now = pygame.time.get_ticks()
         self.end = now + 1000 * seconds
@@ -458,7 +459,7 @@ class StairHelper(Entity):
     """
     Class used to create a STair
     """
-    def __init__(self, game, pos, image_ref, use_function=None, name=None):
+    def __init__(self, game, pos, image_ref, use_function=None, name=None, going_up=False):
         """
         Initialization method
         :param game: reference to the game variable
@@ -466,25 +467,33 @@ class StairHelper(Entity):
         :param image_ref: the reference for the images
         :param use_function: the function to be used when open the door if any
         Sample: use_function=lambda player=self.player: StairHelper.next_lever(player)
+        :param going_up: True for a stair to the previous level
         """
+        self.going_up = going_up
 
         if name is None:
-            name = "Stair to next level"
+            name = "Stair to previous level" if going_up else "Stair to next level"
 
         if use_function is None:
-            use_function = StairHelper.next_level
+            use_function = StairHelper.previous_level if going_up else StairHelper.next_level
 
         Entity.__init__(self, game, name, pos, image_ref, blocks=True,
                         actionable=ActionableEntity(function=use_function))
 
     @staticmethod
     def next_level(bus, stair, entity_that_actioned):
-        stair.game.textbox.add = "The stair {} has been used by {}".format(stair.name, entity_that_actioned.name)
+        print("The stair {} has been used by {}".format(stair.name, entity_that_actioned.name))
         stair.game.go_next_level()
         return True
 
+    @staticmethod
+    def previous_level(bus, stair, entity_that_actioned):
+        print("The stair {} has been used by {}".format(stair.name, entity_that_actioned.name))
+        stair.game.go_previous_level()
+        return True
+
     def __str__(self):
-        return "Stairs {} to next level".format(self.name)
+        return "Stairs {} to {} level".format(self.name, "previous" if self.going_up else "next")
 
 
 class OpenableObjectHelper(Entity):
@@ -734,69 +743,98 @@ class MonsterFactory:
                 return value
         return 0
 
-    def build_list(self, number_monster):
+    def plan_list(self, number_monster):
+        """
+        Choose the monsters and their positions, without creating them
+        :param number_monster: the number of monsters
+        :return: a list of (monster template, position, seed), see instantiate_monster
+        """
         pos_list = self.game.map.get_all_available_tiles(c.T_FLOOR, self.game.objects, without_objects=True)
         assert number_monster < len(pos_list), \
             "Number of monster generated {} must be greater than available positions {}".format(number_monster,
                                                                                                 len(pos_list))
 
         print("Total number of monsters requested: {}".format(number_monster))
+        plan = []
         for i in range(number_monster):
             monster = MonsterFactory.random_choice(self.monster_chances)
-            MonsterFactory.instantiate_monster(self.game, monster, pos_list.pop())
+            plan.append((monster, pos_list.pop(), rd.getrandbits(32)))
+        return plan
+
+    def build_list(self, number_monster):
+        for monster, pos, seed in self.plan_list(number_monster):
+            MonsterFactory.instantiate_monster(self.game, monster, pos, seed=seed)
+
+    @staticmethod
+    def instantiate_monster(game, monster, pos, seed=None):
+        """
+        Create a monster from its template. All the random characteristics are drawn from the seed, so the same
+        monster can be rebuilt from (monster, seed) - this is what is stored in the save games.
+        :param game: reference to the game
+        :param monster: the monster template key
+        :param pos: the position
+        :param seed: the seed for the random characteristics, drawn if not given
+        :return: the monster entity
+        """
+        if seed is None:
+            seed = rd.getrandbits(32)
+        new_monster = ut.call_with_seed(seed, MonsterFactory._build_monster, game, monster, pos)
+        if new_monster is not None:
+            new_monster.template = (monster, seed)
+        return new_monster
 
     @staticmethod
-    def instantiate_monster(game, monster, pos):
+    def _build_monster(game, monster, pos):
         if monster == "GIANT_ANT":
-            MonsterHelper(game, "Giant Ant", pos, 'GIANT_ANT',
-                          armor=16,
-                          hit_dice=(3, 8, 0),
-                          attacks=[("bite", (1, 6, 3))],
-                          morale=12,
-                          saving_throw=16,
-                          vision=2,
-                          speed=8,
-                          monster_type=monster)
+            return MonsterHelper(game, "Giant Ant", pos, 'GIANT_ANT',
+                                 armor=16,
+                                 hit_dice=(3, 8, 0),
+                                 attacks=[("bite", (1, 6, 3))],
+                                 morale=12,
+                                 saving_throw=16,
+                                 vision=2,
+                                 speed=8,
+                                 monster_type=monster)
         elif monster == "BABOON":
-            MonsterHelper(game, "Baboon", pos, 'BABOON',
-                          armor=12, hit_dice=(1, 8, 0),
-                          attacks=[("bite", (1, 4, 1))],
-                          morale=6, saving_throw=18,
-                          vision=3, speed=7, monster_type=monster)
+            return MonsterHelper(game, "Baboon", pos, 'BABOON',
+                                 armor=12, hit_dice=(1, 8, 0),
+                                 attacks=[("bite", (1, 4, 1))],
+                                 morale=6, saving_throw=18,
+                                 vision=3, speed=7, monster_type=monster)
         elif monster == "BADGER":
-            MonsterHelper(game, "Badger", pos, 'BADGER', armor=15, hit_dice=(1, 8, 0),
-                          attacks=[("bite", (1, 3, 1)), ("claws", (1, 2, 1))],
-                          morale=7, saving_throw=18, vision=2, speed=10, monster_type=monster)
+            return MonsterHelper(game, "Badger", pos, 'BADGER', armor=15, hit_dice=(1, 8, 0),
+                                 attacks=[("bite", (1, 3, 1)), ("claws", (1, 2, 1))],
+                                 morale=7, saving_throw=18, vision=2, speed=10, monster_type=monster)
         elif monster == "BAT":
-            MonsterHelper(game, "Bat", pos, 'BAT', armor=10, hit_dice=(1, 4, 0),
-                          attacks=[("bite", (1, 2, 1))],
-                          morale=6, saving_throw=19, vision=3, speed=6, monster_type=monster)
+            return MonsterHelper(game, "Bat", pos, 'BAT', armor=10, hit_dice=(1, 4, 0),
+                                 attacks=[("bite", (1, 2, 1))],
+                                 morale=6, saving_throw=19, vision=3, speed=6, monster_type=monster)
         elif monster == "GREY_RAT":
-            MonsterHelper(game, "Giant poisounous rat", pos, 'GREY_RAT', armor=12, hit_dice=(1, 8, 0),
-                          attacks=[("bite", (1, 3, 1))],
-                          morale=8, saving_throw=18, vision=3, speed=8, monster_type=monster, special=[
-                    lambda player=game.player: MonsterSpecials.poison_player(player, 5)])
+            return MonsterHelper(game, "Giant poisounous rat", pos, 'GREY_RAT', armor=12, hit_dice=(1, 8, 0),
+                                 attacks=[("bite", (1, 3, 1))],
+                                 morale=8, saving_throw=18, vision=3, speed=8, monster_type=monster, special=[
+                           lambda player=game.player: MonsterSpecials.poison_player(player, 5)])
         elif monster == "BROWN_RAT":
-            MonsterHelper(game, "Giant super poisonous rat", pos, 'BROWN_RAT', armor=12, hit_dice=(1, 8, 0),
-                          attacks=[("bite", (1, 3, 1))],
-                          morale=8, saving_throw=18, vision=3, speed=8, monster_type=monster, special=[
-                    lambda player=game.player: MonsterSpecials.poison_player(player, 20)])
+            return MonsterHelper(game, "Giant super poisonous rat", pos, 'BROWN_RAT', armor=12, hit_dice=(1, 8, 0),
+                                 attacks=[("bite", (1, 3, 1))],
+                                 morale=8, saving_throw=18, vision=3, speed=8, monster_type=monster, special=[
+                           lambda player=game.player: MonsterSpecials.poison_player(player, 20)])
         elif monster == "DOG":
-            MonsterHelper(game, "Dog", pos, 'DOG', armor=11, hit_dice=(1, 8, 0),
-                          attacks=[("bite", (1, 4, 1))],
-                          morale=7, saving_throw=18, vision=5, speed=9, monster_type=monster)
+            return MonsterHelper(game, "Dog", pos, 'DOG', armor=11, hit_dice=(1, 8, 0),
+                                 attacks=[("bite", (1, 4, 1))],
+                                 morale=7, saving_throw=18, vision=5, speed=9, monster_type=monster)
         elif monster == "SKELETON":
-            MonsterHelper(game, "Skeleton", pos, 'SKELETON', armor=12, hit_dice=(1, 8, 0),
-                          attacks=[rd.choice([("club", (1, 6, 1)), ("rapier", (1, 6, 1))])],
-                          morale=12, saving_throw=18, vision=4, speed=10, monster_type=monster)
+            return MonsterHelper(game, "Skeleton", pos, 'SKELETON', armor=12, hit_dice=(1, 8, 0),
+                                 attacks=[rd.choice([("club", (1, 6, 1)), ("rapier", (1, 6, 1))])],
+                                 morale=12, saving_throw=18, vision=4, speed=10, monster_type=monster)
         elif monster == "SKELETON_WARRIOR":
-            MonsterHelper(game, "Skeleton guardian", pos, 'SKELETON_WARRIOR', armor=12, hit_dice=(1, 8, 0),
-                          attacks=[rd.choice([("longsword", (1, 8, 2)), ("scimitar", (1, 6, 3))])],
-                          morale=12, saving_throw=18, vision=4, speed=10, monster_type=monster)
+            return MonsterHelper(game, "Skeleton guardian", pos, 'SKELETON_WARRIOR', armor=12, hit_dice=(1, 8, 0),
+                                 attacks=[rd.choice([("longsword", (1, 8, 2)), ("scimitar", (1, 6, 3))])],
+                                 morale=12, saving_throw=18, vision=4, speed=10, monster_type=monster)
         elif monster == "VAMPIRE_SLAVE":
-            MonsterHelper(game, "Vampire Underling", pos, 'VAMPIRE', armor=17, hit_dice=(9, 8, 0),
-                          attacks=[("bite", (1, 6, 9))],
-                          morale=8, saving_throw=11, vision=2, speed=20, monster_type=monster)
+            return MonsterHelper(game, "Vampire Underling", pos, 'VAMPIRE', armor=17, hit_dice=(9, 8, 0),
+                                 attacks=[("bite", (1, 6, 9))],
+                                 morale=8, saving_throw=11, vision=2, speed=20, monster_type=monster)
 
 
 class MonsterSpecials:
@@ -239,7 +239,12 @@ class ItemFactory:
                 return value
         return 0
 
-    def build_list(self, number_item):
+    def plan_list(self, number_item):
+        """
+        Choose the items and their positions, without creating them
+        :param number_item: the number of items
+        :return: a list of (item template, position, seed), see instantiate_item
+        """
         pos_list = self.game.map.get_all_available_isolated_tiles(c.T_FLOOR, self.game.objects,
                                                                   without_objects=True,
                                                                   surrounded=7,
@@ -249,24 +254,48 @@ class ItemFactory:
                                                                                              len(pos_list))
 
         print("Total number of item requested: {}".format(number_item))
+        plan = []
         for i in range(number_item):
             item = ItemFactory.random_choice(self.item_chances)
-            ItemFactory.instantiate_item(self.game, item, pos_list.pop())
+            plan.append((item, pos_list.pop(), rd.getrandbits(32)))
+        return plan
+
+    def build_list(self, number_item):
+        for item, pos, seed in self.plan_list(number_item):
+            ItemFactory.instantiate_item(self.game, item, pos, seed=seed)
+
+    @staticmethod
+    def instantiate_item(game, item, pos, seed=None):
+        """
+        Create an item from its template. All the random characteristics are drawn from the seed, so the same
+        item can be rebuilt from (item, seed) - this is what is stored in the save games.
+        :param game: reference to the game
+        :param item: the item template key
+        :param pos: the position
+        :param seed: the seed for the random characteristics, drawn if not given
+        :return: the item entity
+        """
+        if seed is None:
+            seed = rd.getrandbits(32)
+        new_item = ut.call_with_seed(seed, ItemFactory._build_item, game, item, pos)
+        if new_item is not None:
+            new_item.template = (item, seed)
+        return new_item
 
     @staticmethod
-    def instantiate_item(game, item, pos):
+    def _build_item(game, item, pos):
         if item == "CHEST_GOLD":
-            entities.OpenableObjectHelper(game, pos, "CHEST_CLOSED", "CHEST_OPEN_GOLD", name="Chest",
-                                          use_function=entities.OpenableObjectHelper.manipulate_treasure)
+            return entities.OpenableObjectHelper(game, pos, "CHEST_CLOSED", "CHEST_OPEN_GOLD", name="Chest",
+                                                 use_function=entities.OpenableObjectHelper.manipulate_treasure)
         elif item == "CHEST_TRAP":
-            entities.OpenableObjectHelper(game, pos, "CHEST_CLOSED", "CHEST_OPEN_TRAP", name="Chest",
-                                          use_function=entities.OpenableObjectHelper.manipulate_trap)
+            return entities.OpenableObjectHelper(game, pos, "CHEST_CLOSED", "CHEST_OPEN_TRAP", name="Chest",
+                                                 use_function=entities.OpenableObjectHelper.manipulate_trap)
         elif item == "CHEST_EMPTY":
-            entities.OpenableObjectHelper(game, pos, "CHEST_CLOSED", "CHEST_OPEN_EMPTY", name="Chest",
-                                          use_function=entities.OpenableObjectHelper.manipulate_empty)
+            return entities.OpenableObjectHelper(game, pos, "CHEST_CLOSED", "CHEST_OPEN_EMPTY", name="Chest",
+                                                 use_function=entities.OpenableObjectHelper.manipulate_empty)
         elif item == "COFFIN":
-            entities.OpenableObjectHelper(game, pos, "COFFIN_CLOSED", "COFFIN_OPEN", name="Chest",
-                                          use_function=entities.OpenableObjectHelper.manipulate_vampire)
+            return entities.OpenableObjectHelper(game, pos, "COFFIN_CLOSED", "COFFIN_OPEN", name="Chest",
+                                                 use_function=entities.OpenableObjectHelper.manipulate_vampire)
         #  ************ POTION ***********
         elif "POTION" in item:
             # Potions: 70% chance 1 dose, otherwise 1d6 dose
@@ -281,101 +310,102 @@ class ItemFactory:
                 if ut.roll(100) < st.POTION_DECAYING_CHANCE:
                     # Potion has decayed
                     if ut.roll(100) < st.POTION_POISON_CHANCE:
-                        ItemHelper(game, "poison", pos, "POTION_R_S",
-                                   use_function=lambda player=game.player, value=rd.randint(3, 8):
-                                   ItemHelper.cast_heal(player, heal_amount=-0.25, expression="PERCENTAGE"),
-                                   long_desc="would cost you your life...",
-                                   number_use=1,
-                                   identification={c.NOT_IDENTIFIED_NAME: "potion",
-                                                   c.NOT_IDENTIFIED_DESC: "reddish liquid",
-                                                   c.IDENTIFICATION_MODIFIER: -2})
+                        return ItemHelper(game, "poison", pos, "POTION_R_S",
+                                          use_function=lambda player=game.player, value=rd.randint(3, 8):
+                                          ItemHelper.cast_heal(player, heal_amount=-0.25, expression="PERCENTAGE"),
+                                          long_desc="would cost you your life...",
+                                          number_use=1,
+                                          identification={c.NOT_IDENTIFIED_NAME: "potion",
+                                                          c.NOT_IDENTIFIED_DESC: "reddish liquid",
+                                                          c.IDENTIFICATION_MODIFIER: -2})
                     else:
-                        ItemHelper(game, "potion of delusion", pos, "POTION_R_S",
-                                   use_function=lambda player=game.player, value=rd.randint(3, 8):
-                                   ItemHelper.cast_heal(player, heal_amount=0),
-                                   long_desc="taste like the regular, but does nothing",
-                                   number_use=1,
-                                   identification={c.NOT_IDENTIFIED_NAME: "potion",
-                                                   c.NOT_IDENTIFIED_DESC: "reddish liquid",
-                                                   c.IDENTIFICATION_MODIFIER: -2})
+                        return ItemHelper(game, "potion of delusion", pos, "POTION_R_S",
+                                          use_function=lambda player=game.player, value=rd.randint(3, 8):
+                                          ItemHelper.cast_heal(player, heal_amount=0),
+                                          long_desc="taste like the regular, but does nothing",
+                                          number_use=1,
+                                          identification={c.NOT_IDENTIFIED_NAME: "potion",
+                                                          c.NOT_IDENTIFIED_DESC: "reddish liquid",
+                                                          c.IDENTIFICATION_MODIFIER: -2})
                 else:
-                    ItemHelper(game, "small healing potion", pos, "POTION_R_S",
-                               use_function=lambda player=game.player, value=rd.randint(3, 8):
-                               ItemHelper.cast_heal(player, heal_amount=value),
-                               long_desc=long_desc,
-                               number_use=dose,
-                               identification={c.NOT_IDENTIFIED_NAME: "potion",
-                                               c.NOT_IDENTIFIED_DESC: "reddish liquid",
-                                               c.IDENTIFICATION_MODIFIER: -2})
+                    return ItemHelper(game, "small healing potion", pos, "POTION_R_S",
+                                      use_function=lambda player=game.player, value=rd.randint(3, 8):
+                                      ItemHelper.cast_heal(player, heal_amount=value),
+                                      long_desc=long_desc,
+                                      number_use=dose,
+                                      identification={c.NOT_IDENTIFIED_NAME: "potion",
+                                                      c.NOT_IDENTIFIED_DESC: "reddish liquid",
+                                                      c.IDENTIFICATION_MODIFIER: -2})
             elif item == "HEALING_POTION_N":
                 if ut.roll(100) < st.POTION_DECAYING_CHANCE:
                     # Potion has decayed
                     if ut.roll(100) < st.POTION_POISON_CHANCE:
-                        ItemHelper(game, "Poison", pos, "POTION_R_S",
-                                   use_function=lambda player=game.player:
-                                   ItemHelper.cast_heal(player, heal_amount=-0.45, expression="PERCENTAGE"),
-                                   long_desc="Would cost you your life...",
-                                   number_use=1,
-                                   identification={c.NOT_IDENTIFIED_NAME: "potion",
-                                                   c.NOT_IDENTIFIED_DESC: "large quantity of reddish liquid",
-                                                   c.IDENTIFICATION_MODIFIER: 1})
+                        return ItemHelper(game, "Poison", pos, "POTION_R_S",
+                                          use_function=lambda player=game.player:
+                                          ItemHelper.cast_heal(player, heal_amount=-0.45, expression="PERCENTAGE"),
+                                          long_desc="Would cost you your life...",
+                                          number_use=1,
+                                          identification={c.NOT_IDENTIFIED_NAME: "potion",
+                                                          c.NOT_IDENTIFIED_DESC: "large quantity of reddish liquid",
+                                                          c.IDENTIFICATION_MODIFIER: 1})
                     else:
-                        ItemHelper(game, "Potion of delusion", pos, "POTION_R_S",
-                                   use_function=lambda player=game.player:
-                                   ItemHelper.cast_heal(player, heal_amount=0),
-                                   long_desc="Taste like the regular, but does nothing",
-                                   number_use=1,
-                                   identification={c.NOT_IDENTIFIED_NAME: "potion",
-                                                   c.NOT_IDENTIFIED_DESC: "large quantity of reddish liquid",
-                                                   c.IDENTIFICATION_MODIFIER: 1})
+                        return ItemHelper(game, "Potion of delusion", pos, "POTION_R_S",
+                                          use_function=lambda player=game.player:
+                                          ItemHelper.cast_heal(player, heal_amount=0),
+                                          long_desc="Taste like the regular, but does nothing",
+                                          number_use=1,
+                                          identification={c.NOT_IDENTIFIED_NAME: "potion",
+                                                          c.NOT_IDENTIFIED_DESC: "large quantity of reddish liquid",
+                                                          c.IDENTIFICATION_MODIFIER: 1})
                 else:
-                    ItemHelper(game, "Healing Potion", pos, "POTION_R_N",
-                               use_function=lambda player=game.player, value=rd.randint(5, 11):
-                               ItemHelper.cast_heal(player, heal_amount=value),
-                               long_desc="better for your health in large than in small",
-                               number_use=dose,
-                               identification={c.NOT_IDENTIFIED_NAME: "potion",
-                                               c.NOT_IDENTIFIED_DESC: "large quantity of reddish liquid",
-                                               c.IDENTIFICATION_MODIFIER: 1})
+                    return ItemHelper(game, "Healing Potion", pos, "POTION_R_N",
+                                      use_function=lambda player=game.player, value=rd.randint(5, 11):
+                                      ItemHelper.cast_heal(player, heal_amount=value),
+                                      long_desc="better for your health in large than in small",
+                                      number_use=dose,
+                                      identification={c.NOT_IDENTIFIED_NAME: "potion",
+                                                      c.NOT_IDENTIFIED_DESC: "large quantity of reddish liquid",
+                                                      c.IDENTIFICATION_MODIFIER: 1})
             elif item == "HEALING_POTION_L":
                 if ut.roll(100) < st.POTION_DECAYING_CHANCE:
                     # Potion has decayed
                     if ut.roll(100) < st.POTION_POISON_CHANCE:
-                        ItemHelper(game, "Poison", pos, "POTION_R_S",
-                                   use_function=lambda player=game.player:
-                                   ItemHelper.cast_heal(player, heal_amount=-0.6, expression="PERCENTAGE"),
-                                   long_desc="Would cost you your life...",
-                                   number_use=1,
-                                   identification={c.NOT_IDENTIFIED_NAME: "potion",
-                                                   c.NOT_IDENTIFIED_DESC: "slightly red",
-                                                   c.IDENTIFICATION_MODIFIER: 2})
+                        return ItemHelper(game, "Poison", pos, "POTION_R_S",
+                                          use_function=lambda player=game.player:
+                                          ItemHelper.cast_heal(player, heal_amount=-0.6, expression="PERCENTAGE"),
+                                          long_desc="Would cost you your life...",
+                                          number_use=1,
+                                          identification={c.NOT_IDENTIFIED_NAME: "potion",
+                                                          c.NOT_IDENTIFIED_DESC: "slightly red",
+                                                          c.IDENTIFICATION_MODIFIER: 2})
                     else:
-                        ItemHelper(game, "Potion of delusion", pos, "POTION_R_S",
-                                   use_function=lambda player=game.player:
-                                   ItemHelper.cast_heal(player, heal_amount=0),
-                                   long_desc="Taste like the regular, but does nothing",
-                                   number_use=1,
-                                   identification={c.NOT_IDENTIFIED_NAME: "potion",
-                                                   c.NOT_IDENTIFIED_DESC: "slightly red",
-                                                   c.IDENTIFICATION_MODIFIER: 2})
+                        return ItemHelper(game, "Potion of delusion", pos, "POTION_R_S",
+                                          use_function=lambda player=game.player:
+                                          ItemHelper.cast_heal(player, heal_amount=0),
+                                          long_desc="Taste like the regular, but does nothing",
+                                          number_use=1,
+                                          identification={c.NOT_IDENTIFIED_NAME: "potion",
+                                                          c.NOT_IDENTIFIED_DESC: "slightly red",
+                                                          c.IDENTIFICATION_MODIFIER: 2})
                 else:
-                    ItemHelper(game, "Large Healing Potion", pos, "POTION_R_L",
-                               use_function=lambda player=game.player, value=rd.randint(6, 14):
-                               ItemHelper.cast_heal(player, heal_amount=value),
-                               long_desc="the best money can buy, don't waste it",
-                               number_use=dose,
-                               identification={c.NOT_IDENTIFIED_NAME: "potion",
-                                               c.NOT_IDENTIFIED_DESC: "slightly red",
-                                               c.IDENTIFICATION_MODIFIER: 3})
+                    return ItemHelper(game, "Large Healing Potion", pos, "POTION_R_L",
+                                      use_function=lambda player=game.player, value=rd.randint(6, 14):
+                                      ItemHelper.cast_heal(player, heal_amount=value),
+                                      long_desc="the best money can buy, don't waste it",
+                                      number_use=dose,
+                                      identification={c.NOT_IDENTIFIED_NAME: "potion",
+                                                      c.NOT_IDENTIFIED_DESC: "slightly red",
+                                                      c.IDENTIFICATION_MODIFIER: 3})
         # Equipments
         elif item == "BASIC_SWORD":
-            EquipmentHelper(game, "Basic Sword", pos, "SWORD", slot=c.SLOT_HAND_RIGHT, modifiers={c.BONUS_STR: 2})
+            return EquipmentHelper(game, "Basic Sword", pos, "SWORD", slot=c.SLOT_HAND_RIGHT,
+                                   modifiers={c.BONUS_STR: 2})
         elif item == "BASIC_HELMET":
-            EquipmentHelper(game, "Basic Helmet", pos, "HELMET", slot=c.SLOT_HEAD, modifiers={c.BONUS_STR: -1})
+            return EquipmentHelper(game, "Basic Helmet", pos, "HELMET", slot=c.SLOT_HEAD, modifiers={c.BONUS_STR: -1})
         elif item == "BASIC_CAPE":
-            EquipmentHelper(game, "Cape", pos, "CAPE", slot=c.SLOT_CAPE, modifiers={c.BONUS_STR: 2})
+            return EquipmentHelper(game, "Cape", pos, "CAPE", slot=c.SLOT_CAPE, modifiers={c.BONUS_STR: 2})
         elif item == "BASIC_RING":
-            EquipmentHelper(game, "Ring", pos, "RING", slot=c.SLOT_RING, modifiers={c.BONUS_STR: -1})
+            return EquipmentHelper(game, "Ring", pos, "RING", slot=c.SLOT_RING, modifiers={c.BONUS_STR: -1})
 
 
 class EquipmentHelper(entities.Entity):
@@ -0,0 +1,306 @@
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import constants as c
+import utilities as ut
+from settings import *
+
+from entities import MonsterFactory
+from item import ItemFactory
+from tilemap import MapFactory, ChunkedCaveMap
+
+"""
+Generation of the levels.
+Generating a level (map, doors, stairs, items and monsters positions) does not need any graphics, so it can be done
+ahead of time in another process while the current level is played. The result is a "plan" made of plain data:
+{"level": level number,
+ "seed": level seed,
+ "map": the map bytes (see Map.to_bytes),
+ "doors": [positions], "stairs": [positions], "player": position,
+ "stairs_up": position of the stair to the previous level (None on the first level),
+ "items": [(template, position, seed)], "monsters": [(template, position, seed)]}
+The game then only has to create the entities (see Game.materialize_level).
+On a ChunkedCaveMap, each chunk gets its own share of the items and monsters (see plan_chunk): the plan holds the ones
+of the chunks generated with it, the other chunks get theirs when the player explores them.
+"""
+
+
+def level_seed(game_seed, level):
+    """
+    The seed of a level is derived from the seed of the game, so a game can be replayed
+    :param game_seed: the seed of the game
+    :param level: the level number
+    :return: the seed for the level
+    """
+    return random.Random("{}-{}".format(game_seed, level)).getrandbits(32)
+
+
+def resource_shape(graphical_resources):
+    """
+    The map generation only needs to know how many variants of each resources exist.
+    This builds a light copy of the resources (without any image) that can be sent to another process.
+    :param graphical_resources: the images of the game
+    :return: a dictionary, with the lists replaced by lists of None
+    """
+    shape = {}
+    for key, value in graphical_resources.items():
+        if type(value) is list:
+            shape[key] = [None] * len(value)
+    return shape
+
+
+class _Placeholder:
+    """
+    Stand for an entity during the planning: only the position is used
+    """
+    def __init__(self, pos):
+        (self.x, self.y) = pos
+
+
+class _LevelDraft:
+    """
+    Stand for the game during the planning: the factories only need the level, the map and the objects positions
+    """
+    def __init__(self, level, level_map):
+        self.level = level
+        self.map = level_map
+        self.objects = []
+
+    def occupy(self, pos_list):
+        for pos in pos_list:
+            self.objects.append(_Placeholder(pos))
+
+
+def plan_doors_stairs(level_map, objects, level):
+    """
+    Choose the doors and stairs positions
+    :param level_map: the map
+    :param objects: the objects already on the map
+    :param level: the level number
+    :return: (doors positions, stairs positions)
+    """
+    # place doors - except if we are in a pure maze
+    doors = level_map.doors_pos[:]
+
+    # Place stairs - Here we may have multiple.
+    stairs = []
+    stairs_to_be_placed = 10 - level
+    if isinstance(level_map, ChunkedCaveMap):
+        return doors, plan_far_stairs(level_map, objects, stairs_to_be_placed)
+    stair_pos = level_map.get_all_available_isolated_tiles(c.T_FLOOR, objects, without_objects=False)
+    if len(stair_pos) > stairs_to_be_placed:
+        for i in range(stairs_to_be_placed):
+            stairs.append(stair_pos.pop())
+    else:
+        # Most probably we have far too many corridors - Maze like dungeon...
+        print("Not found convenient way to place stairs - using second method")
+        all_pos = level_map.get_all_available_tiles(c.T_FLOOR, objects + [_Placeholder(pos) for pos in doors],
+                                                    without_objects=True)
+        for i in range(stairs_to_be_placed):
+            stairs.append(all_pos.pop())
+    return doors, stairs
+
+
+def plan_far_stairs(level_map, objects, number):
+    """
+    Choose the stairs positions of a ChunkedCaveMap: in random chunks away from the ones generated with the map (the
+    start area), generated now, so that the player has to explore to find them
+    :param level_map: the map
+    :param objects: the objects already on the map
+    :param number: the number of stairs
+    :return: stairs positions
+    """
+    # The start area, and as much around it
+    gap = ChunkedCaveMap.START_CHUNKS
+    min_x = min(chunk_x for (chunk_x, chunk_y) in level_map.tiles.chunks) - gap
+    min_y = min(chunk_y for (chunk_x, chunk_y) in level_map.tiles.chunks) - gap
+    max_x = max(chunk_x for (chunk_x, chunk_y) in level_map.tiles.chunks) + gap
+    max_y = max(chunk_y for (chunk_x, chunk_y) in level_map.tiles.chunks) + gap
+    (chunks_x, chunks_y) = level_map.chunk_number()
+    assert min_x > 0 or min_y > 0 or max_x < chunks_x - 1 or max_y < chunks_y - 1, \
+        "The map must be larger than its start area"
+    stairs = []
+    while len(stairs) < number:
+        chunk = (random.randrange(chunks_x), random.randrange(chunks_y))
+        if min_x <= chunk[0] <= max_x and min_y <= chunk[1] <= max_y:
+            continue
+        with level_map.spawning_in([chunk]):
+            stair_pos = level_map.get_all_available_isolated_tiles(c.T_FLOOR,
+                                                                   objects + [_Placeholder(pos) for pos in stairs],
+                                                                   without_objects=True, max=1)
+        if stair_pos:
+            stairs.append(stair_pos[0])
+    return stairs
+
+
+def _chunk_share(number, fraction):
+    """
+    :return: the number of entities of a part of the level: the fraction of the number, rounded up or down at random
+    """
+    share = number * fraction
+    return int(share) + (1 if random.random() < share - int(share) else 0)
+
+
+def plan_chunk(level, level_seed, level_map, chunk, objects, number_item, number_monster):
+    """
+    Choose the items and monsters of a chunk of a ChunkedCaveMap: its share of the ones of the level, in proportion of
+    its size. The choice only depends on the level seed and the chunk (and on the objects already there).
+    :param level: the level number
+    :param level_seed: the level seed
+    :param level_map: the map
+    :param chunk: the chunk (chunk x, chunk y)
+    :param objects: the objects already on the map
+    :param number_item: the number of items of the whole level
+    :param number_monster: the number of monsters of the whole level
+    :return: (items, monsters), as in the level plan
+    """
+    seed = random.Random("{}-{}-{}".format(level_seed, chunk[0], chunk[1])).getrandbits(32)
+    return ut.call_with_seed(seed, _plan_chunk, level, seed, level_map, chunk, objects, number_item, number_monster)
+
+
+def _plan_chunk(level, seed, level_map, chunk, objects, number_item, number_monster):
+    draft = _LevelDraft(level, level_map)
+    draft.objects = list(objects)
+    (x_min, y_min, x_max, y_max) = level_map.tiles.chunk_area(chunk[0], chunk[1])
+    fraction = (x_max - x_min) * (y_max - y_min) / (level_map.tile_width * level_map.tile_height)
+    items = []
+    monsters = []
+    with level_map.spawning_in([chunk]):
+        # The factories need more positions than entities: a chunk may have few
+        number_item = _chunk_share(number_item, fraction)
+        if number_item > 0:
+            number_item = min(number_item, len(level_map.get_all_available_isolated_tiles(c.T_FLOOR, draft.objects,
+                                                                                          without_objects=True,
+                                                                                          max=number_item + 1)) - 1)
+        if number_item > 0:
+            items = ItemFactory(draft, seed=seed + 1).plan_list(number_item)
+            draft.occupy([pos for (item, pos, item_seed) in items])
+        number_monster = _chunk_share(number_monster, fraction)
+        if number_monster > 0:
+            number_monster = min(number_monster, len(level_map.get_all_available_tiles(c.T_FLOOR, draft.objects,
+                                                                                       without_objects=True)) - 1)
+        if number_monster > 0:
+            monsters = MonsterFactory(draft, seed=seed + 2).plan_list(number_monster)
+    return items, monsters
+
+
+def generate_level(level, seed, name, shape, number_item, number_monster):
+    """
+    Generate a level plan. Can be run in another process.
+    :param level: the level number
+    :param seed: the level seed
+    :param name: the map name
+    :param shape: the shape of the graphical resources (see resource_shape)
+    :param number_item: the number of items
+    :param number_monster: the number of monsters
+    :return: the level plan
+    """
+    # The random generator of the game is left as it was (the level may be generated in the game process)
+    return ut.call_with_seed(seed, _generate_level, level, seed, name, shape, number_item, number_monster)
+
+
+def _generate_level(level, seed, name, shape, number_item, number_monster):
+    level_map = MapFactory(name, shape, seed=seed, dimension=MAP_DIMENSION).map
+    draft = _LevelDraft(level, level_map)
+
+    # The map may come from the cache: the random state must not depend on its generation
+    random.seed(seed)
+    # The chunks of a ChunkedCaveMap generated with it: the start area, away from the stairs
+    start_chunks = sorted(level_map.tiles.chunks) if isinstance(level_map, ChunkedCaveMap) else None
+    doors, stairs = plan_doors_stairs(level_map, draft.objects, level)
+    draft.occupy(doors)
+    draft.occupy(stairs)
+
+    if start_chunks is None:
+        all_pos = level_map.get_all_available_tiles(c.T_FLOOR, draft.objects, without_objects=True)
+    else:
+        with level_map.spawning_in(start_chunks):
+            all_pos = level_map.get_all_available_tiles(c.T_FLOOR, draft.objects, without_objects=True)
+    player_pos = all_pos.pop()
+    draft.occupy([player_pos])
+    stairs_up = None
+    if level > 1:
+        # The player arrives next to the stair leading back up
+        stairs_up = level_map.get_close_available_tile(player_pos, c.T_FLOOR, draft.objects)
+        if stairs_up != player_pos:
+            draft.occupy([stairs_up])
+        else:
+            stairs_up = None
+
+    if isinstance(level_map, ChunkedCaveMap):
+        items = []
+        monsters = []
+        for chunk in sorted(level_map.tiles.chunks):
+            (chunk_items, chunk_monsters) = plan_chunk(level, seed, level_map, chunk, draft.objects, number_item,
+                                                       number_monster)
+            items += chunk_items
+            monsters += chunk_monsters
+    else:
+        items = ItemFactory(draft, seed=seed + 1).plan_list(number_item)
+        draft.occupy([pos for (item, pos, item_seed) in items])
+        monsters = MonsterFactory(draft, seed=seed + 2).plan_list(number_monster)
+
+    return {"level": level,
+            "seed": seed,
+            "map": level_map.to_bytes(),
+            "doors": doors,
+            "stairs": stairs,
+            "player": player_pos,
+            "stairs_up": stairs_up,
+            "items": items,
+            "monsters": monsters}
+
+
+class LevelGenerator:
+    """
+    Generate the next levels in a worker process.
+    """
+
+    def __init__(self, graphical_resources):
+        self.shape = resource_shape(graphical_resources)
+        self._executor = None
+        self._pending = {}  # level number -> (seed, future)
+
+    def prepare(self, level, seed, name, number_item, number_monster):
+        """
+        Start generating a level in the background
+        """
+        if level in self._pending:
+            return
+        if self._executor is None:
+            # spawn: the worker must not inherit the pygame state of the game
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        self._pending[level] = (seed, self._executor.submit(generate_level, level, seed, name, self.shape,
+                                                            number_item, number_monster))
+
+    def get(self, level, seed, name, number_item, number_monster):
+        """
+        Return the plan of a level: the one prepared if any (waiting for it if needed), else it is generated now.
+        """
+        plan = None
+        if level in self._pending:
+            prepared_seed, future = self._pending.pop(level)
+            if prepared_seed == seed:
+                try:
+                    plan = future.result()
+                except Exception as e:
+                    print("LEVEL GENERATION FAILED IN BACKGROUND: {}".format(e))
+                    # The worker may be broken: a new one will be started next time
+                    self.shutdown()
+            else:
+                future.cancel()
+        if plan is None:
+            plan = generate_level(level, seed, name, self.shape, number_item, number_monster)
+        return plan
+
+    def cancel(self):
+        for seed, future in self._pending.values():
+            future.cancel()
+        self._pending = {}
+
+    def shutdown(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
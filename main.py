@@ -1,17 +1,22 @@
+import random
 import sys
-from os import path, listdir
+from os import environ, path, listdir
 
-import dill as pick
 import pygame as pg
 
+import commands
 import constants as c
+import levelgen
+import persistence
+import profiler
 
 from entities import MonsterFactory, DoorHelper, StairHelper
 from item import ItemFactory
+from pathfinding import HierarchicalPathfinder
 from player import PlayerHelper
 from settings import *
-from tilemap import MapFactory, Camera, FieldOfView, Minimap
-from utilities import Ticker, Publisher
+from tilemap import Map, ChunkedCaveMap, Camera, FieldOfView, Minimap
+from utilities import Ticker, Publisher, MName
 from utilities_ui import LogBox, build_listing_dawnlike, build_listing_oryx, build_listing_icons
 from screen import CharacterScreen, PlayingScreen, InventoryScreen, MapScreen
 
@@ -27,8 +32,14 @@ class Game:
         self.clock = pg.time.Clock()
         pg.key.set_repeat(500, 100)
         self.playing = True
+        self.pending_event = None  # an event taken from the queue while sleeping (see run), not handled yet
+        self.autosaver = persistence.AutoSaver()
+        self.level_store = persistence.LevelStore()
+        self.profiler = profiler.FrameProfiler()
+        self.turn_profiler = profiler.TurnProfiler()
 
         self.load_data()
+        self.level_generator = levelgen.LevelGenerator(self.all_images)
 
 
     def load_data(self):
@@ -60,24 +71,26 @@ class Game:
         pg.mixer.music.pause()
         self.music_playing = False
 
-    def new(self):
-
+    def _init_game_variables(self):
         # Generic Game variables
         self.ticker = Ticker()
+        self.ticker.profiler = self.profiler
+        self.ticker.turn_listeners.append(self.turn_done)
+        if TICKER_STATS:
+            self.ticker.enable_stats(budget=TICKER_TURN_BUDGET)
         self.bus = Publisher()
+        self.commands = commands.CommandQueue()
+        if PUBLISHER_METRICS:
+            self.bus.enable_metrics(report_interval=PUBLISHER_REPORT_INTERVAL)
         self.game_state = c.GAME_STATE_PLAYING
         self.player_took_action = False
         self.minimap_enable = False
         self.objects = []
         self.level = 1
+        self.npc_names = []  # names ready for the next NPCs
+        self.given_names = set()
 
-        # initializing map structure
-        self.map = MapFactory("LordCroket Caves - Level {}".format(self.level), self.all_images).map
-        self.minimap = Minimap(self)
-
-        # Field of view
-        self.fov = FieldOfView(self)
-
+    def _init_sprite_groups(self):
         # We have 5 sprites groups: two below the player, the player one and two above
         # They are drawn in the order below:
         self.player_min2_sprite_group = pg.sprite.Group()
@@ -91,22 +104,7 @@ class Game:
                            self.player_plus1_sprite_group,
                            self.player_plus2_sprite_group]
 
-        # Camera
-        self.camera = Camera(self.map.tile_width * TILESIZE_SCREEN,
-                             self.map.tile_height * TILESIZE_SCREEN)
-
-        self.place_doors_stairs_traps(self.level)
-
-        # Place player
-        all_pos = self.map.get_all_available_tiles(c.T_FLOOR, self.objects, without_objects=True)
-        self.player = PlayerHelper(self, all_pos.pop())
-        self.visible_player_array = self.fov.get_vision_matrix_for(self.player, flag_explored=True)
-
-        # place monsters and items
-        ItemFactory(self).build_list(20) # 220
-        MonsterFactory(self).build_list(120)
-
-        # And we end with the screens...
+    def _init_screens(self):
         self.screens = {
             c.GAME_STATE_INVENTORY: InventoryScreen(self, c.GAME_STATE_PLAYING),
             c.GAME_STATE_MAP: MapScreen(self, c.GAME_STATE_PLAYING),
@@ -114,37 +112,164 @@ class Game:
             c.GAME_STATE_PLAYING: PlayingScreen(self, None)
         }
 
-    def place_doors_stairs_traps(self, level):
+    def new(self):
+
+        self._init_game_variables()
+        self.game_seed = random.getrandbits(32)
+        if environ.get(commands.REPLAY_VARIABLE) is not None:
+            self.game_seed = self.commands.replay(environ[commands.REPLAY_VARIABLE])
+        random.seed(self.game_seed)
+        self._init_sprite_groups()
+        self.level_store.clear()
+
+        # The first level is generated now, the next ones in the background
+        self.materialize_level(self._get_level_plan(self.level))
+
+        # And we end with the screens...
+        self._init_screens()
+        self._prepare_level(self.level + 1)
+
+        if self.turn_profiler.enabled:
+            self.turn_profiler.start(self)
+
+    @staticmethod
+    def _level_parameters(level):
+        """
+        :param level: the level number
+        :return: the map name, the number of items and the number of monsters for the level
         """
-        This will place the basic objects: stairs, stairs and traps
-        :param level: the current level
+        if level == 1:
+            return "LordCroket Caves - Level {}".format(level), 20, 120
+        return "Cave of LordCrocket - Level {}".format(level), 50, 130
+
+    def _prepare_level(self, level):
+        name, number_item, number_monster = self._level_parameters(level)
+        self.level_generator.prepare(level, levelgen.level_seed(self.game_seed, level), name,
+                                     number_item, number_monster)
+
+    def _get_level_plan(self, level):
+        name, number_item, number_monster = self._level_parameters(level)
+        return self.level_generator.get(level, levelgen.level_seed(self.game_seed, level), name,
+                                        number_item, number_monster)
+
+    def materialize_level(self, plan):
+        """
+        Build the level from its plan (see levelgen): map, doors, stairs, items and monsters.
+        The player is created if needed, else moved to its new position.
+        :param plan: the level plan
         :return: nothing
         """
-        # place doors - except if we are in a pure maze
-        pos_list = self.map.doors_pos[:]
-        for pos in pos_list:
+        self.level = plan["level"]
+        self.level_seed = plan["seed"]
+
+        # initializing map structure
+        self.map = Map.from_bytes(plan["map"], self.all_images)
+        self._init_level_view()
+
+        for pos in plan["doors"]:
             DoorHelper(self, pos, ("DOOR_H_CLOSED", "DOOR_H_OPEN", "DOOR_V_CLOSED", "DOOR_V_OPEN"),
-                       name="door".format(pos),
+                       name="door",
                        open_function=DoorHelper.open_door)
+        for pos in plan["stairs"]:
+            StairHelper(self, pos, "STAIRS", name="stairs", use_function=StairHelper.next_level)
+        if plan["stairs_up"] is not None:
+            StairHelper(self, plan["stairs_up"], "STAIRS", name="stairs up", going_up=True)
+        # Traps: TODO
+
+        # Place player
+        self._place_player(plan["player"])
+
+        # place items and monsters
+        self._populate(plan["items"], plan["monsters"])
+
+    def _populate(self, items, monsters):
+        for item, pos, seed in items:
+            ItemFactory.instantiate_item(self, item, pos, seed=seed)
+        for monster, pos, seed in monsters:
+            MonsterFactory.instantiate_monster(self, monster, pos, seed=seed)
+
+    def populate_new_chunks(self):
+        """
+        Give the chunks of a large map generated during the turn their items and monsters (see levelgen.plan_chunk).
+        Done once the turn is over (or before a save), not while the entities are being updated.
+        """
+        if not self.new_chunks:
+            return
+        name, number_item, number_monster = self._level_parameters(self.level)
+        while self.new_chunks:
+            (items, monsters) = levelgen.plan_chunk(self.level, self.level_seed, self.map, self.new_chunks.pop(0),
+                                                    self.objects, number_item, number_monster)
+            self._populate(items, monsters)
+
+    def _init_level_view(self):
+        # The chunks of the map generated from now on are populated at the end of the turn
+        self.new_chunks = []
+        if isinstance(self.map, ChunkedCaveMap):
+            self.map.tiles.chunk_listeners.append(lambda chunk_x, chunk_y: self.new_chunks.append((chunk_x, chunk_y)))
+
+        self.minimap = Minimap(self)
+
+        # Field of view
+        self.fov = FieldOfView(self)
+
+        # Camera
+        self.camera = Camera(self.map.tile_width * TILESIZE_SCREEN,
+                             self.map.tile_height * TILESIZE_SCREEN)
 
-        # Place stairs - Here we may have multiple.
-        stair_pos = self.map.get_all_available_isolated_tiles(c.T_FLOOR, self.objects, without_objects=False)
-        stairs_to_be_placed = 10 - level
-        if len(stair_pos) > stairs_to_be_placed:
-            for i in range(stairs_to_be_placed):
-                StairHelper(self, stair_pos.pop(), "STAIRS", name="stairs".format(i),
-                            use_function=StairHelper.next_level)
+        # Path finding
+        self.pathfinder = HierarchicalPathfinder(self.map)
+
+    def _place_player(self, pos):
+        """
+        Create the player if needed, else move it to its new position
+        """
+        if not hasattr(self, "player") or self.player not in self.objects:
+            self.player = PlayerHelper(self, pos)
         else:
-            # Most probably we have far too many corridors - Maze like dungeon...
-            print("Not found convenient way to place stairs - using second method")
-            all_pos = self.map.get_all_available_tiles(c.T_FLOOR, self.objects, without_objects=True)
-            for i in range(stairs_to_be_placed):
-                StairHelper(self, all_pos.pop(), "STAIRS", name="stairs".format(i),
-                            use_function=StairHelper.next_level)
+            (self.player.x, self.player.y) = pos
+            self.player.invalidate_fog_of_war = True
+            self.player_sprite_group.add(self.player)
+        self.visible_player_tiles = self.fov.get_visible_tiles_for(self.player, flag_explored=True)
 
-        # Traps: TODO
+    def turn_done(self):
+        """
+        Called by the ticker once the ticks of an action are all advanced (the fast forwarded ones included)
+        """
+        self.populate_new_chunks()
+        self.turn_profiler.turn_done(self)
+        # All actions are done: good time for a snapshot
+        self.autosaver.update(self)
+
+    def new_npc_name(self):
+        """
+        :return: a name for a new NPC, different from the ones already given in this game (the player's included)
+        """
+        while not self.npc_names:
+            self.given_names.add(self.player.name)
+            self.npc_names = [name for name in MName.names(NPC_NAME_BATCH) if name not in self.given_names]
+        name = self.npc_names.pop()
+        self.given_names.add(name)
+        return name
 
     def go_next_level(self):
+        self.change_level(self.level + 1)
+
+    def go_previous_level(self):
+        self.change_level(self.level - 1)
+
+    def change_level(self, level):
+        """
+        Leave the current level (kept in the level store) for another one: the stored one if it was already visited,
+        else a new one.
+        :param level: the level number
+        :return: nothing
+        """
+        with self.turn_profiler.level_change(self):
+            self._change_level(level)
+
+    def _change_level(self, level):
+        self.populate_new_chunks()
+        self.level_store.store(self)
 
         # First: cleanup!
         # Warning: we must act on a copy of the list!!!!!
@@ -152,87 +277,86 @@ class Game:
             if entity != self.player:
                 entity.remove_completely_object()
 
-        self.level += 1
+        snapshot = self.level_store.take(level)
+        if snapshot is not None:
+            player_pos = persistence.restore_level(self, snapshot)
+            self._init_level_view()
+            self._place_player(player_pos)
+        else:
+            self.materialize_level(self._get_level_plan(level))
 
-        # initializing map structure
-        self.map = MapFactory("Cave of LordCrocket - Level {}".format(self.level), self.all_images).map
-        self.minimap = Minimap(self)
+        if self.level + 1 not in self.level_store:
+            self._prepare_level(self.level + 1)
 
-        # Field of view
-        self.fov = FieldOfView(self)
+        # Save the new level as soon as possible
+        self.autosaver.save_requested = True
 
-        self.place_doors_stairs_traps(self.level)
+    def save(self, filename=SAVEGAME_FILENAME):
+        self.populate_new_chunks()
+        persistence.save_game(self, filename)
 
-        # Place player
-        all_pos = self.map.get_all_available_tiles(c.T_FLOOR, self.objects, without_objects=True)
-        new_player_pos = all_pos.pop()
-        self.player.x = new_player_pos[0]
-        self.player.y = new_player_pos[1]
-        self.visible_player_array = self.fov.get_vision_matrix_for(self.player, flag_explored=True)
-        self.player.invalidate_fog_of_war = True
-        self.player_sprite_group.add(self.player)
+    def load(self, filename=SAVEGAME_FILENAME):
+        snapshot = persistence.read_snapshot(filename)
 
-        # Camera
-        self.camera = Camera(self.map.tile_width * TILESIZE_SCREEN,
-                             self.map.tile_height * TILESIZE_SCREEN)
-        # place monsters
-        ItemFactory(self).build_list(50)
-        MonsterFactory(self).build_list(130)
-
-
-    def load(self, filename="savegame"):
-        with open(filename, "rb") as f:
-            [self.objects, self.map, player_name, self.all_groups] = pick.load(f)
-            self.map.game = self
-
-            # Generic Game variables
-            self.ticker = Ticker()
-            self.game_state = c.GAME_STATE_PLAYING
-            self.player_took_action = False
-            self.minimap_enable = False
-
-            self.inventory_screen = InventoryScreen(self, c.GAME_STATE_PLAYING)
-            self.map_screen = MapScreen(self, c.GAME_STATE_PLAYING)
-            self.playing_screen = PlayingScreen(self, None)
-            self.character_screen = CharacterScreen(self, c.GAME_STATE_PLAYING)
-
-            # initializing map structure
-            self.minimap = Minimap(self)
-
-            # Field of view
-            self.fov = FieldOfView(self)
-
-            # We have 5 sprites groups: two below the player, the player one and two above
-            # They are drawn in the order below:
-            [self.player_min2_sprite_group,
-             self.player_min1_sprite_group,
-             self.player_sprite_group,
-             self.player_plus1_sprite_group,
-             self.player_plus2_sprite_group] = self.all_groups
-
-            # Camera
-            self.camera = Camera(self.map.width, self.map.height)
-
-            for entities in self.objects:
-                entities.game = self
-                entities.init_graphics()
-                if entities.name == player_name:
-                    self.player = entities
-                    self.visible_player_array = self.fov.get_vision_matrix_for(self.player, flag_explored=True)
-            for entities in self.player.inventory:
-                entities.game = self
-                entities.init_graphics(in_inventory=True)
+        self._init_game_variables()
+        self._init_sprite_groups()
+
+        # Map and all entities
+        persistence.restore_game(self, snapshot)
+        self._init_level_view()
+        self.visible_player_tiles = self.fov.get_visible_tiles_for(self.player, flag_explored=True)
+
+        self._init_screens()
+
+        # The levels left are restored with the game (see restore_game), the ones prepared are of no use
+        self.level_generator.cancel()
+        if self.level + 1 not in self.level_store:
+            self._prepare_level(self.level + 1)
 
     def run(self):
         # game loop - set self.playing = False to end the game
+        # The screen is only drawn when it changed: else the loop sleeps until an event arrives
         clock = pg.time.Clock()
+        drawn_state = None
         while self.playing:
-            self.screens[self.game_state].events()
-            self.screens[self.game_state].update()
-            self.screens[self.game_state].draw()
-            clock.tick(40) #  the program will never run at more than 40 frames per second
+            self.profiler.begin_frame()
+            if self.pending_event is not None or pg.event.peek():
+                self.screens[self.game_state].dirty = True
+            with self.profiler.section("events"):
+                self.screens[self.game_state].events()
+            with self.profiler.section("update"):
+                self.screens[self.game_state].update()
+            screen = self.screens[self.game_state]
+            if self.game_state != drawn_state:
+                screen.invalidate()
+            if screen.needs_redraw():
+                with self.profiler.section("draw"):
+                    screen.draw()
+                screen.dirty = False
+                drawn_state = self.game_state
+                self.profiler.end_frame()  # the idle frames are not kept
+                clock.tick(40) #  the program will never run at more than 40 frames per second
+            else:
+                # Sleep on the event queue. The event received is kept aside, to be handled first by the screen (posting
+                # it again would put it behind the ones received meanwhile)
+                event = pg.event.wait(IDLE_WAIT_MS)
+                if event.type != pg.NOEVENT:
+                    self.pending_event = event
+
+    def get_events(self):
+        """
+        The events to handle, in the order they came: to be used by the screens instead of pg.event.get
+        """
+        events = pg.event.get()
+        if self.pending_event is not None:
+            events.insert(0, self.pending_event)
+            self.pending_event = None
+        return events
 
     def quit(self):
+        self.autosaver.wait()
+        self.level_generator.shutdown()
+        self.level_store.clear()
         pg.quit()
         sys.exit()
 
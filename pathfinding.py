@@ -0,0 +1,524 @@
+import heapq
+from collections import deque
+from itertools import count
+
+import constants as c
+from settings import *
+
+"""
+Path finding on the map.
+* tile_path: A* on the tiles, moving in the 8 directions (a diagonal move costs the same as a straight one).
+* frontier_path: to the closest explored tile that is next to unexplored ones (auto exploration).
+* HierarchicalPathfinder: on the maps made of rooms, plans first from door to door using the room graph, then only
+  looks for the tiles inside the current room. The cost to cross a room from a door to another is computed once.
+"""
+
+_DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def _distance(pos, other_pos):
+    return max(abs(pos[0] - other_pos[0]), abs(pos[1] - other_pos[1]))
+
+
+def tile_path(level_map, start, goal, bounds=None, max_nodes=None, explored_only=False, blocked=None, within=None):
+    """
+    A* from a tile to another one. Only the tile types are considered: the entities (doors, monsters) are not.
+    :param level_map: the map
+    :param start: the start position
+    :param goal: the goal position
+    :param bounds: (min x, min y, max x, max y) to limit the search to a part of the map, all included
+    :param max_nodes: the maximum number of tiles explored, None for no limit
+    :param explored_only: True to only go through the tiles explored by the player
+    :param blocked: positions that cannot be crossed, None for none
+    :param within: the only positions that can be crossed (the goal excepted), None for all
+    :return: the list of the positions to go through, start excluded and goal included. None if there is no path.
+    """
+    if start == goal:
+        return []
+    if bounds is None:
+        bounds = (0, 0, level_map.tile_width - 1, level_map.tile_height - 1)
+    (min_x, min_y, max_x, max_y) = bounds
+    tiles = level_map.tiles
+    if not (min_x <= goal[0] <= max_x and min_y <= goal[1] <= max_y) or \
+            tiles[goal[0]][goal[1]].tile_type != c.T_FLOOR or (explored_only and not tiles[goal[0]][goal[1]].explored):
+        return None
+
+    tie_breaker = count()
+    to_visit = [(_distance(start, goal), next(tie_breaker), start)]
+    came_from = {start: None}
+    cost = {start: 0}
+    explored = 0
+    while to_visit:
+        (estimate, order, pos) = heapq.heappop(to_visit)
+        if pos == goal:
+            path = []
+            while pos != start:
+                path.append(pos)
+                pos = came_from[pos]
+            path.reverse()
+            return path
+        explored += 1
+        if max_nodes is not None and explored > max_nodes:
+            return None
+        next_cost = cost[pos] + 1
+        for (dx, dy) in _DIRECTIONS:
+            x = pos[0] + dx
+            y = pos[1] + dy
+            if min_x <= x <= max_x and min_y <= y <= max_y and tiles[x][y].tile_type == c.T_FLOOR and \
+                    (not explored_only or tiles[x][y].explored):
+                next_pos = (x, y)
+                if (blocked is not None and next_pos in blocked) or \
+                        (within is not None and next_pos not in within and next_pos != goal):
+                    continue
+                if next_cost < cost.get(next_pos, next_cost + 1):
+                    cost[next_pos] = next_cost
+                    came_from[next_pos] = pos
+                    heapq.heappush(to_visit, (next_cost + _distance(next_pos, goal), next(tie_breaker), next_pos))
+    return None
+
+
+def frontier_path(level_map, start, excluded=(), blocked=(), max_nodes=None):
+    """
+    Breadth first search, through the explored floor tiles, of the closest one next to an unexplored tile.
+    :param level_map: the map
+    :param start: the start position
+    :param excluded: positions not to be taken as a goal (frontiers already reached, that stay unexplored)
+    :param blocked: positions that cannot be crossed
+    :param max_nodes: the maximum number of tiles explored, None for no limit
+    :return: the list of the positions to go through, start excluded and goal included. None if there is nothing
+    left to explore.
+    """
+    (width, height) = (level_map.tile_width, level_map.tile_height)
+    tiles = level_map.tiles
+    came_from = {start: None}
+    to_visit = deque([start])
+    while to_visit:
+        pos = to_visit.popleft()
+        if pos != start and pos not in excluded:
+            for (dx, dy) in _DIRECTIONS:
+                x = pos[0] + dx
+                y = pos[1] + dy
+                if 0 <= x < width and 0 <= y < height and not tiles[x][y].explored:
+                    path = []
+                    while pos != start:
+                        path.append(pos)
+                        pos = came_from[pos]
+                    path.reverse()
+                    return path
+        if max_nodes is not None and len(came_from) > max_nodes:
+            return None
+        for (dx, dy) in _DIRECTIONS:
+            x = pos[0] + dx
+            y = pos[1] + dy
+            next_pos = (x, y)
+            if 0 <= x < width and 0 <= y < height and next_pos not in came_from and next_pos not in blocked and \
+                    tiles[x][y].tile_type == c.T_FLOOR and tiles[x][y].explored:
+                came_from[next_pos] = pos
+                to_visit.append(next_pos)
+    return None
+
+
+class _Area:
+    """
+    The floor out of the rooms (a maze, corridors) that some doors open on. The pathfinder uses it as a room: the
+    doors opening on it are linked through it.
+    """
+
+    def __init__(self, tiles):
+        """
+        :param tiles: the positions of the area
+        """
+        self.tiles = tiles
+        min_x = min(x for (x, y) in tiles)
+        min_y = min(y for (x, y) in tiles)
+        self.position = (min_x, min_y)
+        self.size = (max(x for (x, y) in tiles) - min_x + 1, max(y for (x, y) in tiles) - min_y + 1)
+
+
+class HierarchicalPathfinder:
+    """
+    Path finding over the rooms and doors of a map (see RoomGraph).
+    The high level graph has the doors as nodes; two doors are linked when they belong to the same room, with the
+    cost of the tile path between them inside the room. These costs are computed when first needed, then kept.
+    The rooms opening on the floor out of the rooms (a maze, corridors) are linked through it, like through a room
+    (see _Area).
+    For next_step, the costs from every door to the goal are kept for the goal room, and used again while the goal
+    stays in the same room (a companion following the player); the path to the next door is kept until it is reached.
+    When the start or the goal is not in a room linked to the others (corridors, mazes, caves), a plain tile A* is
+    used instead, limited to PATH_MAX_NODES tiles (the large maps would else be searched, and generated, entirely).
+    """
+
+    def __init__(self, level_map):
+        self.map = level_map
+        self._room_doors = {}  # room (or _Area) -> list of the doors of its connections
+        for (room, other_room, doors) in level_map.room_graph.edges():
+            for door in doors:
+                for linked_room in (room, other_room):
+                    room_doors = self._room_doors.setdefault(linked_room, [])
+                    if door not in room_doors:
+                        room_doors.append(door)
+        self._area_at = {}  # position -> the _Area there
+        self._link_areas()
+        self._door_rooms = {}  # door -> the rooms it connects
+        for room, doors in self._room_doors.items():
+            for door in doors:
+                self._door_rooms.setdefault(door, []).append(room)
+        self._component = self._components()  # room -> number of the rooms connected together
+        self._crossing_cost = {}  # (room, position, door) -> cost of the path inside the room, None if none
+        self._goal_costs = {}  # goal room -> {door: cost to the goal}, from the first goal position seen in the room
+        self._followed = {}  # goal room -> the last path given by next_step (to a door, or to the goal), start included
+
+    def _outside(self, pos):
+        (x, y) = pos
+        if 0 <= x < self.map.tile_width and 0 <= y < self.map.tile_height:
+            tile = self.map.tiles[x][y]
+            return tile.tile_type == c.T_FLOOR and tile.room is None
+        return False
+
+    def _link_areas(self):
+        """
+        Find the areas out of the rooms that the doors open on, and add them with their doors. The doors already
+        linking two rooms (through a tunnel) are left as they are, and so are the areas with a single door (dead ends:
+        they link nothing).
+        """
+        graph_doors = set(door for doors in self._room_doors.values() for door in doors)
+        area_doors = {}  # area -> [(room, door)]
+        for room in self.map.rooms:
+            for door in room.doors:
+                door = tuple(door)
+                if door in graph_doors:
+                    continue
+                for (dx, dy) in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+                    pos = (door[0] + dx, door[1] + dy)
+                    if not self._outside(pos):
+                        continue
+                    if pos not in self._area_at:
+                        # Flood the area
+                        tiles = {pos}
+                        to_visit = deque([pos])
+                        while to_visit:
+                            (x, y) = to_visit.popleft()
+                            for (ddx, ddy) in _DIRECTIONS:
+                                next_pos = (x + ddx, y + ddy)
+                                if next_pos not in tiles and self._outside(next_pos):
+                                    tiles.add(next_pos)
+                                    to_visit.append(next_pos)
+                        area = _Area(tiles)
+                        for tile_pos in tiles:
+                            self._area_at[tile_pos] = area
+                    area_doors.setdefault(self._area_at[pos], []).append((room, door))
+        for area, doors in area_doors.items():
+            if len(set(door for (room, door) in doors)) < 2:
+                continue
+            for (room, door) in doors:
+                for linked_room in (room, area):
+                    room_doors = self._room_doors.setdefault(linked_room, [])
+                    if door not in room_doors:
+                        room_doors.append(door)
+
+    def _components(self):
+        component = {}
+        for number, room in enumerate(self._room_doors):
+            if room in component:
+                continue
+            component[room] = number
+            to_visit = [room]
+            while to_visit:
+                for door in self._room_doors[to_visit.pop()]:
+                    for other_room in self._door_rooms[door]:
+                        if other_room not in component:
+                            component[other_room] = number
+                            to_visit.append(other_room)
+        return component
+
+    def _room_bounds(self, room, pos, other_pos):
+        """
+        The search inside a room is limited to the room, extended to the positions (doors may be at the end of a
+        tunnel)
+        """
+        (room_x, room_y) = room.position
+        (size_x, size_y) = room.size
+        return (max(0, min(room_x, pos[0], other_pos[0]) - 1),
+                max(0, min(room_y, pos[1], other_pos[1]) - 1),
+                min(self.map.tile_width - 1, max(room_x + size_x - 1, pos[0], other_pos[0]) + 1),
+                min(self.map.tile_height - 1, max(room_y + size_y - 1, pos[1], other_pos[1]) + 1))
+
+    def _path_in_room(self, room, pos, other_pos, explored_only=False, blocked=None):
+        if isinstance(room, _Area):
+            # The bounds of a maze may hold rooms: the path must stay in the maze (the doors are only ways in and out)
+            return tile_path(self.map, pos, other_pos, max_nodes=PATH_MAX_NODES, explored_only=explored_only,
+                             blocked=blocked, within=room.tiles)
+        return tile_path(self.map, pos, other_pos, bounds=self._room_bounds(room, pos, other_pos),
+                         explored_only=explored_only, blocked=blocked)
+
+    def _cost_in_room(self, room, pos, door, cached=True):
+        key = (room, pos, door)
+        if cached and key in self._crossing_cost:
+            return self._crossing_cost[key]
+        if cached and isinstance(room, _Area):
+            self._area_costs(room, pos)
+            return self._crossing_cost[key]
+        path = self._path_in_room(room, pos, door)
+        cost = len(path) if path is not None else None
+        if cached:
+            self._crossing_cost[key] = cost
+            self._crossing_cost[(room, door, pos)] = cost
+        return cost
+
+    def _area_distances(self, area, pos):
+        """
+        The costs from a position to all the doors of an area, with a single breadth first search (an area may be a
+        whole maze: a search per door would be too long)
+        :return: door -> cost, for the doors that can be reached
+        """
+        doors = set(self._room_doors[area])
+        distance = {pos: 0}
+        to_visit = deque([pos])
+        while to_visit:
+            current = to_visit.popleft()
+            if current in doors and current != pos:
+                # A door is a way out of the area, not through it
+                continue
+            for (dx, dy) in _DIRECTIONS:
+                next_pos = (current[0] + dx, current[1] + dy)
+                if next_pos not in distance and (next_pos in area.tiles or next_pos in doors):
+                    distance[next_pos] = distance[current] + 1
+                    to_visit.append(next_pos)
+        return {door: distance[door] for door in doors if door in distance}
+
+    def _area_costs(self, area, door):
+        distance = self._area_distances(area, door)
+        for other_door in self._room_doors[area]:
+            cost = distance.get(other_door)
+            self._crossing_cost[(area, door, other_door)] = cost
+            self._crossing_cost[(area, other_door, door)] = cost
+
+    def _costs_to_doors(self, room, pos):
+        """
+        :return: door of the room -> cost from the position, for the doors that can be reached (not kept)
+        """
+        if isinstance(room, _Area):
+            return self._area_distances(room, pos)
+        costs = {}
+        for door in self._room_doors[room]:
+            cost = self._cost_in_room(room, pos, door, cached=False)
+            if cost is not None:
+                costs[door] = cost
+        return costs
+
+    def room_at(self, pos):
+        """
+        :return: the room at a position, or the _Area linking the rooms there. None if none.
+        """
+        room = self.map.get_room_at(pos[0], pos[1])
+        if room is None:
+            return self._area_at.get(pos)
+        return room
+
+    def _crossed_room(self, door, other_door):
+        """
+        :return: the room crossed from a door to another one: the cheapest one when they share several (a room and
+        the maze it opens on), as chosen by door_route
+        """
+        best_room = None
+        best_cost = None
+        for room in self._door_rooms[door]:
+            if room in self._door_rooms[other_door]:
+                cost = self._cost_in_room(room, door, other_door)
+                if cost is not None and (best_cost is None or cost < best_cost):
+                    best_room = room
+                    best_cost = cost
+        return best_room
+
+    def _usable(self, door, explored_only, blocked):
+        if blocked is not None and door in blocked:
+            return False
+        return not explored_only or self.map.tiles[door[0]][door[1]].explored
+
+    def door_route(self, start, goal, explored_only=False, blocked=None):
+        """
+        Plan from room to room. The costs inside the rooms do not depend on the constraints: only the doors that
+        cannot be crossed are left out.
+        :param start: the start position
+        :param goal: the goal position
+        :param explored_only: True to only go through the doors explored by the player
+        :param blocked: positions that cannot be crossed, None for none
+        :return: (the list of doors to go through, the room of the start), None if the rooms cannot be used
+        """
+        start_room = self.room_at(start)
+        goal_room = self.room_at(goal)
+        if start_room is None or goal_room is None or start_room is goal_room or \
+                start_room not in self._room_doors or goal_room not in self._room_doors:
+            return None
+        if self._component[start_room] != self._component[goal_room]:
+            return None
+
+        # Dijkstra on the doors. The goal is reached from the doors of its room.
+        goal_doors = self._costs_to_doors(goal_room, goal)
+
+        tie_breaker = count()
+        to_visit = []
+        came_from = {}
+        best = {}
+        for door, cost in self._costs_to_doors(start_room, start).items():
+            if not self._usable(door, explored_only, blocked):
+                continue
+            best[door] = cost
+            came_from[door] = None
+            heapq.heappush(to_visit, (cost, next(tie_breaker), door))
+
+        best_total = None
+        best_last_door = None
+        while to_visit:
+            (cost, order, door) = heapq.heappop(to_visit)
+            if cost > best.get(door, cost):
+                continue
+            if best_total is not None and cost >= best_total:
+                break
+            if door in goal_doors and (best_total is None or cost + goal_doors[door] < best_total):
+                best_total = cost + goal_doors[door]
+                best_last_door = door
+            for room in self._door_rooms[door]:
+                for other_door in self._room_doors[room]:
+                    if other_door == door or not self._usable(other_door, explored_only, blocked):
+                        continue
+                    crossing_cost = self._cost_in_room(room, door, other_door)
+                    if crossing_cost is None:
+                        continue
+                    new_cost = cost + crossing_cost
+                    if new_cost < best.get(other_door, new_cost + 1):
+                        best[other_door] = new_cost
+                        came_from[other_door] = door
+                        heapq.heappush(to_visit, (new_cost, next(tie_breaker), other_door))
+
+        if best_last_door is None:
+            return None
+        doors = []
+        door = best_last_door
+        while door is not None:
+            doors.append(door)
+            door = came_from[door]
+        doors.reverse()
+        return doors, start_room
+
+    def _segment(self, pos, target, room, explored_only=False, blocked=None):
+        """
+        The tile path from a position to the next door (or the goal), looked for in the rooms of the position, the
+        one crossed to the target door first
+        """
+        rooms = self._door_rooms.get(pos, [room])
+        if pos in self._door_rooms and target in self._door_rooms:
+            crossed_room = self._crossed_room(pos, target)
+            if crossed_room is not None:
+                rooms = [crossed_room] + [room for room in rooms if room is not crossed_room]
+        for room in rooms:
+            path = self._path_in_room(room, pos, target, explored_only=explored_only, blocked=blocked)
+            if path is not None:
+                return path
+        return tile_path(self.map, pos, target, max_nodes=PATH_MAX_NODES, explored_only=explored_only,
+                         blocked=blocked)
+
+    def _costs_to_goal(self, goal_room, goal):
+        """
+        The cost from every door to the goal (Dijkstra from the goal), kept for the goal room: while the goal moves
+        inside its room (the player followed by a companion), the costs stay good enough to choose the doors.
+        :return: door -> cost
+        """
+        if goal_room in self._goal_costs:
+            return self._goal_costs[goal_room]
+        tie_breaker = count()
+        best = self._costs_to_doors(goal_room, goal)
+        to_visit = [(cost, next(tie_breaker), door) for door, cost in best.items()]
+        heapq.heapify(to_visit)
+        while to_visit:
+            (cost, order, door) = heapq.heappop(to_visit)
+            if cost > best[door]:
+                continue
+            for room in self._door_rooms[door]:
+                for other_door in self._room_doors[room]:
+                    if other_door == door:
+                        continue
+                    crossing_cost = self._cost_in_room(room, door, other_door)
+                    if crossing_cost is None:
+                        continue
+                    new_cost = cost + crossing_cost
+                    if new_cost < best.get(other_door, new_cost + 1):
+                        best[other_door] = new_cost
+                        heapq.heappush(to_visit, (new_cost, next(tie_breaker), other_door))
+        self._goal_costs[goal_room] = best
+        return best
+
+    def next_step(self, start, goal):
+        """
+        The next position to go to: towards the door of the start room that is the closest to the goal (see
+        _costs_to_goal), the path to that door being kept until it is reached.
+        :param start: the start position
+        :param goal: the goal position
+        :return: a position next to start, None if there is no path
+        """
+        if start == goal:
+            return None
+        goal_room = self.room_at(goal)
+        start_rooms = self._door_rooms.get(start, [self.room_at(start)])
+        if goal_room is None or goal_room not in self._room_doors or goal_room in start_rooms or \
+                any(room not in self._component or self._component[room] != self._component[goal_room]
+                    for room in start_rooms):
+            path = tile_path(self.map, start, goal, max_nodes=PATH_MAX_NODES)
+            if not path:
+                return None
+            if goal_room is not None:
+                # Kept as well: the tile path from a door of the goal room may go out of the room first
+                self._followed[goal_room] = [start] + path
+            return path[0]
+
+        followed = self._followed.get(goal_room)
+        if followed is not None and start in followed[:-1] and \
+                (followed[-1] == goal or followed[-1] in self._door_rooms):
+            # Followed until its door, or until the goal when the goal has not moved
+            return followed[followed.index(start) + 1]
+
+        costs_to_goal = self._costs_to_goal(goal_room, goal)
+        best = None
+        for room in start_rooms:
+            for door, cost in self._costs_to_doors(room, start).items():
+                if door != start and door in costs_to_goal:
+                    total = cost + costs_to_goal[door]
+                    if best is None or total < best[0]:
+                        best = (total, room, door)
+        path = None
+        if best is not None:
+            path = self._path_in_room(best[1], start, best[2])
+        if not path:
+            self._followed.pop(goal_room, None)
+            path = tile_path(self.map, start, goal, max_nodes=PATH_MAX_NODES)
+            return path[0] if path else None
+        self._followed[goal_room] = [start] + path
+        return path[0]
+
+    def path(self, start, goal, explored_only=False, blocked=None):
+        """
+        The whole path, built room by room. When a part of the route cannot be walked with the constraints (a room
+        not fully explored, a monster in the way), a plain tile A* with the same constraints is used instead.
+        :param start: the start position
+        :param goal: the goal position
+        :param explored_only: True to only go through the tiles explored by the player
+        :param blocked: positions that cannot be crossed, None for none
+        :return: the list of the positions to go through, start excluded and goal included. None if there is no path.
+        """
+        route = self.door_route(start, goal, explored_only=explored_only, blocked=blocked)
+        if route is None:
+            return tile_path(self.map, start, goal, max_nodes=PATH_MAX_NODES, explored_only=explored_only,
+                             blocked=blocked)
+        (doors, start_room) = route
+        path = []
+        pos = start
+        for target in doors + [goal]:
+            if target == pos:
+                continue
+            part = self._segment(pos, target, start_room, explored_only=explored_only, blocked=blocked)
+            if part is None:
+                return tile_path(self.map, start, goal, max_nodes=PATH_MAX_NODES, explored_only=explored_only,
+                                 blocked=blocked)
+            path += part
+            pos = target
+        return path
@@ -0,0 +1,519 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+import constants as c
+import settings as st
+
+from entities import MonsterHelper, MonsterFactory, DoorHelper, StairHelper, OpenableObjectHelper, NPCHelper, Entity
+from item import ItemHelper, EquipmentHelper, ItemFactory
+from player import PlayerHelper
+from tilemap import Map
+
+"""
+Save games.
+A save game is a small container:
+* a header: magic + format version (not compressed)
+* a zlib stream of sections, each section being a 4 bytes tag, a length and the payload:
+  - META: the game variables (json)
+  - MAP : the map, as packed layers (see Map.to_bytes)
+  - ENTS: the entities (json). Entities built by a factory only store their template (key, seed) and their
+    mutable state, they are built again by the factory when loading.
+  - LEVS: the levels left by the player, as kept by the LevelStore (see LevelStore.to_bytes)
+Nothing from pygame is stored, so a save does not depend on the graphics.
+The levels left by the player are kept the same way (see LevelStore), without the player.
+"""
+
+SAVE_MAGIC = b"LCSV"
+SAVE_VERSION = 3  # 2: game and level seeds in META, 3: LEVS section
+
+SECTION_META = b"META"
+SECTION_MAP = b"MAP "
+SECTION_ENTITIES = b"ENTS"
+SECTION_LEVELS = b"LEVS"
+
+_SECTION_HEADER = "<4sI"
+_LEVEL_HEADER = "<HI"
+_CHUNK_SIZE = 64 * 1024
+
+
+def build_snapshot(game):
+    """
+    Capture the game state. This is the only part that needs the game objects; the result can then be written
+    with write_snapshot (possibly elsewhere than in the main loop).
+    :param game: the game
+    :return: a dictionary {section tag: bytes}
+    """
+    meta = {"level": game.level,
+            "game_seed": game.game_seed,
+            "level_seed": game.level_seed,
+            "ticks": game.ticker.ticks,
+            "player_name": game.player.name}
+    records = [_player_record(game.player)] + _level_records(game)
+    return {SECTION_META: json.dumps(meta).encode("utf-8"),
+            SECTION_MAP: game.map.to_bytes(),
+            SECTION_ENTITIES: json.dumps(records, separators=(",", ":")).encode("utf-8"),
+            SECTION_LEVELS: game.level_store.to_bytes()}
+
+
+def _level_records(game):
+    """
+    The records of all the saved entities of the current level, except the player
+    """
+    records = []
+    for entity in game.objects:
+        if entity is game.player:
+            continue
+        record = _entity_record(entity)
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def _join_sections(snapshot):
+    return b"".join(struct.pack(_SECTION_HEADER, tag, len(payload)) + payload for tag, payload in snapshot.items())
+
+
+def _split_sections(data):
+    snapshot = {}
+    offset = 0
+    header_size = struct.calcsize(_SECTION_HEADER)
+    while offset < len(data):
+        (tag, length) = struct.unpack_from(_SECTION_HEADER, data, offset)
+        offset += header_size
+        snapshot[tag] = data[offset:offset + length]
+        offset += length
+    return snapshot
+
+
+def write_snapshot(snapshot, filename):
+    """
+    Write the snapshot in a compressed stream. The file is written aside, then moved, so that an existing save is
+    never left half written.
+    :param snapshot: the result of build_snapshot
+    :param filename: the save game file
+    :return: Nothing
+    """
+    temporary_filename = filename + ".tmp"
+    compressor = zlib.compressobj(6)
+    with open(temporary_filename, "wb") as f:
+        f.write(SAVE_MAGIC + struct.pack("<H", SAVE_VERSION))
+        for tag in (SECTION_META, SECTION_MAP, SECTION_ENTITIES, SECTION_LEVELS):
+            payload = snapshot[tag]
+            f.write(compressor.compress(struct.pack(_SECTION_HEADER, tag, len(payload))))
+            for start in range(0, len(payload), _CHUNK_SIZE):
+                f.write(compressor.compress(payload[start:start + _CHUNK_SIZE]))
+        f.write(compressor.flush())
+    os.replace(temporary_filename, filename)
+
+
+def read_snapshot(filename):
+    """
+    Read a save game written by write_snapshot
+    :param filename: the save game file
+    :return: a dictionary {section tag: bytes}
+    """
+    decompressor = zlib.decompressobj()
+    chunks = []
+    with open(filename, "rb") as f:
+        header = f.read(len(SAVE_MAGIC) + 2)
+        assert header[:len(SAVE_MAGIC)] == SAVE_MAGIC, "{} is not a save game".format(filename)
+        (version,) = struct.unpack("<H", header[len(SAVE_MAGIC):])
+        # The version 2 only lacks the LEVS section
+        assert version in (2, SAVE_VERSION), "Save game version {} not supported".format(version)
+        while True:
+            data = f.read(_CHUNK_SIZE)
+            if not data:
+                break
+            chunks.append(decompressor.decompress(data))
+        chunks.append(decompressor.flush())
+    return _split_sections(b"".join(chunks))
+
+
+def save_game(game, filename):
+    write_snapshot(build_snapshot(game), filename)
+
+
+class AutoSaver:
+    """
+    Save the game regularly without stopping the game loop.
+    The snapshot (see build_snapshot) is taken in the main loop, between two turns, and is only made of bytes: the
+    game can go on while a worker thread compresses and writes it.
+    The last autosaves are kept: <filename>.1 is the most recent one, <filename>.<slots> the oldest.
+    """
+
+    def __init__(self, filename=st.AUTOSAVE_FILENAME, slots=st.AUTOSAVE_SLOTS, interval=st.AUTOSAVE_INTERVAL):
+        """
+        :param filename: the base name of the autosave files
+        :param slots: the number of autosaves kept
+        :param interval: the number of ticks between two autosaves
+        """
+        assert slots >= 1, "At least one autosave slot is needed"
+        self.filename = filename
+        self.slots = slots
+        self.interval = interval
+        self.save_requested = False  # set to True to save at the next turn boundary
+        self._last_save_tick = None
+        self._thread = None
+
+    def slot_filename(self, slot):
+        return "{}.{}".format(self.filename, slot)
+
+    @property
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def update(self, game):
+        """
+        To be called once the ticker has advanced, when no action is half done.
+        If a save is still being written, the new one is simply postponed.
+        :param game: the game
+        :return: True if an autosave was started
+        """
+        ticks = game.ticker.ticks
+        if self._last_save_tick is None or ticks < self._last_save_tick:
+            # First call, or new game
+            self._last_save_tick = ticks
+        if not self.save_requested and ticks - self._last_save_tick < self.interval:
+            return False
+        if self.busy:
+            return False
+
+        snapshot = build_snapshot(game)
+        self._last_save_tick = ticks
+        self.save_requested = False
+        self._thread = threading.Thread(target=self._write, args=(snapshot,), name="autosave", daemon=True)
+        self._thread.start()
+        return True
+
+    def wait(self):
+        """
+        Wait for the autosave being written, if any
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _rotate(self):
+        for slot in range(self.slots - 1, 0, -1):
+            if os.path.exists(self.slot_filename(slot)):
+                os.replace(self.slot_filename(slot), self.slot_filename(slot + 1))
+
+    def _write(self, snapshot):
+        try:
+            self._rotate()
+            write_snapshot(snapshot, self.slot_filename(1))
+        except OSError as e:
+            print("AUTOSAVE FAILED: {}".format(e))
+
+
+def restore_game(game, snapshot):
+    """
+    Rebuild the map, all the entities and the levels left of a snapshot in the game.
+    The game must have its ticker, bus, objects list, sprite groups and level store ready.
+    :param game: the game
+    :param snapshot: the result of read_snapshot
+    :return: Nothing
+    """
+    meta = json.loads(snapshot[SECTION_META].decode("utf-8"))
+    game.level = meta["level"]
+    game.game_seed = meta["game_seed"]
+    game.level_seed = meta["level_seed"]
+    game.ticker.ticks = meta["ticks"]
+    game.map = Map.from_bytes(snapshot[SECTION_MAP], game.all_images)
+
+    records = json.loads(snapshot[SECTION_ENTITIES].decode("utf-8"))
+    # The player goes first: the items and monsters keep a reference to it
+    game.player = _restore_player(game, records[0])
+    for record in records[1:]:
+        _restore_entity(game, record)
+    game.level_store.load_bytes(snapshot.get(SECTION_LEVELS, b""))
+
+
+# LEVELS
+
+class LevelStore:
+    """
+    Keep the levels left by the player, so that they are found again as they were left.
+    A level is stored as a compressed snapshot (map and entities, without the player). The most recently left levels
+    are kept in memory, up to a budget in bytes; the older ones are moved to files in a temporary directory.
+    """
+
+    def __init__(self, memory_budget=st.LEVEL_STORE_MEMORY):
+        """
+        :param memory_budget: the maximum size in bytes of the levels kept in memory
+        """
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self._in_memory = OrderedDict()  # level number -> compressed snapshot, the most recent last
+        self._on_disk = {}  # level number -> file name
+        self._directory = None
+
+    def __contains__(self, level):
+        return level in self._in_memory or level in self._on_disk
+
+    def store(self, game):
+        """
+        Store the current level of the game
+        :param game: the game
+        :return: Nothing
+        """
+        meta = {"level": game.level,
+                "level_seed": game.level_seed,
+                "player_pos": list(game.player.pos)}
+        snapshot = {SECTION_META: json.dumps(meta).encode("utf-8"),
+                    SECTION_MAP: game.map.to_bytes(),
+                    SECTION_ENTITIES: json.dumps(_level_records(game), separators=(",", ":")).encode("utf-8")}
+        self.discard(game.level)
+        data = zlib.compress(_join_sections(snapshot), 6)
+        self._in_memory[game.level] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory_budget and len(self._in_memory) > 1:
+            self._move_to_disk(next(iter(self._in_memory)))
+
+    def take(self, level):
+        """
+        Remove a level from the store
+        :param level: the level number
+        :return: the level snapshot (see restore_level), None if the level is not stored
+        """
+        if level in self._in_memory:
+            data = self._in_memory.pop(level)
+            self.memory_used -= len(data)
+        elif level in self._on_disk:
+            filename = self._on_disk.pop(level)
+            with open(filename, "rb") as f:
+                data = f.read()
+            os.remove(filename)
+        else:
+            return None
+        return _split_sections(zlib.decompress(data))
+
+    def discard(self, level):
+        if level in self._in_memory:
+            self.memory_used -= len(self._in_memory.pop(level))
+        elif level in self._on_disk:
+            os.remove(self._on_disk.pop(level))
+
+    def clear(self):
+        self._in_memory.clear()
+        self._on_disk.clear()
+        self.memory_used = 0
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def to_bytes(self):
+        """
+        All the levels stored, as they are kept (compressed snapshots): for each level, its number, the snapshot
+        length and the snapshot
+        :return: bytes
+        """
+        parts = []
+        for level in sorted(self._in_memory.keys() | self._on_disk.keys()):
+            if level in self._in_memory:
+                data = self._in_memory[level]
+            else:
+                with open(self._on_disk[level], "rb") as f:
+                    data = f.read()
+            parts.append(struct.pack(_LEVEL_HEADER, level, len(data)))
+            parts.append(data)
+        return b"".join(parts)
+
+    def load_bytes(self, data):
+        """
+        Replace the levels stored by the ones of to_bytes
+        :param data: the result of to_bytes
+        :return: Nothing
+        """
+        self.clear()
+        offset = 0
+        header_size = struct.calcsize(_LEVEL_HEADER)
+        while offset < len(data):
+            (level, length) = struct.unpack_from(_LEVEL_HEADER, data, offset)
+            offset += header_size
+            self._in_memory[level] = data[offset:offset + length]
+            self.memory_used += length
+            offset += length
+            while self.memory_used > self.memory_budget and len(self._in_memory) > 1:
+                self._move_to_disk(next(iter(self._in_memory)))
+
+    def _move_to_disk(self, level):
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="lordcrocket_levels_")
+        data = self._in_memory.pop(level)
+        self.memory_used -= len(data)
+        filename = os.path.join(self._directory, "level_{}".format(level))
+        with open(filename, "wb") as f:
+            f.write(data)
+        self._on_disk[level] = filename
+
+
+def restore_level(game, snapshot):
+    """
+    Rebuild a level taken from the LevelStore: map and entities. The player is not moved.
+    :param game: the game, without any level entity
+    :param snapshot: the result of LevelStore.take
+    :return: the position of the player when the level was left
+    """
+    meta = json.loads(snapshot[SECTION_META].decode("utf-8"))
+    game.level = meta["level"]
+    game.level_seed = meta["level_seed"]
+    game.map = Map.from_bytes(snapshot[SECTION_MAP], game.all_images)
+    for record in json.loads(snapshot[SECTION_ENTITIES].decode("utf-8")):
+        _restore_entity(game, record)
+    return tuple(meta["player_pos"])
+
+
+# ENTITIES -> RECORDS
+
+def _item_record(entity):
+    record = {"template": list(entity.template), "pos": list(entity.pos)}
+    if entity.equipment is not None:
+        record["kind"] = c.SAVE_KIND_EQUIPMENT
+        record["equipped"] = entity.equipment.is_equipped
+    else:
+        record["kind"] = c.SAVE_KIND_ITEM
+        record["number_use"] = entity.item.number_use
+        record["identified"] = entity.item.identified
+    return record
+
+
+def _player_record(player):
+    return {"kind": c.SAVE_KIND_PLAYER,
+            "pos": list(player.pos),
+            "name": player.name,
+            "stats": [player.base_strength, player.base_dexterity, player.base_mind, player.base_charisma],
+            "base_hit_points": player.base_hit_points,
+            "base_body_points": player.base_body_points,
+            "hit_points": player.fighter.hit_points,
+            "body_points": player.fighter.body_points,
+            "combat_bonus": [player.fighter.physical_combat_bonus, player.fighter.magical_combat_bonus],
+            "saving_throw": player.saving_throw,
+            "experience": player.experience,
+            "level": player.level,
+            "wealth": player.wealth,
+            "base_speed": player.base_speed,
+            "time_before_next_heal": player.time_before_next_heal,
+            "quests": [[quest.state, getattr(quest, "current_kill", 0)] for quest in player.quest_list],
+            "inventory": [_item_record(item) for item in player.inventory if item.template is not None]}
+
+
+def _entity_record(entity):
+    """
+    Build the record of an entity. The transient entities (visual effects, spells) are not saved.
+    :param entity: the entity
+    :return: the record (a dictionary), None if not saved
+    """
+    if entity.image_ref == "REMAINS" and entity.fighter is None:
+        return {"kind": c.SAVE_KIND_REMAINS, "pos": list(entity.pos), "name": entity.name}
+    elif isinstance(entity, MonsterHelper):
+        return {"kind": c.SAVE_KIND_MONSTER,
+                "template": list(entity.template),
+                "pos": list(entity.pos),
+                "hit_points": entity.fighter.hit_points,
+                "already_viewed_player": entity.ai.already_viewed_player,
+                "time_since_view": entity.ai.time_since_view}
+    elif isinstance(entity, (ItemHelper, EquipmentHelper)) and entity.template is not None:
+        return _item_record(entity)
+    elif isinstance(entity, OpenableObjectHelper) and entity.template is not None:
+        return {"kind": c.SAVE_KIND_OPENABLE,
+                "template": list(entity.template),
+                "pos": list(entity.pos),
+                "closed": entity.actionable is not None}
+    elif isinstance(entity, DoorHelper):
+        return {"kind": c.SAVE_KIND_DOOR, "pos": list(entity.pos), "name": entity.name, "closed": entity.blocks}
+    elif isinstance(entity, StairHelper):
+        return {"kind": c.SAVE_KIND_STAIRS, "pos": list(entity.pos), "name": entity.name, "up": entity.going_up}
+    elif isinstance(entity, NPCHelper):
+        return {"kind": c.SAVE_KIND_NPC, "pos": list(entity.pos), "name": entity.name,
+                "image_ref": entity.image_ref}
+    return None
+
+
+# RECORDS -> ENTITIES
+
+def _restore_item(game, record, pos):
+    key, seed = record["template"]
+    entity = ItemFactory.instantiate_item(game, key, pos, seed=seed)
+    if record["kind"] == c.SAVE_KIND_EQUIPMENT:
+        entity.equipment.is_equipped = record["equipped"]
+    else:
+        entity.item.number_use = record["number_use"]
+        if record["identified"] and not entity.item.identified:
+            entity.item.identified = True
+            entity.name = entity.name_after
+            entity.long_desc = entity.long_desc_after
+    return entity
+
+
+def _restore_player(game, record):
+    assert record["kind"] == c.SAVE_KIND_PLAYER, "The first record of a save game must be the player"
+    player = PlayerHelper(game, tuple(record["pos"]))
+    player.name = record["name"]
+    (player.base_strength, player.base_dexterity, player.base_mind, player.base_charisma) = record["stats"]
+    player.base_hit_points = record["base_hit_points"]
+    player.base_body_points = record["base_body_points"]
+    player.fighter.hit_points = record["hit_points"]
+    player.fighter.body_points = record["body_points"]
+    (player.fighter.physical_combat_bonus, player.fighter.magical_combat_bonus) = record["combat_bonus"]
+    player.saving_throw = record["saving_throw"]
+    player.experience = record["experience"]
+    player.level = record["level"]
+    player.wealth = record["wealth"]
+    player.base_speed = record["base_speed"]
+    player.time_before_next_heal = record["time_before_next_heal"]
+    # Before the inventory: the items keep a reference to the player
+    game.player = player
+
+    for quest, (state, current_kill) in zip(player.quest_list, record["quests"]):
+        quest.state = state
+        if hasattr(quest, "current_kill"):
+            quest.current_kill = current_kill
+        if state != c.QUEST_SUBSCRIBED:
+            game.bus.unregister_all(quest)
+
+    for item_record in record["inventory"]:
+        item = _restore_item(game, item_record, player.pos)
+        game.objects.remove(item)
+        for group in game.all_groups:
+            group.remove(item)
+        player.inventory.append(item)
+    return player
+
+
+def _restore_entity(game, record):
+    kind = record["kind"]
+    pos = tuple(record["pos"])
+    if kind == c.SAVE_KIND_MONSTER:
+        key, seed = record["template"]
+        monster = MonsterFactory.instantiate_monster(game, key, pos, seed=seed)
+        monster.fighter.hit_points = record["hit_points"]
+        monster.ai.already_viewed_player = record["already_viewed_player"]
+        monster.ai.time_since_view = record["time_since_view"]
+    elif kind == c.SAVE_KIND_REMAINS:
+        Entity(game, record["name"], pos, "REMAINS", groups=game.player_min1_sprite_group)
+    elif kind in (c.SAVE_KIND_ITEM, c.SAVE_KIND_EQUIPMENT):
+        _restore_item(game, record, pos)
+    elif kind == c.SAVE_KIND_OPENABLE:
+        key, seed = record["template"]
+        openable = ItemFactory.instantiate_item(game, key, pos, seed=seed)
+        if not record["closed"]:
+            OpenableObjectHelper._manipulate_generic(openable, None)
+    elif kind == c.SAVE_KIND_DOOR:
+        door = DoorHelper(game, pos, ("DOOR_H_CLOSED", "DOOR_H_OPEN", "DOOR_V_CLOSED", "DOOR_V_OPEN"),
+                          closed=record["closed"], name=record["name"], open_function=DoorHelper.open_door)
+        if not record["closed"]:
+            door.actionable = None
+            door.set_in_spritegroup(-1)
+    elif kind == c.SAVE_KIND_STAIRS:
+        StairHelper(game, pos, "STAIRS", name=record["name"], going_up=record.get("up", False))
+    elif kind == c.SAVE_KIND_NPC:
+        NPCHelper(game, record["name"], pos, record["image_ref"])
+    else:
+        assert False, "Unknown save record kind {}".format(kind)
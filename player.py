@@ -1,8 +1,11 @@
-from entities import Entity
+from entities import Entity, DoorHelper
 from fighter import PlayerFighter
 import utilities as ut
 import random as rd
+import time
 import constants as c
+import settings as st
+from pathfinding import frontier_path
 from utilities import MName
 
 
@@ -45,6 +48,7 @@ class PlayerHelper(Entity):
         self.wealth = 0
 
         self.invalidate_fog_of_war = True
+        self.activity = None  # the action repeated over several turns, if any (see MultiTurnAction)
 
         # Player needs to heal from exploration
         self.time_before_next_heal = 10  # in 10 turn, recover strength bonus health
@@ -118,7 +122,7 @@ class PlayerHelper(Entity):
 
     def speed_cost_for(self, action):
         # Assume base 1 = move
-        if action == c.AC_ENV_MOVE:
+        if action in (c.AC_ENV_MOVE, c.AC_ENV_REST):
             return self.speed
         elif action == c.P_CAT_FIGHT:
             return int(self.speed * 0.8)
@@ -197,6 +201,85 @@ class PlayerHelper(Entity):
 
         return False
 
+    def rest(self):
+        """
+        Wait for a turn. Resting heals like exploring does.
+        :return: True (the turn is always spent)
+        """
+        self.game.ticker.ticks_to_advance += self.speed_cost_for(c.AC_ENV_REST)
+        self.exploration_heal(None)
+        return True
+
+    def obstacles(self):
+        """
+        :return: the positions where run does not go: the fighters, and what would be used by walking on it (stairs,
+        chests...) except the doors
+        """
+        positions = set()
+        for entity in self.game.objects:
+            if entity == self:
+                continue
+            if entity.fighter:
+                positions.add(entity.pos)
+            if entity.actionable is not None and not isinstance(entity, DoorHelper):
+                positions.update(entity.actionable.action_field)
+        return positions
+
+    def run(self, dx=0, dy=0):
+        """
+        Move one step, without attacking nor using what is on the way (see obstacles).
+        :return: True if the player moved
+        """
+        if (self.x + dx, self.y + dy) in self.obstacles():
+            return False
+        old_pos = self.pos
+        return self.move(dx=dx, dy=dy) and self.pos != old_pos
+
+    def start_activity(self, name, step, turns):
+        """
+        Repeat an action over several turns, in fast forward (see MultiTurnAction)
+        :param name: what the player is doing ("resting"...), for the messages
+        :param step: the function doing one turn of the action, returning False when it cannot go on
+        :param turns: the maximum number of turns
+        """
+        self.activity = MultiTurnAction(self, name, step, turns)
+
+    def start_travel(self, goal):
+        """
+        Walk to a position, through the explored tiles only
+        :param goal: the position
+        :return: True if there is a path to it
+        """
+        follower = PathFollower(self, lambda start, reached: self.game.pathfinder.path(start, goal,
+                                                                                        explored_only=True,
+                                                                                        blocked=self.obstacles()))
+        if not follower.path:
+            return False
+        self.start_activity("travelling", follower, st.TRAVEL_TURNS)
+        return True
+
+    def start_exploration(self):
+        """
+        Walk to the closest unexplored part of the map, again and again, until there is none left
+        :return: True if there is something to explore
+        """
+        follower = PathFollower(self, lambda start, reached: frontier_path(self.game.map, start, excluded=reached,
+                                                                            blocked=self.obstacles(),
+                                                                            max_nodes=st.PATH_MAX_NODES))
+        if not follower.path:
+            return False
+        self.start_activity("exploring", follower, st.TRAVEL_TURNS)
+        return True
+
+    def stop_activity(self, reason=None):
+        """
+        :param reason: why the action was interrupted, to be told to the player. None if it just ended.
+        """
+        if self.activity is not None and reason is not None:
+            self.game.bus.publish(self, {"operator": self, "activity": self.activity.name, "reason": reason},
+                                  main_category=c.P_CAT_ENV, sub_category=c.AC_ENV_INTERRUPT)
+        self.activity = None
+
     # xp related function
     def gain_experience(self, amount):
         self.experience += amount
@@ -265,6 +348,125 @@ class PlayerHelper(Entity):
                 non_equipment.append(item)
         return non_equipment
 
+
+class MultiTurnAction:
+    """
+    An action repeated over several turns: resting, running in a direction...
+    The turns are played in fast forward: as many as the time allows are played (with the ticks they cost) before a
+    frame is drawn, instead of one turn per frame. The action is interrupted when a new monster comes into view, or
+    when the player is hurt.
+    """
+
+    def __init__(self, player, name, step, turns):
+        """
+        :param player: the player
+        :param name: what the player is doing ("resting"...), for the messages
+        :param step: the function doing one turn of the action, returning False when it cannot go on
+        :param turns: the maximum number of turns
+        """
+        self.player = player
+        self.name = name
+        self.step = step
+        self.turns_left = turns
+        self.stop_tick = None  # the tick to stop at, when replayed (see commands.StopActivity)
+        self._update_view()
+        self._monsters_seen = self._monsters_in_view()
+        self._health = self._player_health()
+
+    def _player_health(self):
+        return self.player.fighter.hit_points + self.player.fighter.body_points
+
+    def _monsters_in_view(self):
+        game = self.player.game
+        return set(entity for entity in game.objects
+                   if entity.fighter and entity is not self.player and entity.pos in game.visible_player_tiles)
+
+    def _update_view(self):
+        if self.player.invalidate_fog_of_war:
+            # No frame may be drawn in between: the view is updated here (the fog of war is still built at the next
+            # frame)
+            game = self.player.game
+            game.visible_player_tiles = game.fov.get_visible_tiles_for(self.player, flag_explored=True)
+
+    def _interruption(self):
+        """
+        :return: the reason to stop the action after a turn, None to go on
+        """
+        self._update_view()
+        health = self._player_health()
+        if health < self._health:
+            return "took damage"
+        self._health = health
+        monsters = self._monsters_in_view()
+        new_monsters = monsters - self._monsters_seen
+        self._monsters_seen = monsters
+        if new_monsters:
+            return "{} comes into view".format(new_monsters.pop().name)
+        return None
+
+    def run(self, budget):
+        """
+        Play turns until the time is spent or the action is over. The player activity is cleared when it is over.
+        :param budget: the time allowed, in seconds (at least one turn is played)
+        :return: True if the action goes on
+        """
+        deadline = time.perf_counter() + budget
+        game = self.player.game
+        while True:
+            if self.stop_tick is not None and game.ticker.ticks >= self.stop_tick:
+                self.player.stop_activity()
+                return False
+            if self.turns_left <= 0 or not self.step():
+                self.player.stop_activity()
+                return False
+            self.turns_left -= 1
+            game.ticker.advance_ticks()
+            if not game.playing:
+                return False
+            reason = self._interruption()
+            if reason is not None:
+                self.player.stop_activity(reason)
+                return False
+            if time.perf_counter() > deadline:
+                return True
+
+
+class PathFollower:
+    """
+    The step of a MultiTurnAction walking along a path. The path is looked for again when it is over (the exploration
+    goes on to the next frontier) or blocked (a door to open, someone in the way).
+    """
+
+    def __init__(self, player, find_path):
+        """
+        :param player: the player
+        :param find_path: function(start position, goals reached) giving the path to follow (start excluded), None
+        or empty when there is nowhere to go
+        """
+        self.player = player
+        self.find_path = find_path
+        self.reached = set()  # the ends of the paths already followed
+        self._tries = 0
+        self.path = find_path(player.pos, self.reached)
+
+    def __call__(self):
+        if not self.path:
+            self.path = self.find_path(self.player.pos, self.reached)
+            if not self.path:
+                return False
+        (x, y) = self.path[0]
+        if self.player.run(dx=x - self.player.x, dy=y - self.player.y):
+            self.path.pop(0)
+            self._tries = 0
+            if not self.path:
+                self.reached.add(self.player.pos)
+            return True
+        # Not moved: the door is maybe open now, try again once
+        self._tries += 1
+        self.path = None
+        return self._tries < 2
+
+
 """
 QUESTS RELATED STUFF
 THE ADVENTURER
@@ -0,0 +1,285 @@
+import cProfile
+import csv
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import pygame as pg
+
+from settings import *
+from utilities_ui import FontManager
+
+"""
+Instrumentation of the game loop.
+FrameProfiler times each frame, split in named sections (the screen events, update and draw, then inside them the
+ticker, the AI turns, the fog of war...). The last frames are kept to compute rolling percentiles, shown in an overlay
+(F3 in the game) or written to a CSV file, one line per frame (F4 in the game).
+TurnProfiler captures what happens in a few game turns, or during a level change, with cProfile and by sampling the
+stacks. It is started with F5 in the game or by the LORDCROCKET_PROFILE environment variable.
+"""
+
+PROFILE_VARIABLE = "LORDCROCKET_PROFILE"
+
+
+class FrameProfiler:
+    """
+    Time the frames and their sections. The sections can be nested (the time of the inner ones is also counted in
+    the outer one), and a section can run several times in a frame: its times are added.
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, frame_number=PROFILER_FRAMES):
+        """
+        :param frame_number: the number of frames kept
+        """
+        self.frames = deque(maxlen=frame_number)  # for each frame: section -> milliseconds, "frame" for the total
+        self.sections = []  # the section names, in the order they were first seen
+        self.overlay_enabled = False
+        self._current = None
+        self._frame_start = 0
+        self._overlay = None
+        self._frames_since_overlay = 0
+
+    def begin_frame(self):
+        self._current = {}
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if self._current is None:
+            return
+        self._current["frame"] = (time.perf_counter() - self._frame_start) * 1000
+        self.frames.append(self._current)
+        self._current = None
+
+    @contextmanager
+    def section(self, name):
+        """
+        Time a section of the frame:
+        with profiler.section("fog"):
+            ...
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def add(self, name, duration):
+        """
+        Add a time to a section of the current frame. Ignored out of a frame (while loading for instance).
+        :param name: the section name
+        :param duration: the time, in milliseconds
+        """
+        if self._current is None:
+            return
+        if name not in self._current:
+            self._current[name] = duration
+            if name not in self.sections:
+                self.sections.append(name)
+        else:
+            self._current[name] += duration
+
+    def percentiles(self, name):
+        """
+        :param name: a section name, or "frame" for the whole frame
+        :return: the PERCENTILES and the maximum of the section time over the frames kept, in milliseconds. A frame
+        where the section did not run counts as 0.
+        """
+        values = sorted(frame.get(name, 0) for frame in self.frames)
+        if not values:
+            return [0] * (len(FrameProfiler.PERCENTILES) + 1)
+        result = []
+        for percentile in FrameProfiler.PERCENTILES:
+            # Nearest rank
+            rank = max(0, -(-percentile * len(values) // 100) - 1)
+            result.append(values[rank])
+        result.append(values[-1])
+        return result
+
+    def toggle_overlay(self):
+        self.overlay_enabled = not self.overlay_enabled
+        self._overlay = None
+
+    def draw(self, surface):
+        """
+        Draw the overlay (if enabled) at the top left of the surface. It is only built again every
+        PROFILER_OVERLAY_REFRESH frames, so that it can be read.
+        """
+        if not self.overlay_enabled:
+            return
+        self._frames_since_overlay += 1
+        if self._overlay is None or self._frames_since_overlay >= PROFILER_OVERLAY_REFRESH:
+            self._overlay = self._build_overlay()
+            self._frames_since_overlay = 0
+        surface.blit(self._overlay, (10, 40))
+
+    def _build_overlay(self):
+        font = FontManager.get_font(12)
+        # The texts change all the time: rendered directly, not through the FontManager cache
+        lines = ["{:<12}".format("ms") + "".join("{:>8}".format("p{}".format(percentile))
+                                                 for percentile in FrameProfiler.PERCENTILES) + "{:>8}".format("max")]
+        for name in ["frame"] + self.sections:
+            lines.append("{:<12}".format(name[:12]) + "".join("{:>8.2f}".format(value)
+                                                              for value in self.percentiles(name)))
+        rendered = [font.render(line, True, WHITE) for line in lines]
+        overlay = pg.Surface((max(text.get_width() for text in rendered) + 10,
+                              sum(text.get_height() for text in rendered) + 10), pg.SRCALPHA, 32)
+        overlay.fill((0, 0, 0, 160))
+        y = 5
+        for text in rendered:
+            overlay.blit(text, (5, y))
+            y += text.get_height()
+        return overlay
+
+    def dump(self, filename=None):
+        """
+        Write the frames kept to a CSV file: one line per frame, one column per section (in milliseconds)
+        :param filename: the file, by default a new file in PROFILER_FOLDER
+        :return: the file name
+        """
+        if filename is None:
+            os.makedirs(PROFILER_FOLDER, exist_ok=True)
+            filename = os.path.join(PROFILER_FOLDER, "frames_{}.csv".format(time.strftime("%Y%m%d_%H%M%S")))
+        columns = ["frame"] + self.sections
+        with open(filename, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for frame in self.frames:
+                writer.writerow(["{:.3f}".format(frame.get(name, 0)) for name in columns])
+        print("Frame times written to {}".format(filename))
+        return filename
+
+
+class _StackSampler(threading.Thread):
+    """
+    Sample the stack of a thread at regular intervals, and count the stacks seen
+    """
+
+    def __init__(self, thread_id, interval):
+        threading.Thread.__init__(self, daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # "file:function;file:function..." from the outer call -> number of samples
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            calls = []
+            while frame is not None:
+                calls.append("{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                frame = frame.f_back
+            if calls:
+                self.stacks[";".join(reversed(calls))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class TurnProfiler:
+    """
+    Capture a profile around a window of game turns (a turn being an advance of the ticker), or around a level change.
+    * F5 in the game starts a capture of the next PROFILER_TURNS turns (or stops the current one)
+    * with the LORDCROCKET_PROFILE environment variable, the first turns of a game and all the level changes are
+    captured
+    When no capture runs, it costs a test per turn.
+    Two files are written in PROFILER_FOLDER, named after the ticks, the level and its seed:
+    * .pstats: the cProfile statistics (to be read with pstats, snakeviz...)
+    * .folded: the sampled stacks, one line per stack followed by its count (flamegraph.pl, speedscope...)
+    """
+
+    def __init__(self, turn_number=PROFILER_TURNS):
+        """
+        :param turn_number: the number of turns captured
+        """
+        self.enabled = os.environ.get(PROFILE_VARIABLE) is not None
+        self.turn_number = turn_number
+        self._profile = None
+        self._sampler = None
+        self._turns_left = 0
+        self._first_tick = 0
+
+    @property
+    def capturing(self):
+        return self._profile is not None
+
+    def _begin(self):
+        self._sampler = _StackSampler(threading.get_ident(), PROFILER_SAMPLE_INTERVAL)
+        self._profile = cProfile.Profile()
+        self._sampler.start()
+        self._profile.enable()
+
+    def _end(self, name):
+        self._profile.disable()
+        self._sampler.stop()
+        os.makedirs(PROFILER_FOLDER, exist_ok=True)
+        filename = os.path.join(PROFILER_FOLDER, name)
+        self._profile.dump_stats(filename + ".pstats")
+        with open(filename + ".folded", "w") as f:
+            for stack, count in sorted(self._sampler.stacks.items()):
+                f.write("{} {}\n".format(stack, count))
+        print("Profile written to {}.pstats and {}.folded".format(filename, filename))
+        self._profile = None
+        self._sampler = None
+        return filename
+
+    def start(self, game, turn_number=None):
+        """
+        Start a capture, that will stop by itself after some turns
+        :param game: the game
+        :param turn_number: the number of turns, by default the one given at creation
+        """
+        if self.capturing:
+            return
+        self._turns_left = turn_number if turn_number is not None else self.turn_number
+        self._first_tick = game.ticker.ticks
+        self._begin()
+
+    def stop(self, game):
+        """
+        Stop the current capture and write it
+        :return: the file name (without extension), None if there was no capture
+        """
+        if not self.capturing:
+            return None
+        return self._end("turns_{}-{}_level{}_seed{}".format(self._first_tick, game.ticker.ticks,
+                                                             game.level, game.level_seed))
+
+    def toggle(self, game):
+        if self.capturing:
+            self.stop(game)
+        else:
+            self.start(game)
+
+    def turn_done(self, game):
+        """
+        To be called after each turn
+        """
+        if self._profile is None:
+            return
+        self._turns_left -= 1
+        if self._turns_left <= 0:
+            self.stop(game)
+
+    @contextmanager
+    def level_change(self, game):
+        """
+        Capture a level change (if enabled, and if no capture already runs):
+        with turn_profiler.level_change(game):
+            ...
+        """
+        if not self.enabled or self.capturing:
+            yield
+            return
+        first_tick = game.ticker.ticks
+        from_level = game.level
+        self._begin()
+        try:
+            yield
+        finally:
+            self._end("level{}-{}_tick{}_seed{}".format(from_level, game.level, first_tick, game.level_seed))
@@ -1,11 +1,10 @@
 import pygame as pg
 import constants as c
-import dill as pick
 
 from settings import *
-from os import path
-from entities import ThrowableHelper, NPCHelper
-from utilities_ui import Button, LogBox
+from os import makedirs, path
+import commands
+from utilities_ui import Button, LogBox, FontManager
 
 
 class Screen:
@@ -14,6 +13,20 @@ class Screen:
         self.game = game
         self.default_back_state = default_back_state
         self.widgets = []
+        self.dirty = True  # the screen must be drawn again
+
+    def needs_redraw(self):
+        """
+        Tell if the screen changed since it was last drawn. The screens set dirty when something they show changed,
+        the game loop sets it on each event.
+        """
+        return self.dirty
+
+    def invalidate(self):
+        """
+        The whole screen must be drawn again (another screen was shown in between)
+        """
+        self.dirty = True
 
     def test(self, *args, **kwargs):
         print("Test {} {}".format(args, kwargs))
@@ -42,7 +55,8 @@ class InventoryScreen(Screen):
         self.equipment_list_value = 0  # Used if more equipment are available than 2 lines
 
         self.selected_item = None
-        self.font = pg.font.Font(path.join(path.join(path.dirname(__file__), FONT_FOLDER), FONT_NAME), 10)
+        self.font_size = 10
+        self.font = FontManager.get_font(self.font_size)
 
         x_icon = game.screen.get_rect().width - 2 * self.tile_size
         width = game.all_images["ICON_EQUIP"].get_rect().width
@@ -103,7 +117,7 @@ class InventoryScreen(Screen):
 
     def events(self):
         # catch all events here
-        for event in pg.event.get():
+        for event in self.game.get_events():
             handled = False
             for widget in self.widgets:
                 if not handled:
@@ -214,7 +228,7 @@ class InventoryScreen(Screen):
 
         final_surface = pg.Surface((int(width), int(height * len(lines))))
         for index, line in enumerate(lines):
-            final_surface.blit(self.font.render(line, True, WHITE), (0, index * height))
+            final_surface.blit(FontManager.render(line, self.font_size, WHITE), (0, index * height))
         return final_surface
 
     def draw(self):
@@ -344,14 +358,12 @@ class MapScreen(Screen):
 
     def __init__(self, game, default_back_state):
         Screen.__init__(self, game, default_back_state)
-        game_folder = path.dirname(__file__)
-        font_folder = path.join(game_folder, FONT_FOLDER)
-        self.font = pg.font.Font(path.join(font_folder, FONT_NAME), 12)
+        self.font = FontManager.get_font(12)
 
     def events(self):
 
         # catch all events here
-        for event in pg.event.get():
+        for event in self.game.get_events():
             if event.type == pg.QUIT:
                 self.game.quit()
             if event.type == pg.KEYDOWN:
@@ -366,7 +378,7 @@ class MapScreen(Screen):
         self.game.screen.blit(map_image, (int((self.game.screen.get_width() - map_image.get_width()) / 2),
                                           int((self.game.screen.get_height() - map_image.get_height()) / 2)))
 
-        text = self.font.render(self.game.map.name, 1, WHITE)
+        text = FontManager.render(self.game.map.name, 12, WHITE)
         pos_x = int((self.game.screen.get_width() - text.get_width()) / 2)
         self.game.screen.blit(text, (pos_x, self.game.screen.get_height() - 40))
 
@@ -380,9 +392,8 @@ class CharacterScreen(Screen):
 
     def __init__(self, game, default_back_state):
         Screen.__init__(self, game, default_back_state)
-        game_folder = path.dirname(__file__)
-        font_folder = path.join(game_folder, FONT_FOLDER)
-        self.font = pg.font.Font(path.join(font_folder, FONT_NAME), 12)
+        self.font_size = 12
+        self.font = FontManager.get_font(self.font_size)
         self._surface = None
         self._lines = None
         self.last_update = pg.time.get_ticks()
@@ -438,7 +449,7 @@ class CharacterScreen(Screen):
     def events(self):
 
         # catch all events here
-        for event in pg.event.get():
+        for event in self.game.get_events():
             if event.type == pg.QUIT:
                 self.game.quit()
             if event.type == pg.KEYDOWN:
@@ -456,7 +467,7 @@ class CharacterScreen(Screen):
 
         final_surface = pg.Surface((int(width), int(height * len(self._lines))))
         for index, line in enumerate(self._lines):
-            final_surface.blit(self.font.render(line, True, WHITE), (0, index * height))
+            final_surface.blit(FontManager.render(line, self.font_size, WHITE), (0, index * height))
         self._surface = final_surface
 
     def draw(self):
@@ -473,24 +484,34 @@ class CharacterScreen(Screen):
         delta = 1000
         if now - self.last_update > delta:
             self.last_update = now
+            lines = self._lines
             self.build_surface()
+            if self._lines != lines:
+                self.dirty = True
 
 
 class HealthBarWidget:
 
+    BAR_WIDTH = 200
+    BAR_HEIGHT = 20
+
     def __init__(self, position, player_fighter):
         self.position = position
         self.fighter = player_fighter
-        self.font = pg.font.Font(path.join(path.join(path.dirname(__file__), FONT_FOLDER), FONT_NAME), 10)
+        self.font = FontManager.get_font(10)
+        self.area = pg.Rect(position, (HealthBarWidget.BAR_WIDTH, HealthBarWidget.BAR_HEIGHT))
+        self.force_render = True
+        self._shown_health = None
 
     def get_event(self, event):
         pass
 
     def draw(self, surface):
+        self.force_render = False
         x, y = self.position
-        bar_height = 20
+        bar_height = HealthBarWidget.BAR_HEIGHT
         if self.fighter is not None:
-            bar_width_total = 200
+            bar_width_total = HealthBarWidget.BAR_WIDTH
             # First, we create the interior rectangle
             total_health_possible = self.fighter.owner.base_body_points + self.fighter.owner.base_hit_points
             total_health = self.fighter.body_points + self.fighter.hit_points
@@ -510,17 +531,36 @@ class HealthBarWidget:
                                total_health_possible)
             pg.draw.rect(surface, WHITE, pg.Rect(x, y, bar_width_bp, bar_height), 2)
             # And last, some text
-            label_surface = self.font.render("{}/{}".format(total_health, total_health_possible), 1, color_text)
+            label_surface = FontManager.render("{}/{}".format(total_health, total_health_possible), 10, color_text)
             label_rect = label_surface.get_rect()
             label_rect.center = (x + int(bar_width_bp / 2), y + int(bar_height / 2))
             surface.blit(label_surface, label_rect)
 
     def update(self):
-        pass
+        if self.fighter is not None:
+            health = (self.fighter.body_points, self.fighter.hit_points,
+                      self.fighter.owner.base_body_points, self.fighter.owner.base_hit_points)
+            if health != self._shown_health:
+                self._shown_health = health
+                self.force_render = True
 
 
 class PlayingScreen(Screen):
 
+    # The keys acting on the screen only (the other ones are commands, see commands.py): key -> method
+    SCREEN_KEYS = {pg.K_m: "toggle_minimap",
+                   pg.K_F3: "toggle_profiler_overlay",
+                   pg.K_F4: "dump_frame_profile",
+                   pg.K_F5: "toggle_turn_profile",
+                   pg.K_F6: "toggle_message_metrics",
+                   pg.K_F7: "toggle_ticker_stats",
+                   pg.K_F8: "save_command_log",
+                   pg.K_p: "show_map",
+                   pg.K_f: "show_character",
+                   pg.K_i: "show_inventory",
+                   pg.K_y: "enter_spell_mode",
+                   pg.K_r: "toggle_music"}
+
     def __init__(self, game, default_back_state):
         Screen.__init__(self, game, default_back_state)
         self.fog_of_war_mask = None
@@ -531,45 +571,41 @@ class PlayingScreen(Screen):
 
         self.widgets.append(HealthBarWidget((10, 10), game.player.fighter))
         self.in_spell_mode = False
+        self._last_ticks = None
+        self._sprite_signature = None
+        self._shown_sprites = None  # sprite -> (image id, rect on the screen) at the last display update
+        self._view = None
 
+    def invalidate(self):
+        Screen.invalidate(self)
+        self._shown_sprites = None
 
     def draw(self):
         # Erase All
         self.game.screen.fill(BGCOLOR)
 
         # Background
-        self.game.screen.blit(self.game.map.background,
-                              self.game.camera.apply_rect(pg.Rect(0, 0,
-                                                                  self.game.map.background.get_width(),
-                                                                  self.game.map.background.get_height())))
+        with self.game.profiler.section("background"):
+            self.game.map.draw_background(self.game.screen, self.game.camera)
         # Sprites
-        for group in self.game.all_groups:
-            for sprite in group:
-                self.game.screen.blit(sprite.image, self.game.camera.apply(sprite))
+        shown_sprites = {}
+        with self.game.profiler.section("sprites"):
+            for group in self.game.all_groups:
+                for sprite in group:
+                    rect = self.game.camera.apply(sprite)
+                    self.game.screen.blit(sprite.image, rect)
+                    shown_sprites[sprite] = (id(sprite.image), rect)
 
         # FOW
         map_rebuild = False
         if self.game.player.invalidate_fog_of_war or self.fog_of_war_mask is None:
-
-            self.fog_of_war_mask = pg.Surface((self.game.screen.get_rect().width,
-                                               self.game.screen.get_rect().height), pg.SRCALPHA, 32)
-
-            black = pg.Surface((TILESIZE_SCREEN, TILESIZE_SCREEN))
-            black.fill(BGCOLOR)
-            gray = pg.Surface((TILESIZE_SCREEN, TILESIZE_SCREEN), pg.SRCALPHA, 32)
-            gray.fill((0, 0, 0, 120))
-            for x in range(self.game.map.tile_width):
-                for y in range(self.game.map.tile_height):
-                    if not self.game.visible_player_array[x][y]:
-                        if self.game.map.tiles[x][y].explored:
-                            self.fog_of_war_mask.blit(gray, self.game.camera.apply_rect(
-                                pg.Rect(x*TILESIZE_SCREEN, y*TILESIZE_SCREEN, TILESIZE_SCREEN, TILESIZE_SCREEN)))
-                        else:
-                            self.fog_of_war_mask.blit(black, self.game.camera.apply_rect(
-                                pg.Rect(x * TILESIZE_SCREEN, y * TILESIZE_SCREEN, TILESIZE_SCREEN, TILESIZE_SCREEN)))
+            with self.game.profiler.section("fog"):
+                self._build_fog_of_war()
             self.game.player.invalidate_fog_of_war = False
 
-            self.game.visible_player_array = self.game.fov.get_vision_matrix_for(self.game.player, flag_explored=True)
+            with self.game.profiler.section("fov"):
+                self.game.visible_player_tiles = self.game.fov.get_visible_tiles_for(self.game.player,
+                                                                                     flag_explored=True)
             map_rebuild = True
 
         self.game.screen.blit(self.fog_of_war_mask, (0, 0))
@@ -586,16 +622,74 @@ class PlayingScreen(Screen):
                                    self.game.minimap.background_mini_map.get_width() - 10, 10))
 
         # Generic Modal Widgets?
-        for widget in self.widgets:
-            widget.draw(self.game.screen)
-
-        pg.display.flip()
+        widget_areas = [widget.area for widget in self.widgets if getattr(widget, "force_render", False)]
+        with self.game.profiler.section("widgets"):
+            for widget in self.widgets:
+                widget.draw(self.game.screen)
+
+        self.game.profiler.draw(self.game.screen)
+        with self.game.profiler.section("flip"):
+            self._update_display(shown_sprites, widget_areas, map_rebuild)
+
+    def _update_display(self, shown_sprites, widget_areas, full):
+        """
+        Send the frame to the display. With DIRTY_RECTS, only the parts that changed are sent: the sprites that moved
+        or changed image (where they were and where they are now) and the widgets drawn again. The whole screen is
+        sent when the view changed: camera scroll, fog of war, minimap, window size, profiler overlay.
+        :param shown_sprites: sprite -> (image id, rect on the screen) for this frame
+        :param widget_areas: the areas of the widgets that changed
+        :param full: True to send the whole screen anyway
+        """
+        view = (self.game.camera.camera.topleft, self.game.screen.get_size(), self.game.minimap_enable,
+                self.game.profiler.overlay_enabled)
+        previous = self._shown_sprites
+        full = full or not DIRTY_RECTS or previous is None or view != self._view or \
+            self.game.profiler.overlay_enabled
+        self._shown_sprites = shown_sprites
+        self._view = view
+        if full:
+            pg.display.flip()
+            return
+
+        screen_rect = self.game.screen.get_rect()
+        rects = widget_areas
+        for sprite, shown in shown_sprites.items():
+            if previous.get(sprite) != shown:
+                rects.append(shown[1])
+        for sprite, shown in previous.items():
+            if shown_sprites.get(sprite) != shown:
+                rects.append(shown[1])
+        rects = [screen_rect.clip(rect) for rect in rects if screen_rect.colliderect(rect)]
+        if rects:
+            pg.display.update(rects)
+
+    def _build_fog_of_war(self):
+        self.fog_of_war_mask = pg.Surface((self.game.screen.get_rect().width,
+                                           self.game.screen.get_rect().height), pg.SRCALPHA, 32)
+
+        black = pg.Surface((TILESIZE_SCREEN, TILESIZE_SCREEN))
+        black.fill(BGCOLOR)
+        gray = pg.Surface((TILESIZE_SCREEN, TILESIZE_SCREEN), pg.SRCALPHA, 32)
+        gray.fill((0, 0, 0, 120))
+        # Only the tiles on the screen
+        (x_min, y_min, x_max, y_max) = self.game.camera.tile_area(self.game.screen.get_width(),
+                                                                  self.game.screen.get_height(),
+                                                                  self.game.map.tile_width,
+                                                                  self.game.map.tile_height)
+        for x in range(x_min, x_max):
+            for y in range(y_min, y_max):
+                if (x, y) not in self.game.visible_player_tiles:
+                    if self.game.map.tiles[x][y].explored:
+                        self.fog_of_war_mask.blit(gray, self.game.camera.apply_rect(
+                            pg.Rect(x*TILESIZE_SCREEN, y*TILESIZE_SCREEN, TILESIZE_SCREEN, TILESIZE_SCREEN)))
+                    else:
+                        self.fog_of_war_mask.blit(black, self.game.camera.apply_rect(
+                            pg.Rect(x * TILESIZE_SCREEN, y * TILESIZE_SCREEN, TILESIZE_SCREEN, TILESIZE_SCREEN)))
 
     def events(self):
 
         # catch all events here
-
-        for event in pg.event.get():
+        for event in self.game.get_events():
             handled = False
             for widget in self.widgets:
                 if not handled:
@@ -617,127 +711,18 @@ class PlayingScreen(Screen):
                 self.game.player.invalidate_fog_of_war = True
                 self.game.textbox.resize(old_rect.width, old_rect.height, event.w, event.h)
 
-            if self.in_spell_mode and event.type == pg.KEYDOWN:
-                if event.key in (pg.K_LEFT, pg.K_q, pg.K_KP4):
-                    ThrowableHelper(self.game, self.game.player.pos, "FIREBALL", (-1, 0),
-                                    ThrowableHelper.light_damage,
-                                    stopped_by=[c.T_WALL, c.T_VOID])
-                    self.in_spell_mode = False
-                    self.game.ticker.ticks_to_advance += self.game.player.speed_cost_for(c.AC_SPELL)
-
-                if event.key in (pg.K_RIGHT, pg.K_d, pg.K_KP6):
-                    ThrowableHelper(self.game, self.game.player.pos, "FIREBALL", (1, 0),
-                                    ThrowableHelper.light_damage,
-                                    stopped_by=[c.T_WALL, c.T_VOID])
-                    self.in_spell_mode = False
-                    self.game.ticker.ticks_to_advance += self.game.player.speed_cost_for(c.AC_SPELL)
-
-                if event.key in (pg.K_UP, pg.K_z, pg.K_KP8):
-                    ThrowableHelper(self.game, self.game.player.pos, "FIREBALL", (0, -1),
-                                    ThrowableHelper.light_damage,
-                                    stopped_by=[c.T_WALL, c.T_VOID])
-                    self.in_spell_mode = False
-                    self.game.ticker.ticks_to_advance += self.game.player.speed_cost_for(c.AC_SPELL)
-
-                if event.key in (pg.K_DOWN, pg.K_x, pg.K_KP2):
-                    ThrowableHelper(self.game, self.game.player.pos, "FIREBALL", (0, 1),
-                                    ThrowableHelper.light_damage,
-                                    stopped_by=[c.T_WALL, c.T_VOID])
-                    self.in_spell_mode = False
-                    self.game.ticker.ticks_to_advance += self.game.player.speed_cost_for(c.AC_SPELL)
-
-                if event.key in (pg.K_KP7, pg.K_a):
-                    ThrowableHelper(self.game, self.game.player.pos, "FIREBALL", (-1, -1),
-                                    ThrowableHelper.light_damage,
-                                    stopped_by=[c.T_WALL, c.T_VOID])
-                    self.in_spell_mode = False
-                    self.game.ticker.ticks_to_advance += self.game.player.speed_cost_for(c.AC_SPELL)
-
-                if event.key in (pg.K_KP9, pg.K_e):
-                    ThrowableHelper(self.game, self.game.player.pos, "FIREBALL", (1, -1),
-                                    ThrowableHelper.light_damage,
-                                    stopped_by=[c.T_WALL, c.T_VOID])
-                    self.in_spell_mode = False
-                    self.game.ticker.ticks_to_advance += self.game.player.speed_cost_for(c.AC_SPELL)
-
-                if event.key in (pg.K_KP1, pg.K_w):
-                    ThrowableHelper(self.game, self.game.player.pos, "FIREBALL", (-1, 1),
-                                    ThrowableHelper.light_damage,
-                                    stopped_by=[c.T_WALL, c.T_VOID])
-                    self.in_spell_mode = False
-                    self.game.ticker.ticks_to_advance += self.game.player.speed_cost_for(c.AC_SPELL)
-
-                if event.key in (pg.K_KP3, pg.K_c):
-                    ThrowableHelper(self.game, self.game.player.pos, "FIREBALL", (1, 1),
-                                    ThrowableHelper.light_damage,
-                                    stopped_by=[c.T_WALL, c.T_VOID])
-                    self.in_spell_mode = False
-                    self.game.ticker.ticks_to_advance += self.game.player.speed_cost_for(c.AC_SPELL)
+            if event.type == pg.KEYDOWN and self.game.player.activity is not None:
+                # Any key stops the action in progress
+                self.game.commands.push(commands.StopActivity())
 
             elif event.type == pg.KEYDOWN:
-                if event.key in (pg.K_LEFT, pg.K_q, pg.K_KP4):
-                    self.game.player.move(dx=-1)
-                if event.key in (pg.K_RIGHT, pg.K_d, pg.K_KP6):
-                    self.game.player.move(dx=1)
-                if event.key in (pg.K_UP, pg.K_z, pg.K_KP8):
-                    self.game.player.move(dy=-1)
-                if event.key in (pg.K_DOWN, pg.K_x, pg.K_KP2):
-                    self.game.player.move(dy=1)
-                if event.key in (pg.K_KP7, pg.K_a):
-                    self.game.player.move(dx=-1, dy=-1)
-                if event.key in (pg.K_KP9, pg.K_e):
-                    self.game.player.move(dx=1, dy=-1)
-                if event.key in (pg.K_KP1, pg.K_w):
-                    self.game.player.move(dx=-1, dy=1)
-                if event.key in (pg.K_KP3, pg.K_c):
-                    self.game.player.move(dx=1, dy=1)
-                if event.key == pg.K_m:
-                    self.game.minimap_enable = not self.game.minimap_enable
-                    print("Minimap state: {}".format(self.game.minimap_enable))
-                if event.key == pg.K_p:
-                    self.game.game_state = c.GAME_STATE_MAP
-                if event.key == pg.K_f:
-                    self.game.game_state = c.GAME_STATE_CHARACTER
-                if event.key == pg.K_i:
-                    self.game.game_state = c.GAME_STATE_INVENTORY
-                if event.key == pg.K_g:
-                    for item in self.game.objects:
-                        if (item.x, item.y) == (self.game.player.x, self.game.player.y) and item.item:
-                            item.item.pick_up()
-
-                if event.key == pg.K_y:
-                    self.in_spell_mode = True
-
-                if event.key == pg.K_n:
-                    self.game.go_next_level()
-                    return
-
-                if event.key == pg.K_h:
-                    (x, y) = self.game.player.pos
-                    x += 1
-                    NPCHelpe2r(self.game, "Companion", (x, y), "GUARD_M")
-                if event.key == pg.K_r:
-                    # First, make sure that the music system is unabled
-                    if not hasattr(self.game, "soundfiles"):
-                        self.game.load_music()
-
-                    if self.game.music_playing:
-                        pg.mixer.music.pause()
-                    else:
-                        pg.mixer.music.unpause()
-                    self.game.music_playing = not self.game.music_playing
-
-                if event.key == pg.K_s:
-                    print("SAVING and EXIT")
-                    # We cleanup all objects
-                    for entities in self.game.objects:
-                        entities.clean_before_save()
-                    self.game.map.clean_before_save()
-                    for entities in self.game.player.inventory:
-                        entities.clean_before_save()
-                    with open("savegame", "wb") as f:
-                        pick.dump([self.game.objects, self.game.map, self.game.player.name, self.game.all_groups], f)
-                    self.game.quit()
+                # The keys acting on the game are queued as commands, the other ones act on the screen at once
+                command = commands.command_for_key(event.key, event.mod, spell_mode=self.in_spell_mode)
+                if command is not None:
+                    self.game.commands.push(command)
+                    self.in_spell_mode = False
+                elif not self.in_spell_mode and event.key in PlayingScreen.SCREEN_KEYS:
+                    getattr(self, PlayingScreen.SCREEN_KEYS[event.key])()
 
             if event.type == pg.MOUSEBUTTONDOWN:
                 (button1, button2, button3) = pg.mouse.get_pressed()
@@ -752,10 +737,87 @@ class PlayingScreen(Screen):
                         for entity in self.game.objects:
                             if entity.x == x and entity.y == y:
                                 print(entity.name)
+                if button3:
+                    # Travel to the tile
+                    (rev_x, rev_y) = self.game.camera.reverse((x, y))
+                    self.game.commands.push(commands.Travel(int(rev_x / TILESIZE_SCREEN),
+                                                            int(rev_y / TILESIZE_SCREEN)))
+
+    def toggle_minimap(self):
+        self.game.minimap_enable = not self.game.minimap_enable
+        print("Minimap state: {}".format(self.game.minimap_enable))
+
+    def toggle_profiler_overlay(self):
+        self.game.profiler.toggle_overlay()
+
+    def dump_frame_profile(self):
+        self.game.profiler.dump()
+
+    def toggle_turn_profile(self):
+        self.game.turn_profiler.toggle(self.game)
+
+    def toggle_message_metrics(self):
+        if self.game.bus.metrics is None:
+            self.game.bus.enable_metrics(report_interval=PUBLISHER_REPORT_INTERVAL)
+            print("Message metrics enabled")
+        else:
+            print(self.game.bus.disable_metrics().report())
+
+    def toggle_ticker_stats(self):
+        if self.game.ticker.stats is None:
+            self.game.ticker.enable_stats(budget=TICKER_TURN_BUDGET)
+            print("Ticker statistics enabled")
+        else:
+            makedirs(PROFILER_FOLDER, exist_ok=True)
+            filename = path.join(PROFILER_FOLDER, "ticker_{}.json".format(self.game.ticker.ticks))
+            self.game.ticker.disable_stats().export(filename)
+            print("Ticker statistics written to {}".format(filename))
+
+    def save_command_log(self):
+        makedirs(REPLAY_FOLDER, exist_ok=True)
+        self.game.commands.save_log(path.join(REPLAY_FOLDER, "commands_{}.json".format(self.game.ticker.ticks)),
+                                    self.game.game_seed)
+
+    def show_map(self):
+        self.game.game_state = c.GAME_STATE_MAP
+
+    def show_character(self):
+        self.game.game_state = c.GAME_STATE_CHARACTER
+
+    def show_inventory(self):
+        self.game.game_state = c.GAME_STATE_INVENTORY
+
+    def enter_spell_mode(self):
+        self.in_spell_mode = True
+
+    def toggle_music(self):
+        # First, make sure that the music system is unabled
+        if not hasattr(self.game, "soundfiles"):
+            self.game.load_music()
+
+        if self.game.music_playing:
+            pg.mixer.music.pause()
+        else:
+            pg.mixer.music.unpause()
+        self.game.music_playing = not self.game.music_playing
 
     def update(self):
         # Update actions
-        self.game.ticker.advance_ticks()
+        # The commands waiting are executed now, as long as the ticker allows, before the next frame is drawn
+        with self.game.profiler.section("commands"):
+            self.game.commands.execute(self.game, budget=TICKER_FRAME_BUDGET)
+        # An action over several turns is played in fast forward: only one frame is drawn per FAST_FORWARD_BUDGET
+        if self.game.player.activity is not None and not self.game.ticker.busy:
+            with self.game.profiler.section("fast forward"):
+                self.game.player.activity.run(FAST_FORWARD_BUDGET)
+        # A long action is spread over several frames, so that they keep their pace
+        with self.game.profiler.section("ticker"):
+            self.game.ticker.advance_ticks(budget=TICKER_FRAME_BUDGET)
+        if not self.game.ticker.busy:
+            # The autosaves are taken at the end of the turns (see Game.turn_done), but a save requested by a level
+            # change does not wait for the next turn. The chunks drawn since the turn are populated first.
+            self.game.populate_new_chunks()
+            self.game.autosaver.update(self.game)
         # update visual portion of the game loop
         for group in self.game.all_groups:
             group.update()
@@ -765,3 +827,30 @@ class PlayingScreen(Screen):
         for widget in self.widgets:
             widget.update()
 
+        # Something to show?
+        if self.game.ticker.ticks != self._last_ticks:
+            self._last_ticks = self.game.ticker.ticks
+            self.dirty = True
+        if self.game.player.invalidate_fog_of_war or any(getattr(widget, "force_render", False)
+                                                         for widget in self.widgets):
+            self.dirty = True
+        sprite_signature = self.build_sprite_signature()
+        if sprite_signature != self._sprite_signature:
+            self._sprite_signature = sprite_signature
+            self.dirty = True
+
+    def build_sprite_signature(self):
+        """
+        Describe what the sprites look like on the screen: their images and positions, for the ones in view only (the
+        animation of a monster out of the screen does not need a redraw).
+        :return: a value that changes when the sprites shown change
+        """
+        view = self.game.screen.get_rect()
+        signature = [self.game.camera.camera.topleft]
+        for group in self.game.all_groups:
+            for sprite in group:
+                rect = self.game.camera.apply(sprite)
+                if view.colliderect(rect):
+                    signature.append((id(sprite.image), rect.topleft))
+        return signature
+
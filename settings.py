@@ -18,6 +18,8 @@ BLUE = (0, 0, 255)
 PLAYABLE_WIDTH = 768   # 16 * 64 or 32 * 32 or 64 * 16
 PLAYABLE_HEIGHT = 768  # 16 * 48 or 32 * 24 or 64 * 12
 FPS = 60
+DIRTY_RECTS = True  # only send the changed parts of the playing screen to the display (else a full flip)
+IDLE_WAIT_MS = 50  # longest sleep on the event queue when nothing changed (animations are checked this often)
 BGCOLOR = BLACK
 
 TILESIZE_SCREEN = 48
@@ -43,10 +45,40 @@ IMG_ORYX_SUB = 'oryx'
 IMG_PIXEL_SUB = 'pixel'
 IMG_ICONS = 'icons'
 SOUND_FOLDER = 'sound'
+SAVEGAME_FILENAME = 'savegame'
+AUTOSAVE_FILENAME = 'autosave'
+AUTOSAVE_SLOTS = 3  # number of autosaves kept
+AUTOSAVE_INTERVAL = 500  # ticks between two autosaves (a move of the player is about 10 ticks)
+LEVEL_STORE_MEMORY = 2 * 1024 * 1024  # bytes of left levels kept in memory, the older ones go to temporary files
+MAP_CACHE_FOLDER = None  # set to a folder to keep the generated maps by seed (benchmarks, test scenarios)
+MAP_DIMENSION = (81, 121)  # size of the generated levels, in tiles
+LARGE_MAP_TILES = 250000  # above this number of tiles, a level is a cave generated by chunks, when explored
+MAP_CHUNK_SIZE = 16  # size of the chunks of the large maps, in tiles
+MAP_CHUNK_SURFACES = 12  # number of chunk images of the large maps kept (the last drawn)
+PATH_MAX_NODES = 10000  # maximum number of tiles looked at when searching a path tile by tile
+PROFILER_FRAMES = 240  # frames kept by the frame profiler (F3 to show, F4 to write them to a file)
+PROFILER_OVERLAY_REFRESH = 20  # frames between two refreshes of the profiler overlay
+PROFILER_FOLDER = 'profiles'  # where the profiler files are written
+REPLAY_FOLDER = 'replays'  # where the command logs are written (F8 in the game)
+PROFILER_TURNS = 20  # turns captured by the turn profiler (F5, or LORDCROCKET_PROFILE environment variable)
+PROFILER_SAMPLE_INTERVAL = 0.005  # seconds between two stack samples of the turn profiler
+PUBLISHER_METRICS = False  # measure the messages and their subscribers from the start (else F6 in the game)
+PUBLISHER_REPORT_INTERVAL = 60  # seconds between two reports of the message metrics, 0 for none
+TICKER_STATS = False  # record the actors run by the ticker from the start (else F7 in the game)
+TICKER_TURN_BUDGET = 0.005  # seconds an actor turn should not exceed (the slower ones are recorded)
+TICKER_FRAME_BUDGET = 0.015  # seconds of simulation per frame: the longer actions are spread over several frames
+FAST_FORWARD_BUDGET = 0.1  # seconds of turns played without drawing when resting or running
+REST_TURNS = 20  # turns of rest with the '.' key
+RUN_TURNS = 50  # maximum steps of a run (shift + direction)
+COMMAND_QUEUE_SIZE = 4  # commands waiting to be executed (the keys pressed when it is full are dropped)
+TRAVEL_TURNS = 1000  # maximum steps of a travel (right click) or of an automatic exploration ('o' key)
+NPC_NAME_BATCH = 10  # NPC names generated at once (see Game.new_npc_name)
 
 FONT_FOLDER = 'font'
 # FONT_NAME = 'unispace.ttf'
 FONT_NAME = 'SourceCodePro-Regular.otf'
+TEXT_CACHE_SIZE = 256  # number of rendered texts kept in memory
+LOG_HISTORY_SIZE = 200  # number of messages kept in the log box
 
 # ITEMS CHARACTERISTICS
 # POTIONS (these are percentage)
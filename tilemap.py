@@ -1,16 +1,27 @@
 import pygame as pg
 from settings import *
+import mmap
+import os
 import random
+from collections import OrderedDict, deque
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
 from os import path
 import constants as c
 import utilities as ut
 
+MAP_FORMAT_VERSION = 2
+GENERATOR_VERSION = 4  # to be increased each time the generation of a map from a seed changes
+
 
 class Tile:
     """
     A tile of the map and its properties
     """
-    
+    __slots__ = ("tile_type", "explored", "room")  # there are many tiles: lighter and faster to create
+
     def __init__(self, tile_type=c.T_VOID, room=None):
         self.tile_type = tile_type
         self.explored = False
@@ -49,7 +60,6 @@ class Room:
         self.position = position
         self.name = Room._name_generator()
         self.doors = []
-        self.connecting_room = []
 
     @staticmethod
     def _name_generator():
@@ -81,21 +91,205 @@ class Room:
         return tiles
 
 
+class RoomGraph:
+    """
+    The connections between the rooms of a map: the rooms are the nodes, the doors the edges.
+    Built during the generation of the map, and used to check that the rooms are reachable or to find a way from a
+    room to another one.
+    Only the rooms opening on each other (directly or through a tunnel) are linked: rooms opening on a maze are not
+    linked through it.
+    """
+    def __init__(self, rooms=None):
+        self.neighbours = {}  # room -> set of the rooms connected to it
+        self.doors = {}  # (room, other room) -> set of the doors between them, stored for both orders
+        self._component = None  # room -> component number, built when needed
+        if rooms is not None:
+            for room in rooms:
+                self.add_room(room)
+
+    def add_room(self, room):
+        if room not in self.neighbours:
+            self.neighbours[room] = set()
+            self._component = None
+
+    def remove_room(self, room):
+        for other_room in self.neighbours.pop(room, ()):
+            self.neighbours[other_room].discard(room)
+            self.doors.pop((room, other_room), None)
+            self.doors.pop((other_room, room), None)
+        self._component = None
+
+    def connect(self, room, other_room, door=None):
+        """
+        Link two rooms
+        :param door: the position of the door between the rooms, if any
+        """
+        if room is other_room:
+            return
+        self.add_room(room)
+        self.add_room(other_room)
+        self.neighbours[room].add(other_room)
+        self.neighbours[other_room].add(room)
+        doors = self.doors.setdefault((room, other_room), set())
+        self.doors[(other_room, room)] = doors
+        if door is not None:
+            doors.add(tuple(door))
+        self._component = None
+
+    def edges(self):
+        """
+        :return: the list of (room, other room, doors), each connection once
+        """
+        seen = set()
+        edges = []
+        for (room, other_room), doors in self.doors.items():
+            if (other_room, room) not in seen:
+                seen.add((room, other_room))
+                edges.append((room, other_room, doors))
+        return edges
+
+    def reachable_from(self, rooms):
+        """
+        :param rooms: the starting rooms
+        :return: the set of the rooms that can be reached from them, including themselves
+        """
+        visited = set(rooms)
+        to_visit = deque(visited)
+        while to_visit:
+            room = to_visit.popleft()
+            for other_room in self.neighbours.get(room, ()):
+                if other_room not in visited:
+                    visited.add(other_room)
+                    to_visit.append(other_room)
+        return visited
+
+    def components(self):
+        """
+        :return: the list of the sets of rooms connected together
+        """
+        result = []
+        visited = set()
+        for room in self.neighbours:
+            if room not in visited:
+                component = self.reachable_from([room])
+                visited |= component
+                result.append(component)
+        return result
+
+    def connected(self, room, other_room):
+        if self._component is None:
+            self._component = {}
+            for number, component in enumerate(self.components()):
+                for component_room in component:
+                    self._component[component_room] = number
+        return room in self._component and self._component.get(room) == self._component.get(other_room)
+
+    def path(self, start, goal):
+        """
+        Shortest way, in number of rooms, from a room to another one
+        :return: the list of rooms from start to goal (both included), None if there is no way
+        """
+        if start not in self.neighbours or goal not in self.neighbours:
+            return None
+        came_from = {start: None}
+        to_visit = deque([start])
+        while to_visit:
+            room = to_visit.popleft()
+            if room is goal:
+                path = []
+                while room is not None:
+                    path.append(room)
+                    room = came_from[room]
+                path.reverse()
+                return path
+            for other_room in self.neighbours[room]:
+                if other_room not in came_from:
+                    came_from[other_room] = room
+                    to_visit.append(other_room)
+        return None
+
+
+class MapCache:
+    """
+    Keep the generated maps on disk, one file per (dimension, seed, generator version), so that a map generated
+    from a seed is only generated once. The file is the map binary representation (see Map.to_bytes), read through
+    a memory map.
+    The map type is not part of the key: it is drawn from the seed.
+    """
+    def __init__(self, folder, version=GENERATOR_VERSION):
+        self.folder = folder
+        self.version = version
+
+    @staticmethod
+    def default():
+        """
+        :return: the cache set in the settings (MAP_CACHE_FOLDER), None if there is none
+        """
+        if MAP_CACHE_FOLDER is None:
+            return None
+        return MapCache(MAP_CACHE_FOLDER)
+
+    def filename(self, dimension, seed):
+        return path.join(self.folder, "map_{}x{}_{}_v{}.bin".format(dimension[0], dimension[1], seed, self.version))
+
+    def load(self, name, graphical_resources, dimension, seed):
+        """
+        :return: the cached map (renamed), None if not in the cache
+        """
+        filename = self.filename(dimension, seed)
+        if not path.isfile(filename):
+            return None
+        with open(filename, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                level_map = Map.from_bytes(data, graphical_resources)
+            finally:
+                data.close()
+        level_map.name = name
+        return level_map
+
+    def store(self, level_map, dimension, seed):
+        os.makedirs(self.folder, exist_ok=True)
+        filename = self.filename(dimension, seed)
+        # Written aside then moved: another process may be reading the cache
+        temporary_filename = "{}.{}.tmp".format(filename, os.getpid())
+        with open(temporary_filename, "wb") as f:
+            f.write(level_map.to_bytes())
+        os.replace(temporary_filename, filename)
+
+
 class MapFactory:
     """
     Used to generate one of the predefined map type
     """
     def __init__(self, name, graphical_resources,
-                 seed=None, filename=None, dimension=(81, 121)):
+                 seed=None, filename=None, dimension=(81, 121), cache=None):
+        """
+        :param cache: the MapCache used when a seed is given, by default the one of the settings
+        """
 
         random.seed(seed)
 
         map_correctly_initialized = False
         self.map = None
 
+        if cache is None:
+            cache = MapCache.default()
+        if seed is None or filename is not None:
+            cache = None
+
         if filename is not None:
             self.map = FileMap(name, graphical_resources, filename)
-        else:
+        elif cache is not None:
+            self.map = cache.load(name, graphical_resources, dimension, seed)
+            if self.map is not None:
+                # Already cleaned before being stored
+                return
+
+        if self.map is None and dimension[0] * dimension[1] > LARGE_MAP_TILES:
+            # Too large to be generated at once: generated by chunks, when explored
+            self.map = ChunkedCaveMap(name, graphical_resources, dimension)
+        elif self.map is None:
             while not map_correctly_initialized:
                 print(" *** GENERATING DUNGEON *** ")
                 map_type = ut.roll(4)
@@ -115,8 +309,13 @@ class MapFactory:
                 map_correctly_initialized = \
                     len(self.map.get_all_available_tiles(c.T_FLOOR, [],
                                                          without_objects=True)) > all_size / 4
+
         # Make it a bit more beautiful
         self.map.remove_extra_walls()
+        self.map.index_rooms()
+
+        if cache is not None:
+            cache.store(self.map, dimension, seed)
 
 
 class Map:
@@ -124,7 +323,7 @@ class Map:
     The Map, representing a level.
     Mainly holds a reference to a set of tiles, as well as dimensions.
     """
-    def __init__(self, name, graphical_resources, dimension):
+    def __init__(self, name, graphical_resources, dimension, wall_ref_number=None):
 
         self.graphical_resources = graphical_resources
         self.name = name
@@ -135,9 +334,13 @@ class Map:
 
         self.tiles = []
         self.rooms = []
+        self.room_graph = RoomGraph()
         self._doors_pos = None
+        self._doors_pos_set = None
 
-        self.wall_ref_number = random.randint(0, len(self.graphical_resources['WALLS']) - 1)  # we keep this as a ref for later
+        if wall_ref_number is None:
+            wall_ref_number = random.randint(0, len(self.graphical_resources['WALLS']) - 1)
+        self.wall_ref_number = wall_ref_number  # we keep this as a ref for later
         # The following is a trick to adapt the graphics
         self._adapt_graphical_resources(graphical_resources)
 
@@ -155,10 +358,186 @@ class Map:
             self._build_background()
         return self._background
 
+    def draw_background(self, surface, camera):
+        """
+        Draw the part of the background seen through the camera
+        :param surface: the surface to draw on
+        :param camera: the camera
+        """
+        background = self.background
+        surface.blit(background, camera.apply_rect(pg.Rect(0, 0, background.get_width(), background.get_height())))
+
+    def known_bounds(self):
+        """
+        :return: (x min, y min, x max, y max) of the part of the map that exists, the max being excluded
+        """
+        return 0, 0, self.tile_width, self.tile_height
+
+    def known_tile(self, x, y):
+        """
+        :return: the tile, None if it does not exist yet (see ChunkedCaveMap)
+        """
+        return self.tiles[x][y]
+
     def clean_before_save(self):
         self._background = None
         self.graphical_resources = None
 
+    def set_graphical_resources(self, graphical_resources):
+        """
+        Attach the graphical resources to a map that was built without them (loaded from a file for instance)
+        :param graphical_resources: the images of the game
+        :return: Nothing
+        """
+        self.graphical_resources = graphical_resources
+        self._background = None
+        self._adapt_graphical_resources(graphical_resources)
+
+    def to_bytes(self):
+        """
+        Compact binary representation of the map, used for the save games.
+        * header: version, dimensions, wall reference, map class and name
+        * layers (see _layers_to_bytes)
+        :return: the bytes
+        """
+        name = self.name.encode("utf-8")
+        class_name = type(self).__name__.encode("ascii")
+        parts = [struct.pack("<HHHHHH", MAP_FORMAT_VERSION, self.tile_width, self.tile_height,
+                             self.wall_ref_number, len(class_name), len(name)), class_name, name]
+
+        parts += self._layers_to_bytes()
+        return b"".join(parts)
+
+    @staticmethod
+    def from_bytes(data, graphical_resources):
+        """
+        Rebuild a map from its binary representation (see to_bytes).
+        The map is not generated again: only the base Map initialization is done, with the map class kept so that
+        the specialized methods (like in the mazes) are still used.
+        :param data: the bytes
+        :param graphical_resources: the images of the game
+        :return: the map
+        """
+        (version, width, height, wall_ref_number, class_length, name_length) = struct.unpack_from("<HHHHHH", data)
+        assert version in (1, MAP_FORMAT_VERSION), "Map format version {} not supported".format(version)
+        offset = struct.calcsize("<HHHHHH")
+        class_name = data[offset:offset + class_length].decode("ascii")
+        offset += class_length
+        name = data[offset:offset + name_length].decode("utf-8")
+        offset += name_length
+
+        map_class = MAP_CLASSES.get(class_name, Map)
+        level_map = map_class.__new__(map_class)
+        Map.__init__(level_map, name, graphical_resources, (width, height), wall_ref_number=wall_ref_number)
+
+        level_map._layers_from_bytes(data, offset, version)
+        return level_map
+
+    def _layers_to_bytes(self):
+        """
+        The layers part of to_bytes. All layers are stored column by column (same order as self.tiles):
+        * tile types: one byte per tile
+        * explored: one bit per tile
+        * rooms: one unsigned short per tile, 0 for no room, else the room index + 1
+        * room list: position, size, doors and name
+        * room graph: the connections (room indexes) and their doors
+        :return: a list of bytes
+        """
+        parts = []
+        tile_types = bytearray(self.tile_width * self.tile_height)
+        explored = bytearray((self.tile_width * self.tile_height + 7) // 8)
+        room_layer = array("H", bytes(2 * self.tile_width * self.tile_height))
+        room_index = {}
+        for index, room in enumerate(self.rooms):
+            room_index[room] = index + 1
+        i = 0
+        for column in self.tiles:
+            for tile in column:
+                tile_types[i] = ord(tile.tile_type)
+                if tile.explored:
+                    explored[i >> 3] |= 1 << (i & 7)
+                if tile.room is not None:
+                    room_layer[i] = room_index.get(tile.room, 0)
+                i += 1
+        if sys.byteorder == "big":
+            room_layer.byteswap()
+        parts += [bytes(tile_types), bytes(explored), room_layer.tobytes()]
+
+        parts.append(struct.pack("<H", len(self.rooms)))
+        for room in self.rooms:
+            room_name = room.name.encode("utf-8")
+            parts.append(struct.pack("<HHHHHH", room.position[0], room.position[1], room.size[0], room.size[1],
+                                      len(room.doors), len(room_name)))
+            for door in room.doors:
+                parts.append(struct.pack("<HH", door[0], door[1]))
+            parts.append(room_name)
+
+        edges = [(room, other_room, doors) for (room, other_room, doors) in self.room_graph.edges()
+                 if room in room_index and other_room in room_index]
+        parts.append(struct.pack("<H", len(edges)))
+        for room, other_room, doors in edges:
+            parts.append(struct.pack("<HHH", room_index[room] - 1, room_index[other_room] - 1, len(doors)))
+            for door in sorted(doors):
+                parts.append(struct.pack("<HH", door[0], door[1]))
+        return parts
+
+    def _layers_from_bytes(self, data, offset, version):
+        """
+        Read the layers part of to_bytes
+        """
+        (width, height) = (self.tile_width, self.tile_height)
+        size = width * height
+        tile_types = data[offset:offset + size]
+        offset += size
+        explored = data[offset:offset + (size + 7) // 8]
+        offset += (size + 7) // 8
+        room_layer = array("H")
+        room_layer.frombytes(data[offset:offset + 2 * size])
+        if sys.byteorder == "big":
+            room_layer.byteswap()
+        offset += 2 * size
+
+        (room_number,) = struct.unpack_from("<H", data, offset)
+        offset += 2
+        for i in range(room_number):
+            (pos_x, pos_y, size_x, size_y, door_number, room_name_length) = struct.unpack_from("<HHHHHH", data, offset)
+            offset += struct.calcsize("<HHHHHH")
+            room = Room((size_x, size_y), position=(pos_x, pos_y))
+            for j in range(door_number):
+                room.doors.append(struct.unpack_from("<HH", data, offset))
+                offset += 4
+            room.name = data[offset:offset + room_name_length].decode("utf-8")
+            offset += room_name_length
+            self.rooms.append(room)
+            self.room_graph.add_room(room)
+
+        if version >= 2:
+            (edge_number,) = struct.unpack_from("<H", data, offset)
+            offset += 2
+            for i in range(edge_number):
+                (room_number, other_room_number, door_number) = struct.unpack_from("<HHH", data, offset)
+                offset += struct.calcsize("<HHH")
+                room = self.rooms[room_number]
+                other_room = self.rooms[other_room_number]
+                self.room_graph.connect(room, other_room)
+                for j in range(door_number):
+                    self.room_graph.connect(room, other_room, struct.unpack_from("<HH", data, offset))
+                    offset += 4
+
+        tile_type_values = {ord(c.T_VOID): c.T_VOID, ord(c.T_WALL): c.T_WALL, ord(c.T_FLOOR): c.T_FLOOR}
+        self.tiles = []
+        i = 0
+        for x in range(width):
+            column = []
+            for y in range(height):
+                tile = Tile(tile_type_values[tile_types[i]])
+                tile.explored = (explored[i >> 3] >> (i & 7)) & 1 == 1
+                if room_layer[i] > 0:
+                    tile.room = self.rooms[room_layer[i] - 1]
+                column.append(tile)
+                i += 1
+            self.tiles.append(column)
+
     def remove_extra_walls(self):
         """
         Generic method used by all to clean up after generation
@@ -218,9 +597,9 @@ class Map:
             x = random.randint(0, self.tile_width - 1)
             y = random.randint(0, self.tile_height - 1)
             if self.tiles[x][y].tile_type == tile_type:
-                if without_objects and ((x, y) not in entity_pos_listing and (x, y) not in self.doors_pos):
+                if without_objects and ((x, y) not in entity_pos_listing and (x, y) not in self.doors_pos_set):
                     return x, y
-                elif (x, y) not in self.doors_pos:
+                elif (x, y) not in self.doors_pos_set:
                     return x, y
 
     def get_close_available_tile(self, ref_pos, tile_type, game_objects, without_objects=True):
@@ -247,9 +626,9 @@ class Map:
             x = pos_x + d[0]
             y = pos_y + d[1]
             if self.tiles[x][y].tile_type == tile_type:
-                if without_objects and ((x, y) not in entity_pos_listing and (x, y) not in self.doors_pos):
+                if without_objects and ((x, y) not in entity_pos_listing and (x, y) not in self.doors_pos_set):
                     return x, y
-                elif (x, y) not in self.doors_pos:
+                elif (x, y) not in self.doors_pos_set:
                     return x, y
         return ref_pos
 
@@ -258,12 +637,23 @@ class Map:
     def doors_pos(self):
         if self._doors_pos is None:
             self._doors_pos = []
+            self._doors_pos_set = set()
             for room in self.rooms:
                 for door in room.doors:
-                    if door not in self._doors_pos:
+                    if door not in self._doors_pos_set:
+                        self._doors_pos_set.add(door)
                         self._doors_pos.append(door)
         return self._doors_pos
 
+    @property
+    def doors_pos_set(self):
+        """
+        Same as doors_pos, to check if a position is a door
+        """
+        if self._doors_pos_set is None:
+            self.doors_pos
+        return self._doors_pos_set
+
     def get_all_available_tiles(self, tile_type, game_objects, without_objects=False):
         """
         Return all tile matching the characteristics: given tile type
@@ -284,7 +674,7 @@ class Map:
             for y in range(self.tile_height):
                 if self.tiles[x][y].tile_type == tile_type:
                     if without_objects:
-                        if (x, y) not in entity_pos_listing and (x, y) not in self.doors_pos:
+                        if (x, y) not in entity_pos_listing and (x, y) not in self.doors_pos_set:
                             listing.append((x, y))
                     else:
                         listing.append((x, y))
@@ -311,7 +701,8 @@ class Map:
                 if without_objects and (x + dx, y + dy) in listing:
                     v += 1
                 elif 0 <= x + dx < self.tile_width and 0 <= y+dy < self.tile_height:
-                    if self.tiles[x+dx][y+dy].tile_type == tile_type:
+                    tile = self.known_tile(x + dx, y + dy)
+                    if tile is not None and tile.tile_type == tile_type:
                         v += 1
                         if v >= surrounded:
                             break
@@ -321,11 +712,26 @@ class Map:
                     return result
         return result
 
+    def index_rooms(self):
+        """
+        Build the room layer of the tiles from the final room list.
+        During the generation the tiles get the last room placed on them; rooms may overlap or be removed since.
+        Here, as when looking through the room list, the first room of the list wins.
+        """
+        for column in self.tiles:
+            for tile in column:
+                tile.room = None
+        for room in reversed(self.rooms):
+            for (x, y) in room.get_tile_list():
+                self.tiles[x][y].room = room
+
     def get_room_at(self, x, y):
-        if hasattr(self, "rooms"):
-            for room in self.rooms:
-                if (x, y) in room.get_tile_list():
-                    return room
+        """
+        Use the room layer of the tiles (see index_rooms), no need to look through the rooms
+        :return: the room at the position, None if none
+        """
+        if 0 <= x < self.tile_width and 0 <= y < self.tile_height:
+            return self.tiles[x][y].room
         return None
 
     def _build_background(self, name=None):
@@ -338,10 +744,9 @@ class Map:
             self._background = pg.Surface((self.tile_width * TILESIZE_SCREEN,
                                            self.tile_height * TILESIZE_SCREEN))
             self._background.fill(BGCOLOR)
-            if IMG_STYLE == c.IM_STYLE_DAWNLIKE:
-                self._build_background_dawnlike()
-            elif IMG_STYLE == c.IM_STYLE_ORYX:
-                self._build_background_oryx()
+            # The decorations are random: drawn apart from the game random generator, which must only depend on
+            # the game (see commands.CommandQueue.replay)
+            ut.call_with_seed(self.name, self._draw_tiles, self._background, (0, 0, self.tile_width, self.tile_height))
 
             # complex_walls = type(self.graphical_resources['WALLS']) is list
             #
@@ -384,97 +789,195 @@ class Map:
         if name is not None:
             pg.image.save(self._background, path.dirname(__file__) + '/' + name)
 
-    def _build_background_dawnlike(self):
+    def _draw_tiles(self, surface, area):
+        """
+        Draw a part of the map
+        :param surface: the surface to draw on. Its top left corner is the top left corner of the area.
+        :param area: (x min, y min, x max, y max) of the tiles to draw, the max being excluded
+        :return: Nothing
+        """
+        if IMG_STYLE == c.IM_STYLE_DAWNLIKE:
+            self._build_background_dawnlike(surface, area)
+        elif IMG_STYLE == c.IM_STYLE_ORYX:
+            self._build_background_oryx(surface, area)
+
+    def _build_background_dawnlike(self, surface, area):
         """
         Build background using dawnlike tileset
-        :return: Nothing, just blitting things on _background property
+        :param surface: the surface to draw on (see _draw_tiles)
+        :param area: the tiles to draw (see _draw_tiles)
+        :return: Nothing, just blitting things on the surface
         """
-        # First, we choose our wall serie
-        wall_series = random.randint(0, len(self.graphical_resources['WALLS']) - 1)
-        floor_series = random.randint(0, len(self.graphical_resources['FLOOR']) - 1)
+        # First, we choose our wall serie - the map reference, so that all parts of the map match
+        wall_series = self.wall_ref_number % len(self.graphical_resources['WALLS'])
+        floor_series = self.wall_ref_number % len(self.graphical_resources['FLOOR'])
+        door_list = self.doors_pos_set
+        (x_min, y_min, x_max, y_max) = area
 
-        for y in range(self.tile_height):
-            for x in range(self.tile_width):
+        for y in range(y_min, y_max):
+            for x in range(x_min, x_max):
 
-                door_list = []
-                # build door list - except if we are in a pure maze
-                if hasattr(self, "rooms") and self.rooms is not None:
-                    for room in self.rooms:
-                        for door_pos in room.doors:
-                            door_list.append(door_pos)
                 weight_wall = self.wall_weight(x, y, door_list)
                 weight_floor = self.wall_weight(x, y, door_list, tile_type=c.T_FLOOR)
+                screen_pos = ((x - x_min) * TILESIZE_SCREEN, (y - y_min) * TILESIZE_SCREEN)
 
                 if self.tiles[x][y].tile_type == c.T_WALL:
                     # We always blit a floor... but using the wall as reference for weight
-                    self._background.blit(self.graphical_resources['FLOOR'][floor_series][weight_wall],
-                                          (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
-                    self._background.blit(self.graphical_resources['WALLS'][wall_series][weight_wall],
-                                          (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                    surface.blit(self.graphical_resources['FLOOR'][floor_series][weight_wall], screen_pos)
+                    surface.blit(self.graphical_resources['WALLS'][wall_series][weight_wall], screen_pos)
                 elif self.tiles[x][y].tile_type == c.T_FLOOR:
-                    self._background.blit(self.graphical_resources['FLOOR'][floor_series][weight_floor],
-                                          (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                    surface.blit(self.graphical_resources['FLOOR'][floor_series][weight_floor], screen_pos)
 
-    def _build_background_oryx(self):
+    def _build_background_oryx(self, surface, area):
         """
         Build background using oryx tileset
-        :return: Nothing, just blitting things on _background property
+        :param surface: the surface to draw on (see _draw_tiles)
+        :param area: the tiles to draw (see _draw_tiles)
+        :return: Nothing, just blitting things on the surface
         """
         # First, we choose our wall serie
         wall_series = floor_series = self.wall_ref_number
         type_floor = 0
+        door_list = self.doors_pos_set
+        (x_min, y_min, x_max, y_max) = area
 
-        for y in range(self.tile_height):
-            for x in range(self.tile_width):
+        for y in range(y_min, y_max):
+            for x in range(x_min, x_max):
 
-                door_list = []
-                # build door list - except if we are in a pure maze
-                if hasattr(self, "rooms") and self.rooms is not None:
-                    for room in self.rooms:
-                        for door_pos in room.doors:
-                            door_list.append(door_pos)
                 weight_wall = self.wall_weight(x, y, door_list)
                 weight_floor = self.wall_weight(x, y, door_list, tile_type=c.T_FLOOR)
+                screen_pos = ((x - x_min) * TILESIZE_SCREEN, (y - y_min) * TILESIZE_SCREEN)
 
                 if self.tiles[x][y].tile_type == c.T_WALL:
                     # We always blit a floor... but using the wall as reference for weight
-                    self._background.blit(self.graphical_resources['FLOOR'][floor_series][type_floor],
-                                          (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
-                    self._background.blit(self.graphical_resources['WALLS'][wall_series][weight_wall],
-                                          (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                    surface.blit(self.graphical_resources['FLOOR'][floor_series][type_floor], screen_pos)
+                    surface.blit(self.graphical_resources['WALLS'][wall_series][weight_wall], screen_pos)
                 elif self.tiles[x][y].tile_type == c.T_FLOOR:
                     other_floor = random.randint(0, 99)
                     _type_floor = type_floor
                     with_spider_web = False
                     if other_floor > 70:
                         _type_floor = other_floor % len(self.graphical_resources['FLOOR'][floor_series])
-                    self._background.blit(self.graphical_resources['FLOOR'][floor_series][_type_floor],
-                                          (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                    surface.blit(self.graphical_resources['FLOOR'][floor_series][_type_floor], screen_pos)
                     # Adding wall shadow on floor tile
                     if weight_floor in (0, 2, 4, 6, 8, 10, 12, 14):
-                        self._background.blit(self.graphical_resources['WALLS_SHADOW'],
-                                              (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                        surface.blit(self.graphical_resources['WALLS_SHADOW'], screen_pos)
                     if random.randint(0, 100) <= 20:
                         with_spider_web = True
                         # Adding spider web on floor tile if the wall is correct
                         if weight_floor == 6:
-                            self._background.blit(self.graphical_resources['SPIDER_WEB_TOP_LEFT'],
-                                                  (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                            surface.blit(self.graphical_resources['SPIDER_WEB_TOP_LEFT'], screen_pos)
                         elif weight_floor == 3:
-                            self._background.blit(self.graphical_resources['SPIDER_WEB_BOTTOM_LEFT'],
-                                                  (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                            surface.blit(self.graphical_resources['SPIDER_WEB_BOTTOM_LEFT'], screen_pos)
                         elif weight_floor == 9:
-                            self._background.blit(self.graphical_resources['SPIDER_WEB_BOTTOM_RIGHT'],
-                                                  (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                            surface.blit(self.graphical_resources['SPIDER_WEB_BOTTOM_RIGHT'], screen_pos)
                         elif weight_floor == 12:
-                            self._background.blit(self.graphical_resources['SPIDER_WEB_TOP_RIGHT'],
-                                                  (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                            surface.blit(self.graphical_resources['SPIDER_WEB_TOP_RIGHT'], screen_pos)
                     if not with_spider_web and random.randint(0, 100) <= 5:
-                        self._background.blit(random.choice(self.graphical_resources['FLOOR_DECO_LIST']),
-                                              (x * TILESIZE_SCREEN, y * TILESIZE_SCREEN))
+                        surface.blit(random.choice(self.graphical_resources['FLOOR_DECO_LIST']), screen_pos)
 
 
-class MazeMap(Map):
+class _MazeExtension:
+    """
+    Maze carving, shared by the maps with mazes
+    """
+
+    def __init__(self):
+        self.tiles = []
+        self.tile_height = self.tile_width = 0
+        assert 0, "Constructor should not be called"
+
+    def _flood_maze(self, to_explore=0):
+        """
+        Carve a maze on the odd cells, going on from the last cell carved and backtracking when blocked.
+        The tiles of the rooms, and the tiles flagged explored, are left untouched.
+        :param to_explore: the number of cells after which the carving stops
+        """
+        forbidden_tiles = set()
+        if hasattr(self, "rooms"):
+            for room in self.rooms:
+                forbidden_tiles.update(room.get_tile_list())
+        explored = set()
+        for x in range(self.tile_width):
+            for y in range(self.tile_height):
+                if self.tiles[x][y].explored:
+                    explored.add((x, y))
+
+        # 2. We pick a random cell, and flag it explored. Demarrage sur un impair!
+        found = False
+        current_x = current_y = 0
+        while not found:
+            current_x = int(random.randint(0, self.tile_width) / 2)
+            if current_x % 2 == 0:
+                current_x += 1
+            current_y = int(random.randint(0, self.tile_height) / 2)
+            if current_y % 2 == 0:
+                current_y += 1
+            if (current_x, current_y) not in explored and (current_x, current_y) not in forbidden_tiles:
+                found = True
+
+        self.tiles[current_x][current_y].tile_type = c.T_FLOOR
+        explored.add((current_x, current_y))
+        carved = 1
+        to_visit = [(current_x, current_y)]
+
+        while to_visit and carved < to_explore:
+            (current_x, current_y) = to_visit[-1]
+            directions = [(2, 0), (-2, 0), (0, 2), (0, -2)]
+            # 3. We pick a random direction among the valid ones: new cell in the grid and not explored
+            random.shuffle(directions)
+            for (dir_x, dir_y) in directions:
+                next_pos = (current_x + dir_x, current_y + dir_y)
+                if 0 < next_pos[0] < self.tile_width and 0 < next_pos[1] < self.tile_height and \
+                        next_pos not in explored and next_pos not in forbidden_tiles:
+                    # 4. we create a corridor
+                    self.tiles[current_x + dir_x // 2][current_y + dir_y // 2].tile_type = c.T_FLOOR
+                    self.tiles[next_pos[0]][next_pos[1]].tile_type = c.T_FLOOR
+                    explored.add(next_pos)
+                    carved += 1
+                    to_visit.append(next_pos)
+                    break
+            else:
+                # Dead end: back to the previous cell
+                to_visit.pop()
+
+        for x in range(self.tile_width):
+            for y in range(self.tile_height):
+                self.tiles[x][y].explored = False
+
+    def _is_dead_end(self, x, y):
+        if not (0 < x < self.tile_width - 1 and 0 < y < self.tile_height - 1) or \
+                self.tiles[x][y].tile_type != c.T_FLOOR:
+            return False
+        count = 0
+        for (dx, dy) in ((0, -1), (0, 1), (1, 0), (-1, 0)):
+            if self.tiles[x + dx][y + dy].tile_type == c.T_FLOOR:
+                count += 1
+        return count <= 1
+
+    def _remove_dead_ends(self, spareness=None):
+        """
+        Fill the dead ends. Each pass shortens the dead end corridors by one tile.
+        Only the neighbours of the tiles filled need to be checked for the next pass.
+        :param spareness: the number of passes, None to remove all the dead ends
+        """
+        dead_ends = [(x, y) for x in range(1, self.tile_width - 1) for y in range(1, self.tile_height - 1)
+                     if self._is_dead_end(x, y)]
+        passes = 0
+        while dead_ends and (spareness is None or passes < spareness):
+            next_dead_ends = []
+            for (x, y) in dead_ends:
+                if self.tiles[x][y].tile_type != c.T_FLOOR:
+                    continue
+                self.tiles[x][y].tile_type = c.T_WALL
+                for (dx, dy) in ((0, -1), (0, 1), (1, 0), (-1, 0)):
+                    if self._is_dead_end(x + dx, y + dy):
+                        next_dead_ends.append((x + dx, y + dy))
+            dead_ends = next_dead_ends
+            passes += 1
+
+
+class MazeMap(Map, _MazeExtension):
     """
     This represents a pure maze.
     Such a dungeon doesn't contain doors or rooms.
@@ -498,17 +1001,7 @@ class MazeMap(Map):
 
         print(" MAZE: Remove dead End")
         # Now, we want to remove some dead end
-        for i in range(spareness):
-            for x in range(1, self.tile_width - 1):
-                for y in range(1, self.tile_height - 1):
-                    if self.tiles[x][y].tile_type == c.T_FLOOR:
-                        delta = [(0, -1), (0, 1), (1, 0), (-1, 0)]
-                        count = 0
-                        for (dx, dy) in delta:
-                            if self.tiles[x + dx][y + dy].tile_type == c.T_FLOOR:
-                                count += 1
-                        if count <= 1:
-                            self.tiles[x][y].tile_type = c.T_WALL
+        self._remove_dead_ends(spareness)
 
     def get_all_available_isolated_tiles(self, tile_type, game_objects, without_objects=False, surrounded=7, max=None):
         """
@@ -522,63 +1015,6 @@ class MazeMap(Map):
         return self.get_all_available_tiles(tile_type, game_objects, without_objects=without_objects)
 
 
-
-    def _flood_maze(self, to_explore=0):
-        # 2. We pick a random cell, and flag it explored. Demarrage sur un impair!
-        found = False
-        current_x = current_y = 0
-        forbidden_tiles = []
-        if hasattr(self, "rooms"):
-            for room in self.rooms:
-                forbidden_tiles = forbidden_tiles + room.get_tile_list()
-        while not found:
-            current_x = int(random.randint(0, self.tile_width) / 2)
-            if current_x % 2 == 0:
-                current_x += 1
-            current_y = int(random.randint(0, self.tile_width) / 2)
-            if current_y % 2 == 0:
-                current_y += 1
-            if not self.tiles[current_x][current_y].explored and not (current_x, current_y) in forbidden_tiles:
-                self.tiles[current_x][current_y].explored = True
-                found = True
-
-        self.tiles[current_x][current_y].tile_type = c.T_FLOOR
-        explored = [(current_x, current_y)]
-
-        trials = 0
-        while len(explored) < to_explore and trials < (self.tile_width * self.tile_height)/4:
-            current_cell = self.tiles[current_x][current_y]
-            directions = [(2, 0), (-2, 0), (0, 2), (0, -2)]
-            # 3. We pick a random direction
-            random.shuffle(directions)
-            found = False
-            (dir_x, dir_y) = (0, 0)
-
-            while not found and len(directions) > 0:
-                (dir_x, dir_y) = directions.pop()
-                # 3A: we test if this new cell is valid and not explored
-                if 0 < current_x + dir_x < self.tile_width and 0 < current_y + dir_y < self.tile_height:
-                    if not self.tiles[current_x + dir_x][current_y + dir_y].explored:
-                        if not (current_x + dir_x, current_y + dir_y) in forbidden_tiles:
-                            found = True
-
-            if found:
-                # 4. we create a corridor
-                self.tiles[current_x + int(dir_x / 2)][current_y + int(dir_y / 2)].tile_type = c.T_FLOOR
-                current_x += dir_x
-                current_y += dir_y
-                self.tiles[current_x][current_y].tile_type = c.T_FLOOR
-                self.tiles[current_x][current_y].explored = True
-                explored.append((current_x, current_y))
-            else:
-                (current_x, current_y) = random.choice(explored)
-            trials += 1
-
-        for x in range(self.tile_width):
-            for y in range(self.tile_height):
-                self.tiles[x][y].explored = False
-
-
 class _RoomExtension:
 
     def __init__(self):
@@ -586,20 +1022,6 @@ class _RoomExtension:
         self.tile_height = self.tile_width = 0
         assert 0, "Constructor should not be called"
 
-    def _add_connected_room(self, room, list_connected, to_visit, already_visited):
-        already_visited.append(room)
-
-        for connection in room.connecting_room:
-            if connection not in to_visit and connection not in already_visited:
-                to_visit.append(connection)
-
-        for room_to_visit in to_visit:
-            if room_to_visit not in already_visited:
-                self._add_connected_room(room_to_visit, list_connected, to_visit, already_visited)
-
-        if room in to_visit:
-            to_visit.remove(room)
-
     def _get_branching_position_direction(self, branching_room, except_dir=None):
         while True:
             # we consider pos = 0,0
@@ -641,17 +1063,40 @@ class _RoomExtension:
                 size_y = random.randint(min_size[1], max_size[1])
         return Room((size_x, size_y))
 
+    def _init_floor_rows(self):
+        """
+        The floor tiles are kept as one bitset per row (bit x of row y for the tile x, y), so that checking if a
+        rectangle is free only looks at its rows. The tiles changed during the room placement must go through
+        _set_tile_type to keep it up to date.
+        """
+        self._floor_rows = [0] * self.tile_height
+        for x in range(self.tile_width):
+            for y in range(self.tile_height):
+                if self.tiles[x][y].tile_type == c.T_FLOOR:
+                    self._floor_rows[y] |= 1 << x
+
+    def _set_tile_type(self, x, y, tile_type):
+        self.tiles[x][y].tile_type = tile_type
+        if tile_type == c.T_FLOOR:
+            self._floor_rows[y] |= 1 << x
+        else:
+            self._floor_rows[y] &= ~(1 << x)
+
     def _space_for_new_room(self, new_room_size, new_room_position, tiles_blocking=c.T_FLOOR):
-        for y in range(new_room_position[1],
-                       new_room_position[1] + new_room_size[1]):
-            for x in range(new_room_position[0],
-                           new_room_position[0] + new_room_size[0]):
-                if x < 0 or x > self.tile_width - 1:
-                    return False
-                if y < 0 or y > self.tile_height - 1:
-                    return False
-                if self.tiles[x][y].tile_type in tiles_blocking:
-                    return False
+        (pos_x, pos_y) = new_room_position
+        (size_x, size_y) = new_room_size
+        if pos_x < 0 or pos_y < 0 or pos_x + size_x > self.tile_width or pos_y + size_y > self.tile_height:
+            return False
+        if tiles_blocking != c.T_FLOOR:
+            for y in range(pos_y, pos_y + size_y):
+                for x in range(pos_x, pos_x + size_x):
+                    if self.tiles[x][y].tile_type in tiles_blocking:
+                        return False
+            return True
+        mask = ((1 << size_x) - 1) << pos_x
+        for y in range(pos_y, pos_y + size_y):
+            if self._floor_rows[y] & mask:
+                return False
         return True
 
     def _place_room(self, room, grid_position):
@@ -661,9 +1106,9 @@ class _RoomExtension:
                 self.tiles[x][y].room = room
                 if y in (grid_position[1], grid_position[1] + room.size[1] - 1) or \
                                 x in (grid_position[0], grid_position[0] + room.size[0] - 1):
-                    self.tiles[x][y].tile_type = c.T_WALL
+                    self._set_tile_type(x, y, c.T_WALL)
                 else:
-                    self.tiles[x][y].tile_type = c.T_FLOOR
+                    self._set_tile_type(x, y, c.T_FLOOR)
 
 
 class RoomMap(Map, _RoomExtension):
@@ -682,9 +1127,11 @@ class RoomMap(Map, _RoomExtension):
         self.tiles = [[Tile(c.T_VOID)
                        for y in range(self.tile_height)]
                       for x in range(self.tile_width)]
+        self._init_floor_rows()
 
         # generate the dungeon
         self.rooms.append(self._generate_room(room_size_range[0], room_size_range[1]))
+        self.room_graph.add_room(self.rooms[-1])
         self._place_room(self.rooms[-1],
                          (int(self.tile_width / 2 - (self.rooms[-1].size[0] / 2)),
                          int(self.tile_height / 2 - (self.rooms[-1].size[1] / 2))))
@@ -718,41 +1165,40 @@ class RoomMap(Map, _RoomExtension):
                 # Now connecting room
                 # No tunnel, easy case:
                 new_room.doors.append(branching_pos)
-                self.tiles[branching_pos[0]][branching_pos[1]].tile_type = c.T_FLOOR
-                new_room.connecting_room.append(branching_room)
-                branching_room.connecting_room.append(new_room)
+                self._set_tile_type(branching_pos[0], branching_pos[1], c.T_FLOOR)
+                self.room_graph.connect(new_room, branching_room, branching_pos)
                 # We now place the tunnel
                 if branching_dir == 'N':
                     for i in range(1, tunnel_length + 1):
-                        self.tiles[branching_pos[0]][branching_pos[1] - i].tile_type = c.T_FLOOR
-                        self.tiles[branching_pos[0] - 1][branching_pos[1] - i].tile_type = c.T_WALL
-                        self.tiles[branching_pos[0] + 1][branching_pos[1] - i].tile_type = c.T_WALL
+                        self._set_tile_type(branching_pos[0], branching_pos[1] - i, c.T_FLOOR)
+                        self._set_tile_type(branching_pos[0] - 1, branching_pos[1] - i, c.T_WALL)
+                        self._set_tile_type(branching_pos[0] + 1, branching_pos[1] - i, c.T_WALL)
                     if tunnel_length >= 3:
                         branching_room.doors.append((branching_pos[0], branching_pos[1] - tunnel_length))
                 elif branching_dir == 'E':
                     for i in range(1, tunnel_length + 1):
-                        self.tiles[branching_pos[0] + i][branching_pos[1]].tile_type = c.T_FLOOR
-                        self.tiles[branching_pos[0] + i][branching_pos[1] - 1].tile_type = c.T_WALL
-                        self.tiles[branching_pos[0] + i][branching_pos[1] + 1].tile_type = c.T_WALL
+                        self._set_tile_type(branching_pos[0] + i, branching_pos[1], c.T_FLOOR)
+                        self._set_tile_type(branching_pos[0] + i, branching_pos[1] - 1, c.T_WALL)
+                        self._set_tile_type(branching_pos[0] + i, branching_pos[1] + 1, c.T_WALL)
                     if tunnel_length >= 3:
                         branching_room.doors.append((branching_pos[0] + tunnel_length, branching_pos[1]))
                 elif branching_dir == 'S':
                     for i in range(1, tunnel_length + 1):
-                        self.tiles[branching_pos[0]][branching_pos[1] + i].tile_type = c.T_FLOOR
-                        self.tiles[branching_pos[0] - 1][branching_pos[1] + i].tile_type = c.T_WALL
-                        self.tiles[branching_pos[0] + 1][branching_pos[1] + i].tile_type = c.T_WALL
+                        self._set_tile_type(branching_pos[0], branching_pos[1] + i, c.T_FLOOR)
+                        self._set_tile_type(branching_pos[0] - 1, branching_pos[1] + i, c.T_WALL)
+                        self._set_tile_type(branching_pos[0] + 1, branching_pos[1] + i, c.T_WALL)
                         if tunnel_length >= 3:
                             branching_room.doors.append((branching_pos[0], branching_pos[1] + tunnel_length))
                 elif branching_dir == 'W':
                     for i in range(1, tunnel_length + 1):
-                        self.tiles[branching_pos[0] - i][branching_pos[1]].tile_type = c.T_FLOOR
-                        self.tiles[branching_pos[0] - i][branching_pos[1] - 1].tile_type = c.T_WALL
-                        self.tiles[branching_pos[0] - i][branching_pos[1] + 1].tile_type = c.T_WALL
+                        self._set_tile_type(branching_pos[0] - i, branching_pos[1], c.T_FLOOR)
+                        self._set_tile_type(branching_pos[0] - i, branching_pos[1] - 1, c.T_WALL)
+                        self._set_tile_type(branching_pos[0] - i, branching_pos[1] + 1, c.T_WALL)
                     if tunnel_length >= 3:
                         branching_room.doors.append((branching_pos[0] - tunnel_length, branching_pos[1]))
 
 
-class RoomAndMazeMap(Map, _RoomExtension):
+class RoomAndMazeMap(Map, _RoomExtension, _MazeExtension):
 
     def __init__(self, name, graphical_resource, dimension):
 
@@ -769,6 +1215,7 @@ class RoomAndMazeMap(Map, _RoomExtension):
             self.tiles = [[Tile(c.T_WALL)
                            for y in range(self.tile_height)]
                           for x in range(self.tile_width)]
+            self._init_floor_rows()  # only kept up to date while placing the rooms
 
             # We place a bunch of room
             count_explored = 0
@@ -784,6 +1231,7 @@ class RoomAndMazeMap(Map, _RoomExtension):
                 if self._space_for_new_room(new_room.size, pos):
                     self._place_room(new_room, pos)
                     self.rooms.append(new_room)
+                    self.room_graph.add_room(new_room)
                     tile_list = new_room.get_tile_list()
                     for (x, y) in tile_list:
                         self.tiles[x][y].explored = True
@@ -806,38 +1254,29 @@ class RoomAndMazeMap(Map, _RoomExtension):
 
             print("DUNGEON MAZE: Doors in position")
             # Now we check if we have rooms that are not connected and we remove them:
-            connected_external_list = []
+            # the rooms opening on the maze are kept, with all the rooms that can be reached from them.
+            connected_external_rooms = set()
             for room in self.rooms:
-                room_tile_list = room.get_tile_list()
                 for (x, y) in room.doors:
                     # which tile is external
                     delta = [(0, -1), (0, 1), (1, 0), (-1, 0)]
                     for (dx, dy) in delta:
                         if self.tiles[x + dx][y + dy].tile_type == c.T_FLOOR:
-                            if self.tiles[x + dx][y + dy] not in room_tile_list:
-                                if self.tiles[x + dx][y + dy].room is None:
-                                    if room not in connected_external_list:
-                                        connected_external_list.append(room)
-                                else:
-                                    other_room = self.tiles[x + dx][y + dy].room
-                                    room.connecting_room.append(other_room)
-                                    other_room.connecting_room.append(room)
-
-            list_old_rooms = self.rooms[:]
-            # Now let's recursively go from the connected group
-            for room in connected_external_list:
-                already_visited = []
-                self._add_connected_room(room, connected_external_list, [], already_visited)
-                for visited_room in already_visited:
-                    if visited_room not in connected_external_list:
-                        connected_external_list.append(visited_room)
-
-            self.rooms = connected_external_list
+                            other_room = self.tiles[x + dx][y + dy].room
+                            if other_room is None:
+                                connected_external_rooms.add(room)
+                            elif other_room is not room:
+                                self.room_graph.connect(room, other_room, (x, y))
+
+            list_old_rooms = self.rooms
+            connected_rooms = self.room_graph.reachable_from(connected_external_rooms)
+            self.rooms = [room for room in list_old_rooms if room in connected_rooms]
             # At this point all the internal group that are connected via relays should be somewhere..
 
             print("DUNGEON MAZE: Non connected rooms flagged")
             for room in list_old_rooms:
-                if room not in self.rooms:
+                if room not in connected_rooms:
+                    self.room_graph.remove_room(room)
                     # Erase the wall and floor
                     room_tile_list = room.get_tile_list()
                     for (x, y) in room_tile_list:
@@ -846,76 +1285,10 @@ class RoomAndMazeMap(Map, _RoomExtension):
             print("DUNGEON MAZE: Non connected rooms removed")
 
             # Now, we want to remove some dead end
-            spareness = random.randint(1, 5)
-            for i in range(spareness):
-                for x in range(1, self.tile_width - 1):
-                    for y in range(1, self.tile_height - 1):
-                        if self.tiles[x][y].tile_type == c.T_FLOOR:
-                            delta = [(0, -1), (0, 1), (1, 0), (-1, 0)]
-                            count = 0
-                            for (dx, dy) in delta:
-                                if self.tiles[x + dx][y + dy].tile_type == c.T_FLOOR:
-                                    count += 1
-                            if count <= 1:
-                                self.tiles[x][y].tile_type = c.T_WALL
+            self._remove_dead_ends(random.randint(1, 5))
 
             print("DUNGEON MAZE: Dead ends removed")
 
-    def _flood_maze(self, to_explore=0):
-        # 2. We pick a random cell, and flag it explored. Demarrage sur un impair!
-        found = False
-        current_x = current_y = 0
-        forbidden_tiles = []
-        if hasattr(self, "rooms"):
-            for room in self.rooms:
-                forbidden_tiles = forbidden_tiles + room.get_tile_list()
-        while not found:
-            current_x = int(random.randint(0, self.tile_width) / 2)
-            if current_x % 2 == 0:
-                current_x += 1
-            current_y = int(random.randint(0, self.tile_width) / 2)
-            if current_y % 2 == 0:
-                current_y += 1
-            if not self.tiles[current_x][current_y].explored and not (current_x, current_y) in forbidden_tiles:
-                self.tiles[current_x][current_y].explored = True
-                found = True
-
-        self.tiles[current_x][current_y].tile_type = c.T_FLOOR
-        explored = [(current_x, current_y)]
-
-        trials = 0
-        while len(explored) < to_explore and trials < (self.tile_width * self.tile_height)/4:
-
-            directions = [(2, 0), (-2, 0), (0, 2), (0, -2)]
-            # 3. We pick a random direction
-            random.shuffle(directions)
-            found = False
-            (dir_x, dir_y) = (0, 0)
-
-            while not found and len(directions) > 0:
-                (dir_x, dir_y) = directions.pop()
-                # 3A: we test if this new cell is valid and not explored
-                if 0 < current_x + dir_x < self.tile_width and 0 < current_y + dir_y < self.tile_height:
-                    if not self.tiles[current_x + dir_x][current_y + dir_y].explored:
-                        if not (current_x + dir_x, current_y + dir_y) in forbidden_tiles:
-                            found = True
-
-            if found:
-                # 4. we create a corridor
-                self.tiles[current_x + int(dir_x / 2)][current_y + int(dir_y / 2)].tile_type = c.T_FLOOR
-                current_x += dir_x
-                current_y += dir_y
-                self.tiles[current_x][current_y].tile_type = c.T_FLOOR
-                self.tiles[current_x][current_y].explored = True
-                explored.append((current_x, current_y))
-            else:
-                (current_x, current_y) = random.choice(explored)
-            trials += 1
-
-        for x in range(self.tile_width):
-            for y in range(self.tile_height):
-                self.tiles[x][y].explored = False
-
     def _place_door_in_dungeon_maze(self, room, except_dir=None):
         trials = 400
         while trials > 0:
@@ -987,36 +1360,530 @@ class CaveMap(Map):
         return count
 
 
+class _ChunkedColumn:
+    """
+    A column of a ChunkedTileGrid, so that the tiles can be reached as grid[x][y]
+    """
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.x = x
+
+    def __len__(self):
+        return self.grid.height
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self.grid.height
+        if not 0 <= y < self.grid.height:
+            raise IndexError("tile index out of range")
+        size = self.grid.chunk_size
+        return self.grid.chunk(self.x // size, y // size)[self.x % size][y % size]
+
+
+class ChunkedTileGrid:
+    """
+    The tiles of a large map, cut in square chunks. A chunk is only created (by the chunk builder) when one of its
+    tiles is used.
+    It is used as the list of columns of the other maps: grid[x][y] is a tile, the chunk being created if needed.
+    """
+    def __init__(self, width, height, chunk_size, chunk_builder):
+        """
+        :param chunk_builder: function (chunk x, chunk y) returning the columns of tiles of the chunk
+        """
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.chunks = {}  # (chunk x, chunk y) -> list of columns of tiles
+        self.chunk_listeners = []  # functions (chunk x, chunk y) called each time a chunk is created
+        self._chunk_builder = chunk_builder
+        self._columns = {}
+
+    def __len__(self):
+        return self.width
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.width
+        if not 0 <= x < self.width:
+            raise IndexError("tile index out of range")
+        column = self._columns.get(x)
+        if column is None:
+            column = self._columns[x] = _ChunkedColumn(self, x)
+        return column
+
+    def chunk(self, chunk_x, chunk_y):
+        """
+        :return: the columns of tiles of the chunk, created if needed
+        """
+        key = (chunk_x, chunk_y)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = self._chunk_builder(chunk_x, chunk_y)
+            for listener in self.chunk_listeners:
+                listener(chunk_x, chunk_y)
+        return chunk
+
+    def has_chunk(self, chunk_x, chunk_y):
+        return (chunk_x, chunk_y) in self.chunks
+
+    def chunk_area(self, chunk_x, chunk_y):
+        """
+        :return: (x min, y min, x max, y max) of the tiles of the chunk, the max being excluded
+        """
+        x_min = chunk_x * self.chunk_size
+        y_min = chunk_y * self.chunk_size
+        return x_min, y_min, min(x_min + self.chunk_size, self.width), min(y_min + self.chunk_size, self.height)
+
+
+class ChunkedCaveMap(Map):
+    """
+    A cavelike dungeon of any size.
+    The tiles are generated by chunks (see ChunkedTileGrid), when first used: only the chunks around the start are
+    generated with the map, the others when the player explores. Each chunk is generated from the map seed and its
+    position only, so the result does not depend on the order the chunks are generated in.
+    Unlike the CaveMap, the cellular automaton updates all the tiles at once (the CaveMap updates them in place, so a
+    tile depends on the whole map). With the CaveMap rules this only leaves small closed caves: here there is more
+    initial noise and a tile becomes a wall when at least 5 tiles around it are walls, which gives open and connected
+    caves (about 3/4 of floor, as the CaveMap). The automaton is run on the chunk and a margin around it, larger than
+    the number of steps, so the tiles of the chunk are always the same.
+    The background is also drawn by chunk, only the ones on the screen, and only the last ones are kept.
+    The items and monsters are spawned by chunk as well (see levelgen.plan_chunk), in the available tiles of a chunk
+    (see spawning_in).
+    """
+
+    WALL_NOISE = 42  # chance (out of 100) of an initial wall
+    STEPS = 8  # steps of the cellular automaton
+    MARGIN = 9  # tiles around the chunk used for the generation: more than the automaton steps
+    START_CHUNKS = 2  # chunks generated around the center of the map, on each side
+
+    def __init__(self, name, graphical_resource, dimension, chunk_size=MAP_CHUNK_SIZE):
+        assert ChunkedCaveMap.STEPS < ChunkedCaveMap.MARGIN <= chunk_size, "Chunks must be larger than the margin"
+
+        Map.__init__(self, name, graphical_resource, dimension)
+
+        print(" CHUNKED CAVE: Initialization")
+
+        self._init_chunks(random.getrandbits(32), chunk_size)
+
+        center_x = self.tile_width // 2 // chunk_size
+        center_y = self.tile_height // 2 // chunk_size
+        for chunk_x in range(center_x - ChunkedCaveMap.START_CHUNKS, center_x + ChunkedCaveMap.START_CHUNKS + 1):
+            for chunk_y in range(center_y - ChunkedCaveMap.START_CHUNKS, center_y + ChunkedCaveMap.START_CHUNKS + 1):
+                if self._chunk_exists(chunk_x, chunk_y):
+                    self.tiles.chunk(chunk_x, chunk_y)
+
+    def _init_chunks(self, seed, chunk_size):
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.tiles = ChunkedTileGrid(self.tile_width, self.tile_height, chunk_size, self._generate_chunk)
+        self._chunk_surfaces = OrderedDict()  # (chunk x, chunk y) -> background image, the last drawn at the end
+        self._spawn_chunks = None  # the chunks where the available tiles are looked for, None for all the generated
+
+    def _chunk_exists(self, chunk_x, chunk_y):
+        return 0 <= chunk_x * self.chunk_size < self.tile_width and 0 <= chunk_y * self.chunk_size < self.tile_height
+
+    def _noise(self, chunk_x, chunk_y):
+        """
+        The initial random noise of a chunk: True for a wall. Always the same for a given map and chunk.
+        :return: the list of the values, column by column, for a full chunk
+        """
+        generator = random.Random("{}-{}-{}".format(self.seed, chunk_x, chunk_y))
+        return [generator.randint(0, 100) <= ChunkedCaveMap.WALL_NOISE for i in range(self.chunk_size * self.chunk_size)]
+
+    def _generate_chunk(self, chunk_x, chunk_y):
+        """
+        Generate the tiles of a chunk
+        :return: the columns of tiles of the chunk
+        """
+        size = self.chunk_size
+        margin = ChunkedCaveMap.MARGIN
+        (x_min, y_min, x_max, y_max) = self.tiles.chunk_area(chunk_x, chunk_y)
+        # The window: the chunk and its margin, as a flat list (column by column) of walls
+        window_x = x_min - margin
+        window_y = y_min - margin
+        window_width = x_max - x_min + 2 * margin
+        window_height = y_max - y_min + 2 * margin
+
+        walls = [True] * (window_width * window_height)
+        # Only the tiles inside the map borders change, the others are walls
+        fixed = [True] * (window_width * window_height)
+        noises = {}
+        for i in range(window_width):
+            x = window_x + i
+            if not 0 < x < self.tile_width - 1:
+                continue
+            for j in range(window_height):
+                y = window_y + j
+                if not 0 < y < self.tile_height - 1:
+                    continue
+                noise_key = (x // size, y // size)
+                noise = noises.get(noise_key)
+                if noise is None:
+                    noise = noises[noise_key] = self._noise(x // size, y // size)
+                walls[i * window_height + j] = noise[(x % size) * size + y % size]
+                # The tiles on the edge of the window have not all their neighbours
+                fixed[i * window_height + j] = not (0 < i < window_width - 1 and 0 < j < window_height - 1)
+
+        neighbours = [di * window_height + dj for di in (-1, 0, 1) for dj in (-1, 0, 1)]
+        to_update = [k for k in range(window_width * window_height) if not fixed[k]]
+        for repeat in range(ChunkedCaveMap.STEPS):
+            new_walls = walls[:]
+            for k in to_update:
+                count = 0
+                for delta in neighbours:
+                    if walls[k + delta]:
+                        count += 1
+                new_walls[k] = count >= 5
+            walls = new_walls
+
+        # Then the tiles, with the walls surrounded by walls removed (as in remove_extra_walls)
+        around = [delta for delta in neighbours if delta != 0]
+        chunk = []
+        for i in range(margin, margin + x_max - x_min):
+            column = []
+            for j in range(margin, margin + y_max - y_min):
+                k = i * window_height + j
+                if not walls[k]:
+                    column.append(Tile(c.T_FLOOR))
+                elif all(walls[k + delta] for delta in around):
+                    column.append(Tile(c.T_VOID))
+                else:
+                    column.append(Tile(c.T_WALL))
+            chunk.append(column)
+        return chunk
+
+    def chunk_number(self):
+        """
+        :return: (number of chunks on x, number of chunks on y)
+        """
+        return (self.tile_width + self.chunk_size - 1) // self.chunk_size, \
+               (self.tile_height + self.chunk_size - 1) // self.chunk_size
+
+    def _generated_areas(self):
+        return [self.tiles.chunk_area(chunk_x, chunk_y) for (chunk_x, chunk_y) in sorted(self.tiles.chunks)]
+
+    def _spawn_areas(self):
+        if self._spawn_chunks is None:
+            return self._generated_areas()
+        return [self.tiles.chunk_area(chunk_x, chunk_y) for (chunk_x, chunk_y) in self._spawn_chunks]
+
+    @contextmanager
+    def spawning_in(self, chunks):
+        """
+        Limit the available tiles (get_random_available_tile, get_all_available_tiles...) to some chunks, generated if
+        needed:
+        with level_map.spawning_in([(chunk_x, chunk_y)]):
+            ...
+        :param chunks: the list of the chunks (chunk x, chunk y)
+        """
+        self._spawn_chunks = chunks
+        try:
+            yield
+        finally:
+            self._spawn_chunks = None
+
+    def remove_extra_walls(self):
+        """
+        Already done when generating each chunk
+        """
+        pass
+
+    def index_rooms(self):
+        """
+        No room in a cave
+        """
+        pass
+
+    def known_bounds(self):
+        areas = self._generated_areas()
+        return (min(area[0] for area in areas), min(area[1] for area in areas),
+                max(area[2] for area in areas), max(area[3] for area in areas))
+
+    def known_tile(self, x, y):
+        if not (0 <= x < self.tile_width and 0 <= y < self.tile_height) or \
+                not self.tiles.has_chunk(x // self.chunk_size, y // self.chunk_size):
+            return None
+        return self.tiles[x][y]
+
+    def get_random_available_tile(self, tile_type, game_objects, without_objects=True):
+        """
+        Same as for the other maps, but only in the chunks already generated (or the ones given to spawning_in)
+        """
+        entity_pos_listing = []
+
+        if without_objects:
+            for entity in game_objects:
+                entity_pos_listing.append((entity.x, entity.y))
+
+        areas = self._spawn_areas()
+        while True:
+            (x_min, y_min, x_max, y_max) = random.choice(areas)
+            x = random.randint(x_min, x_max - 1)
+            y = random.randint(y_min, y_max - 1)
+            if self.tiles[x][y].tile_type == tile_type and (x, y) not in entity_pos_listing:
+                return x, y
+
+    def get_all_available_tiles(self, tile_type, game_objects, without_objects=False):
+        """
+        Same as for the other maps, but only in the chunks already generated (or the ones given to spawning_in)
+        """
+        listing = []
+        entity_pos_listing = set()
+
+        if without_objects:
+            for entity in game_objects:
+                entity_pos_listing.add((entity.x, entity.y))
+
+        for (x_min, y_min, x_max, y_max) in self._spawn_areas():
+            for x in range(x_min, x_max):
+                for y in range(y_min, y_max):
+                    if self.tiles[x][y].tile_type == tile_type and (x, y) not in entity_pos_listing:
+                        listing.append((x, y))
+        random.shuffle(listing)
+        return listing
+
+    def draw_background(self, surface, camera):
+        """
+        Draw the chunks seen through the camera
+        """
+        (x_min, y_min, x_max, y_max) = camera.tile_area(surface.get_width(), surface.get_height(),
+                                                        self.tile_width, self.tile_height)
+        for chunk_x in range(x_min // self.chunk_size, (x_max - 1) // self.chunk_size + 1):
+            for chunk_y in range(y_min // self.chunk_size, (y_max - 1) // self.chunk_size + 1):
+                chunk_surface = self._chunk_surface(chunk_x, chunk_y)
+                surface.blit(chunk_surface, camera.apply_rect(pg.Rect(chunk_x * self.chunk_size * TILESIZE_SCREEN,
+                                                                      chunk_y * self.chunk_size * TILESIZE_SCREEN,
+                                                                      chunk_surface.get_width(),
+                                                                      chunk_surface.get_height())))
+
+    def _chunk_surface(self, chunk_x, chunk_y):
+        """
+        The background of a chunk, built if needed. Only the last MAP_CHUNK_SURFACES ones are kept.
+        """
+        key = (chunk_x, chunk_y)
+        if key in self._chunk_surfaces:
+            self._chunk_surfaces.move_to_end(key)
+            return self._chunk_surfaces[key]
+        area = self.tiles.chunk_area(chunk_x, chunk_y)
+        chunk_surface = pg.Surface(((area[2] - area[0]) * TILESIZE_SCREEN, (area[3] - area[1]) * TILESIZE_SCREEN))
+        chunk_surface.fill(BGCOLOR)
+        # Seeded, so that a chunk drawn again looks the same
+        ut.call_with_seed("{}-{}-{}".format(self.seed, chunk_x, chunk_y), self._draw_tiles, chunk_surface, area)
+        self._chunk_surfaces[key] = chunk_surface
+        while len(self._chunk_surfaces) > MAP_CHUNK_SURFACES:
+            self._chunk_surfaces.popitem(last=False)
+        return chunk_surface
+
+    def _build_background(self, name=None):
+        assert False, "A chunked map has no background image: it is drawn by chunks (see draw_background)"
+
+    def clean_before_save(self):
+        Map.clean_before_save(self)
+        self._chunk_surfaces.clear()
+
+    def set_graphical_resources(self, graphical_resources):
+        Map.set_graphical_resources(self, graphical_resources)
+        self._chunk_surfaces.clear()
+
+    def _layers_to_bytes(self):
+        """
+        The tiles are generated again from the seed: only the seed, the chunks generated and their explored tiles
+        (one bit per tile, column by column) are stored.
+        :return: a list of bytes
+        """
+        parts = [struct.pack("<IHI", self.seed, self.chunk_size, len(self.tiles.chunks))]
+        for (chunk_x, chunk_y) in sorted(self.tiles.chunks):
+            chunk = self.tiles.chunks[(chunk_x, chunk_y)]
+            explored = bytearray((len(chunk) * len(chunk[0]) + 7) // 8)
+            i = 0
+            for column in chunk:
+                for tile in column:
+                    if tile.explored:
+                        explored[i >> 3] |= 1 << (i & 7)
+                    i += 1
+            parts += [struct.pack("<HH", chunk_x, chunk_y), bytes(explored)]
+        return parts
+
+    def _layers_from_bytes(self, data, offset, version):
+        (seed, chunk_size, chunk_number) = struct.unpack_from("<IHI", data, offset)
+        offset += struct.calcsize("<IHI")
+        self._init_chunks(seed, chunk_size)
+        for n in range(chunk_number):
+            (chunk_x, chunk_y) = struct.unpack_from("<HH", data, offset)
+            offset += 4
+            chunk = self.tiles.chunk(chunk_x, chunk_y)
+            explored_length = (len(chunk) * len(chunk[0]) + 7) // 8
+            explored = data[offset:offset + explored_length]
+            offset += explored_length
+            i = 0
+            for column in chunk:
+                for tile in column:
+                    tile.explored = (explored[i >> 3] >> (i & 7)) & 1 == 1
+                    i += 1
+
+
 class FileMap(Map):
     """
     This is a hardoced dungeon, taken from a file definition.
     It should contain specific locations for NPC or monsters
+    Two file formats are read:
+    * text: one line per row of tiles, '1' for a wall, '2' for a floor, a letter for a floor with a spawn marker
+      (the letter is kept in self.markers), anything else for nothing
+    * binary (see write_map_file): read through a memory map, much faster for the large maps. Files made from the text
+      format with convert_text_map.
     """
 
+    MAGIC = b"LCMF"
+    VERSION = 1
+    HEADER = "<4sHHHH"  # magic, version, width, height, layers
+    LAYER_MARKERS = 1
+    LAYER_ROOMS = 2
+
     def __init__(self, name, graphical_resource, filename):
         Map.__init__(self, name, graphical_resource, (1, 1))  # dimensions will be set after
 
-        file_data = []
-        with open(filename, 'rt') as f:
-            for line in f:
-                file_data.append(line.strip())
+        self.markers = {}  # position -> spawn marker (a letter)
+
+        with open(filename, 'rb') as f:
+            binary = f.read(len(FileMap.MAGIC)) == FileMap.MAGIC
+        if binary:
+            self._read_binary(filename)
+        else:
+            self._read_text(filename)
+
+    def _read_text(self, filename):
+        (tile_types, self.markers) = read_text_map(filename)
+
+        self.tile_width = len(tile_types)  # width of map, expressed in tiles
+        self.tile_height = len(tile_types[0])  # height of map, expressed in tiles
+
+        self.tiles = [[Tile(tile_type) for tile_type in column] for column in tile_types]
+
+    def _read_binary(self, filename):
+        with open(filename, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                (magic, version, width, height, layers) = struct.unpack_from(FileMap.HEADER, data)
+                assert version == FileMap.VERSION, "Map file version {} not supported".format(version)
+                offset = struct.calcsize(FileMap.HEADER)
+                self.tile_width = width
+                self.tile_height = height
+
+                # The tile types, column by column: each column is one slice of the file
+                tile_type_values = {ord(c.T_VOID): c.T_VOID, ord(c.T_WALL): c.T_WALL, ord(c.T_FLOOR): c.T_FLOOR}
+                self.tiles = []
+                for x in range(width):
+                    self.tiles.append([Tile(tile_type_values[tile_type])
+                                       for tile_type in data[offset:offset + height]])
+                    offset += height
+
+                if layers & FileMap.LAYER_MARKERS:
+                    (marker_number,) = struct.unpack_from("<I", data, offset)
+                    offset += 4
+                    for i in range(marker_number):
+                        (x, y, marker) = struct.unpack_from("<HHc", data, offset)
+                        offset += struct.calcsize("<HHc")
+                        self.markers[(x, y)] = marker.decode("ascii")
+
+                if layers & FileMap.LAYER_ROOMS:
+                    (room_number,) = struct.unpack_from("<H", data, offset)
+                    offset += 2
+                    for i in range(room_number):
+                        (pos_x, pos_y, size_x, size_y, room_name_length) = struct.unpack_from("<HHHHH", data, offset)
+                        offset += struct.calcsize("<HHHHH")
+                        room = Room((size_x, size_y), position=(pos_x, pos_y))
+                        room.name = data[offset:offset + room_name_length].decode("utf-8")
+                        offset += room_name_length
+                        self.rooms.append(room)
+                        self.room_graph.add_room(room)
+            finally:
+                data.close()
+
+
+def write_map_file(filename, tile_types, markers=None, rooms=None):
+    """
+    Write a map in the binary format read by FileMap:
+    * header: magic, version, width, height, the layers present
+    * tile types: one byte per tile, column by column
+    * markers (optional layer): the spawn markers, position and letter
+    * rooms (optional layer): position, size and name of the rooms
+    :param filename: the file to write
+    :param tile_types: the tile types, as a list of columns
+    :param markers: dictionary position -> marker (a letter)
+    :param rooms: list of Room
+    :return: Nothing
+    """
+    width = len(tile_types)
+    height = len(tile_types[0])
+    layers = 0
+    if markers:
+        layers |= FileMap.LAYER_MARKERS
+    if rooms:
+        layers |= FileMap.LAYER_ROOMS
+
+    parts = [struct.pack(FileMap.HEADER, FileMap.MAGIC, FileMap.VERSION, width, height, layers)]
+    for column in tile_types:
+        parts.append("".join(column).encode("ascii"))
+    if markers:
+        parts.append(struct.pack("<I", len(markers)))
+        for (x, y) in sorted(markers):
+            parts.append(struct.pack("<HHc", x, y, markers[(x, y)].encode("ascii")))
+    if rooms:
+        parts.append(struct.pack("<H", len(rooms)))
+        for room in rooms:
+            room_name = room.name.encode("utf-8")
+            parts.append(struct.pack("<HHHHH", room.position[0], room.position[1], room.size[0], room.size[1],
+                                     len(room_name)))
+            parts.append(room_name)
+
+    with open(filename, "wb") as f:
+        f.write(b"".join(parts))
+
+
+def read_text_map(filename):
+    """
+    Read a map in the text format (see FileMap)
+    :param filename: the text map
+    :return: (the tile types as a list of columns, dictionary position -> spawn marker)
+    """
+    file_data = []
+    with open(filename, 'rt') as f:
+        for line in f:
+            file_data.append(line.strip())
+
+    tile_types = [[c.T_FLOOR for y in range(len(file_data))] for x in range(len(file_data[0]))]
+    markers = {}
+
+    # Parse the file
+    for row, tiles in enumerate(file_data):
+        for col, tile in enumerate(tiles):
+            if tile == str(c.T_WALL):
+                tile_types[col][row] = c.T_WALL
+            elif tile == str(c.T_FLOOR):
+                tile_types[col][row] = c.T_FLOOR
+            elif tile.isalpha():
+                tile_types[col][row] = c.T_FLOOR
+                markers[(col, row)] = tile
+            else:
+                tile_types[col][row] = c.T_VOID
+    return tile_types, markers
 
-        self.tile_width = len(file_data[0])  # width of map, expressed in tiles
-        self.tile_height = len(file_data)  # height of map, expressed in tiles
 
-        self.tiles = [[Tile(c.T_FLOOR)
-                       for y in range(self.tile_height)]
-                      for x in range(self.tile_width)]
+def convert_text_map(text_filename, binary_filename):
+    """
+    Convert a map from the text format to the binary format (see FileMap).
+    Can be run as: python tilemap.py map.txt map.bin
+    :param text_filename: the text map
+    :param binary_filename: the binary file to write
+    :return: Nothing
+    """
+    (tile_types, markers) = read_text_map(text_filename)
+    write_map_file(binary_filename, tile_types, markers=markers)
 
-        # Parse the file
-        for row, tiles in enumerate(file_data):
-            for col, tile in enumerate(tiles):
-                if tile == str(c.T_WALL):
-                    self.tiles[col][row].tile_type = c.T_WALL
-                elif tile == str(c.T_FLOOR):
-                    self.tiles[col][row].tile_type = c.T_FLOOR
-                else:
-                    self.tiles[col][row].tile_type = c.T_VOID
+
+# Used to rebuild a map of the right type from a file
+MAP_CLASSES = {"Map": Map, "MazeMap": MazeMap, "RoomMap": RoomMap, "RoomAndMazeMap": RoomAndMazeMap,
+               "CaveMap": CaveMap, "ChunkedCaveMap": ChunkedCaveMap, "FileMap": FileMap}
 
 
 class Camera:
@@ -1042,6 +1909,21 @@ class Camera:
         # and apply it to the camera rect
         self.camera = pg.Rect(x, y, self.width, self.height)
 
+    def tile_area(self, view_width, view_height, tile_width, tile_height):
+        """
+        The tiles shown through the camera
+        :param view_width: the width of the view, in pixels
+        :param view_height: the height of the view, in pixels
+        :param tile_width: the width of the map, in tiles
+        :param tile_height: the height of the map, in tiles
+        :return: (x min, y min, x max, y max), the max being excluded
+        """
+        (cam_x, cam_y) = self.camera.topleft
+        return (max(0, -cam_x // TILESIZE_SCREEN),
+                max(0, -cam_y // TILESIZE_SCREEN),
+                min(tile_width, (view_width - cam_x) // TILESIZE_SCREEN + 1),
+                min(tile_height, (view_height - cam_y) // TILESIZE_SCREEN + 1))
+
     def reverse(self, pos):
         """
         Return the pos in the original file from a position on the screen.
@@ -1061,9 +1943,8 @@ class Minimap:
 
     def build_background(self, minimap=True, zoom_factor=2, center_player=False, map_display_size_x=MINIMAP_WIDTH, map_display_size_y=MINIMAP_HEIGHT):
 
-        x_min = y_min = 0
-        x_max = self.game.map.tile_width
-        y_max = self.game.map.tile_height
+        # Only the part of the map that exists (the large maps are generated when explored)
+        (x_min, y_min, x_max, y_max) = self.game.map.known_bounds()
 
         if hasattr(self.game, "player") and center_player:
             _background = pg.Surface((map_display_size_x * zoom_factor, map_display_size_y * zoom_factor))
@@ -1072,13 +1953,13 @@ class Minimap:
             y_min = max(0, self.game.player.y - int(map_display_size_y / 2))
             y_max = min(self.game.player.y + int(map_display_size_y / 2), self.game.map.tile_height)
         else:
-            _background = pg.Surface((self.game.map.tile_width * zoom_factor,
-                                      self.game.map.tile_height * zoom_factor))
+            _background = pg.Surface(((x_max - x_min) * zoom_factor, (y_max - y_min) * zoom_factor))
         backpixels = pg.PixelArray(_background)
         for x in range(x_min, x_max):
             for y in range(y_min, y_max):
-                if self.game.map.tiles[x][y].explored:
-                    tile_type = self.game.map.tiles[x][y].tile_type
+                tile = self.game.map.known_tile(x, y)
+                if tile is not None and tile.explored:
+                    tile_type = tile.tile_type
                     if tile_type == c.T_WALL:
                         backpixels[(x - x_min) * zoom_factor:(x - x_min) * zoom_factor + 1,
                         (y - y_min) * zoom_factor:(y - y_min) * zoom_factor + 1] = RED
@@ -1230,24 +2111,16 @@ class FieldOfView:
 
     def __init__(self, game):
         self.game = game
-        self._ready = False
-        self.fov = []
 
-    def reset(self):
-        self.fov = [[False for y in range(self.game.map.tile_height)] for x in range(self.game.map.tile_width)]
-        self._ready = True
-
-    def get_vision_matrix_for(self, entity, radius=None, flag_explored=False, ignore_entity_at=None):
+    def get_visible_tiles_for(self, entity, radius=None, flag_explored=False, ignore_entity_at=None):
         """
         The Field of View algo
         :param entity: the entity for which the algo is done
         :param radius: the number of tiles the user can go throught
         :param flag_explored: any unexplored tile will become explored (good for player, but not NPC)
         :param ignore_entity_at: will ignore any entity at positions (like player) - this is a list
-        :return: the Field of view, with True for each tile that is visible
+        :return: the set of the visible tile positions. Only the tiles around the entity are looked at.
         """
-        if not self._ready:
-            self.reset()
         if radius is None:
             if hasattr(entity, "fighter"):
                 radius = entity.vision
@@ -1263,9 +2136,10 @@ class FieldOfView:
         # RAD times, and checking for collision with wall every step.
 
         # First: the entity itself is visible!
-        self.fov[entity.x][entity.y] = True  # Make tile visible
+        visible = {(entity.x, entity.y)}  # Make tile visible
+        tiles = self.game.map.tiles
         if flag_explored:
-            self.game.map.tiles[entity.x][entity.y].explored = True
+            tiles[entity.x][entity.y].explored = True
 
         for i in range(0, FieldOfView.RAYS + 1, FieldOfView.STEP):
             ax = FieldOfView.SINTABLE[i]  # Get precalculated value sin(x / (180 / pi))
@@ -1280,20 +2154,22 @@ class FieldOfView:
 
                 round_x = int(round(x))
                 round_y = int(round(y))
-                if round_x < 0 or round_y < 0 or round_x > self.game.map.tile_width or\
-                                round_y > self.game.map.tile_height:  # Ray is out of range
+                if round_x < 0 or round_y < 0 or round_x >= self.game.map.tile_width or\
+                                round_y >= self.game.map.tile_height:  # Ray is out of range
                     break
 
-                self.fov[round_x][round_y] = True  # Make tile visible
+                visible.add((round_x, round_y))  # Make tile visible
+                tile = tiles[round_x][round_y]
                 if flag_explored:
-                    self.game.map.tiles[round_x][round_y].explored = True
+                    tile.explored = True
                 if ignore_entity_at is not None:
-                    if (round_x, round_y) not in ignore_entity_at and\
-                            self.game.map.tiles[round_x][round_y].block_view_for(entity):
+                    if (round_x, round_y) not in ignore_entity_at and tile.block_view_for(entity):
                         break
-                elif self.game.map.tiles[round_x][round_y].block_view_for(entity):  # Stop ray if it hit
+                elif tile.block_view_for(entity):  # Stop ray if it hit
                     break
 
-        self._ready = False
+        return visible
+
 
-        return self.fov
+if __name__ == '__main__':
+    convert_text_map(sys.argv[1], sys.argv[2])
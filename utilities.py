@@ -1,7 +1,65 @@
+import json
 import random as rd
+import time
+from collections import Counter, deque
 import constants as c
 
 
+class TickerStats(object):
+    """
+    What the Ticker runs:
+    * the number of actors per tick (as an histogram: number of actors -> number of ticks)
+    * the take_turn calls by class of actor (AIEntity, TemporaryAction...): number, total and longest time
+    * the number of actors waiting in the schedule, after each tick (the last ones only)
+    * the actors whose turn took longer than the budget (the last ones only)
+    """
+
+    def __init__(self, budget=0.005, sample_number=1000):
+        """
+        :param budget: the time an actor turn should not exceed, in seconds
+        :param sample_number: the number of queue depths and slow turns kept
+        """
+        self.budget = budget
+        self.actors_per_tick = Counter()
+        self.calls = Counter()  # class name -> number of turns
+        self.total_time = Counter()  # class name -> cumulative time, in seconds
+        self.max_time = {}  # class name -> longest turn, in seconds
+        self.queue_depths = deque(maxlen=sample_number)  # (tick, actors scheduled)
+        self.slow_turns = deque(maxlen=sample_number)  # (tick, class name, owner name, seconds)
+
+    def turn(self, tick, obj, duration):
+        name = type(obj).__name__
+        self.calls[name] += 1
+        self.total_time[name] += duration
+        if duration > self.max_time.get(name, 0):
+            self.max_time[name] = duration
+        if duration > self.budget:
+            owner = getattr(obj, "owner", None)
+            self.slow_turns.append((tick, name, getattr(owner, "name", None), duration))
+
+    def tick(self, tick, actor_number, schedule):
+        self.actors_per_tick[actor_number] += 1
+        self.queue_depths.append((tick, sum(len(actors) for actors in schedule.values())))
+
+    def to_dict(self):
+        """
+        :return: the statistics as plain data (times in milliseconds), ready to be written as JSON
+        """
+        return {"budget_ms": self.budget * 1000,
+                "actors_per_tick": {str(number): ticks for number, ticks in sorted(self.actors_per_tick.items())},
+                "turns": {name: {"calls": self.calls[name],
+                                 "total_ms": self.total_time[name] * 1000,
+                                 "max_ms": self.max_time.get(name, 0) * 1000}
+                          for name in self.calls},
+                "queue_depths": [list(sample) for sample in self.queue_depths],
+                "slow_turns": [{"tick": tick, "class": name, "owner": owner, "ms": duration * 1000}
+                               for (tick, name, owner, duration) in self.slow_turns]}
+
+    def export(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
 class Ticker(object):
     """Simple timer for roguelike games."""
 
@@ -9,22 +67,84 @@ class Ticker(object):
         self.ticks = 0  # current ticks--sys.maxint is 2147483647
         self.schedule = {}  # this is the dict of things to do {ticks: [obj1, obj2, ...], ticks+1: [...], ...}
         self.ticks_to_advance = 0
+        self.profiler = None  # optional FrameProfiler: the turns are then timed, the AI ones apart
+        self.stats = None  # optional TickerStats (see enable_stats)
+        self.turn_listeners = []  # functions called each time the ticks of an action are all advanced
+
+    def enable_stats(self, budget=0.005, sample_number=1000):
+        """
+        Start recording what is run (see TickerStats)
+        :return: the statistics
+        """
+        self.stats = TickerStats(budget=budget, sample_number=sample_number)
+        return self.stats
+
+    def disable_stats(self):
+        """
+        :return: the statistics recorded, None if they were not enabled
+        """
+        stats = self.stats
+        self.stats = None
+        return stats
 
     def schedule_turn(self, interval, obj):
         self.schedule.setdefault(self.ticks + interval, []).append(obj)
 
-    def _advance_ticks(self, interval):
+    def _advance_ticks(self, interval, deadline=None):
+        """
+        :param interval: the number of ticks to advance
+        :param deadline: the time (perf_counter) after which no new tick is started, None for no limit
+        :return: the number of ticks advanced (at least one)
+        """
         for i in range(interval):
+            if deadline is not None and i > 0 and time.perf_counter() > deadline:
+                return i
             things_to_do = self.schedule.pop(self.ticks, [])
+            actor_number = 0
             for obj in things_to_do:
-                if obj is not None:
+                if obj is None:
+                    continue
+                actor_number += 1
+                if self.profiler is None and self.stats is None:
                     obj.take_turn()
+                else:
+                    self._timed_turn(obj)
+            if self.stats is not None:
+                self.stats.tick(self.ticks, actor_number, self.schedule)
             self.ticks += 1
+        return interval
+
+    def _timed_turn(self, obj):
+        start = time.perf_counter()
+        if self.profiler is None:
+            obj.take_turn()
+        else:
+            # The AI components are the ones with an owner
+            with self.profiler.section("ai" if hasattr(obj, "owner") else "actions"):
+                obj.take_turn()
+        if self.stats is not None:
+            self.stats.turn(self.ticks, obj, time.perf_counter() - start)
+
+    @property
+    def busy(self):
+        """
+        True while the ticks of the last action are not all advanced
+        """
+        return self.ticks_to_advance > 0
 
-    def advance_ticks(self):
+    def advance_ticks(self, budget=None):
+        """
+        Advance the ticks asked for by the actions.
+        :param budget: the time allowed, in seconds, None for no limit. A tick is never split: the ones left when the
+        time is over are advanced by the next calls (and at least one tick is advanced per call).
+        """
         if self.ticks_to_advance > 0:
-            self._advance_ticks(self.ticks_to_advance)
-            self.ticks_to_advance = 0
+            deadline = None if budget is None else time.perf_counter() + budget
+            self.ticks_to_advance -= self._advance_ticks(self.ticks_to_advance, deadline=deadline)
+            if self.ticks_to_advance <= 0:
+                # The turn is over, whoever advanced it (the screen, the command queue, a multi-turn action)
+                for listener in self.turn_listeners:
+                    listener()
 
     def unregister(self, obj):
         if obj is not None:
@@ -65,6 +185,78 @@ class TemporaryAction():
                     self.register_target.unregister(self)
 
 
+class PublisherMetrics(object):
+    """
+    Load of a Publisher: messages published by (main, sub) category, and the calls to the subscribers.
+    The subscribers are counted by function (like LogBox.notify), all objects together.
+    """
+
+    def __init__(self, report_interval=0):
+        """
+        :param report_interval: seconds between two reports printed, 0 for none
+        """
+        self.messages = Counter()  # (main category, sub category) -> number of messages published
+        self.calls = Counter()  # subscriber function -> number of calls
+        self.total_time = Counter()  # subscriber function -> cumulative time, in seconds
+        self.max_time = {}  # subscriber function -> longest call, in seconds
+        self.report_interval = report_interval
+        self._last_report = time.perf_counter()
+
+    @staticmethod
+    def _category_name(category):
+        if type(category) in (list, tuple):
+            return "/".join(str(value) for value in category)
+        return str(category)
+
+    def count(self, main_category, sub_category):
+        self.messages[(self._category_name(main_category), self._category_name(sub_category))] += 1
+
+    def call(self, function, message):
+        """
+        Call a subscriber and measure it
+        """
+        start = time.perf_counter()
+        try:
+            function(message)
+        finally:
+            duration = time.perf_counter() - start
+            name = getattr(function, "__qualname__", repr(function))
+            self.calls[name] += 1
+            self.total_time[name] += duration
+            if duration > self.max_time.get(name, 0):
+                self.max_time[name] = duration
+
+    def snapshot(self):
+        """
+        :return: a copy of the metrics:
+        {"messages": {"main#sub": count},
+         "subscribers": {function name: {"calls": count, "total_ms": time, "max_ms": time}}}
+        """
+        return {"messages": {"{}#{}".format(main, sub): count for (main, sub), count in self.messages.items()},
+                "subscribers": {name: {"calls": self.calls[name],
+                                       "total_ms": self.total_time[name] * 1000,
+                                       "max_ms": self.max_time.get(name, 0) * 1000}
+                                for name in self.calls}}
+
+    def report(self):
+        """
+        :return: the metrics as a text, the most expensive subscribers first
+        """
+        lines = ["Messages published:"]
+        for (main, sub), count in self.messages.most_common():
+            lines.append("  {:<40} {:>8}".format("{}#{}".format(main, sub), count))
+        lines.append("{:<42} {:>8} {:>12} {:>10}".format("Subscribers:", "calls", "total ms", "max ms"))
+        for name, total_time in self.total_time.most_common():
+            lines.append("  {:<40} {:>8} {:>12.2f} {:>10.2f}".format(name[:40], self.calls[name], total_time * 1000,
+                                                                    self.max_time.get(name, 0) * 1000))
+        return "\n".join(lines)
+
+    def report_if_due(self):
+        if self.report_interval > 0 and time.perf_counter() - self._last_report >= self.report_interval:
+            self._last_report = time.perf_counter()
+            print(self.report())
+
+
 class Publisher(object):
     """
     Dispatch messages
@@ -72,12 +264,31 @@ class Publisher(object):
     * Main: like log, fight, exploration, inventory
     * Sub: precises the main, optional.
     Messgae content is a dictionary
+    The load can be measured (see enable_metrics).
     """
 
     def __init__(self):
         self._specialized_list = {}  # Subscribe to main and a list of sub_category
         self.in_publish = False
         self.delayed_unregister = []
+        self.metrics = None
+
+    def enable_metrics(self, report_interval=0):
+        """
+        Start counting the messages and measuring the subscribers (see PublisherMetrics)
+        :param report_interval: seconds between two reports printed, 0 for none
+        :return: the metrics
+        """
+        self.metrics = PublisherMetrics(report_interval=report_interval)
+        return self.metrics
+
+    def disable_metrics(self):
+        """
+        :return: the metrics collected, None if they were not enabled
+        """
+        metrics = self.metrics
+        self.metrics = None
+        return metrics
 
     def register(self,
                  object_to_register,
@@ -133,6 +344,9 @@ class Publisher(object):
     def publish(self, source, message, main_category=c.P_ALL, sub_category=c.P_ALL):
         self.in_publish = True
         assert type(message) is dict, "Message {} is not a dict".format(message)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.count(main_category, sub_category)
         message["SOURCE"] = source
         broadcasted_list = []
         message["MAIN_CATEGORY"] = main_category
@@ -156,10 +370,15 @@ class Publisher(object):
                 if key in self._specialized_list:
                     for function in self._specialized_list[key]:
                         if function not in broadcasted_list:  # Need to be sure not to send two times the message
-                            function(message)
+                            if metrics is None:
+                                function(message)
+                            else:
+                                metrics.call(function, message)
                             broadcasted_list.append(function)
         self.in_publish = False
         self.handle_delayed_unregister_all()
+        if metrics is not None:
+            metrics.report_if_due()
 
 """
 Utilities Functions.
@@ -179,6 +398,22 @@ def roll(dice, repeat=1):
     return res
 
 
+def call_with_seed(seed, function, *args, **kwargs):
+    """
+    Call a function with the random generator seeded, so that the result can be built again identically.
+    The state of the random generator is restored afterwards.
+    :param seed: the seed to use
+    :param function: the function to call
+    :return: the result of the function
+    """
+    state = rd.getstate()
+    rd.seed(seed)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        rd.setstate(state)
+
+
 
 NAMES = ["Abaet","Acamen","Adeen","Aghon","Ahburn","Airen","Aldaren","Alkirk","Amitel","Anumil","Asen","Atgur","Auden","Aysen","Abarden","Achard","Aerden","Agnar","Ahdun","Airis","Alderman","Allso","Anfar","Asden","Aslan","Atlin","Ault","Aboloft","Ackmard","Afflon","Ahalfar","Aidan","Albright","Aldren","Amerdan","Anumi","Asdern","Atar","Auchfor","Ayrie",
 "Bacohl","Balati","Basden","Bedic","Beson","Bewul","Biston","Boaldelr","Breanon","Bredock","Bristan","Busma","Badeek","Baradeer","Bayde","Beeron","Besur","Biedgar","Bithon","Bolrock","Bredere","Breen","Buchmeid","Buthomar","Baduk","Barkydle","Beck","Bein","Besurlde","Bildon","Boal","Brakdern","Bredin","Brighton","Bue","Bydern",
@@ -219,11 +454,20 @@ class Mdict:
         l = self[prefix]
         return rd.choice(l)
 
+    def freeze(self):
+        """
+        Once built, the suffix lists are not modified anymore: store them as tuples
+        """
+        for prefix in self.d:
+            self.d[prefix] = tuple(self.d[prefix])
+
 
 class MName:
     """
     A name from a Markov chain
+    The chains are built only once per chain length, and shared by all the name requests.
     """
+    _instances = {}
 
     def __init__(self, chainlen=3):
         """
@@ -241,6 +485,7 @@ class MName:
             for n in range(0, len(l)):
                 self.mcd.add_key(s[n:n + chainlen], s[n + chainlen])
             self.mcd.add_key(s[len(l):len(l) + chainlen], "\n")
+        self.mcd.freeze()
 
     def getName(self):
         """
@@ -259,5 +504,34 @@ class MName:
         return name.capitalize()
 
     @staticmethod
-    def name():
-        return MName().getName()
\ No newline at end of file
+    def _get_instance(chainlen=3):
+        if chainlen not in MName._instances:
+            MName._instances[chainlen] = MName(chainlen=chainlen)
+        return MName._instances[chainlen]
+
+    @staticmethod
+    def name(chainlen=3):
+        return MName._get_instance(chainlen=chainlen).getName()
+
+    @staticmethod
+    def names(count, unique=True, chainlen=3):
+        """
+        Generate multiple names at once
+        :param count: the number of names requested
+        :param unique: if True, all the names will be different
+        :param chainlen: the length of the Markov chain
+        :return: a list of names (may be shorter than count if the chain cannot produce enough different names)
+        """
+        generator = MName._get_instance(chainlen=chainlen)
+        if not unique:
+            return [generator.getName() for i in range(count)]
+        names = []
+        already_seen = set()
+        attempts = 0
+        while len(names) < count and attempts < 20 * count:
+            attempts += 1
+            name = generator.getName()
+            if name and name not in already_seen:
+                already_seen.add(name)
+                names.append(name)
+        return names
\ No newline at end of file
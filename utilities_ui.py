@@ -4,12 +4,70 @@ from os import path
 import constants as c
 import random as rd
 import string
+from collections import OrderedDict, deque
 
 """
 Sub utilities routines.
 """
 
 
+class FontManager:
+    """
+    Shared access to the fonts and to the rendered texts.
+    Each font (file, size) is loaded only once from the disk, and the last rendered texts are kept in a LRU cache
+    keyed on (text, font, color, background), so identical strings are not rasterized again.
+    Warning: the surfaces returned by render are shared, they must be blitted but never modified.
+    """
+    _fonts = {}
+    _texts = OrderedDict()
+
+    @staticmethod
+    def get_font(size, font_name=st.FONT_NAME):
+        """
+        Return the font, loading it only the first time
+        :param size: the size of the font
+        :param font_name: the font file name, in the font folder. None for the pygame default font
+        :return: the pygame font
+        """
+        key = (font_name, size)
+        if key not in FontManager._fonts:
+            if font_name is None:
+                FontManager._fonts[key] = pg.font.Font(None, size)
+            else:
+                font_folder = path.join(path.dirname(__file__), st.FONT_FOLDER)
+                FontManager._fonts[key] = pg.font.Font(path.join(font_folder, font_name), size)
+        return FontManager._fonts[key]
+
+    @staticmethod
+    def render(text, size, color, background=None, font_name=st.FONT_NAME, antialias=True):
+        """
+        Render a text, or take it from the cache if the same text was already rendered
+        :param text: the text to be rendered
+        :param size: the size of the font
+        :param color: the color of the text
+        :param background: the background color, None for a transparent background
+        :param font_name: the font file name
+        :param antialias: as in pygame font render
+        :return: the rendered surface (shared, not to be modified)
+        """
+        key = (text, font_name, size, antialias, tuple(color),
+               tuple(background) if background is not None else None)
+        surface = FontManager._texts.get(key)
+        if surface is not None:
+            FontManager._texts.move_to_end(key)
+            return surface
+
+        font = FontManager.get_font(size, font_name=font_name)
+        if background is None:
+            surface = font.render(text, antialias, color)
+        else:
+            surface = font.render(text, antialias, color, background)
+        FontManager._texts[key] = surface
+        if len(FontManager._texts) > st.TEXT_CACHE_SIZE:
+            FontManager._texts.popitem(last=False)
+        return surface
+
+
 class Button(object):
     '''
     https://github.com/metulburr/pygooey/blob/master/pygooey/button.py
@@ -62,7 +120,7 @@ class Button(object):
             "id": None,
             "color": pg.Color('black'),
             "text": None,
-            "font":  pg.font.Font(path.join(path.join(path.dirname(__file__), st.FONT_FOLDER), st.FONT_NAME), 10),
+            "font": FontManager.get_font(10),
             "hover_color": pg.Color('white'),
             "clicked_color": None,
             "font_color": pg.Color("white"),
@@ -250,7 +308,7 @@ class InputBox(object):
                     "outline_color": pg.Color("black"),
                     "outline_width": 2,
                     "active_color": pg.Color("blue"),
-                    "font": pg.font.Font(None, self.rect.height + 4),
+                    "font": FontManager.get_font(self.rect.height + 4, font_name=None),
                     "clear_on_enter": False,
                     "inactive_on_enter": True,
                     "blink_speed": 500,
@@ -350,7 +408,8 @@ class LogBox:
                  border=2,
                  border_color=st.WHITE, initial_message=None):
 
-        self.font = pg.font.Font(path.join(path.join(path.dirname(__file__), st.FONT_FOLDER), st.FONT_NAME), 10)
+        self.font_size = 10
+        self.font = FontManager.get_font(self.font_size)
         self.border = border
         self.border_color = border_color
 
@@ -361,7 +420,8 @@ class LogBox:
                             limit_lines * self.font.get_height())
         self.rect.centerx = int(st.GAME_WIDTH / 2)
         bus.register(self)
-        self.messages = []
+        # Bounded history: each message is stored with its lines already wrapped to the box width
+        self.messages = deque(maxlen=st.LOG_HISTORY_SIZE)
         self.limit_lines = limit_lines
         self.delta = 0
         self.drag_drop_text_box = False
@@ -401,35 +461,37 @@ class LogBox:
         @return: a list of text lines.
         """
         # BBB: someday this function could became part of some text (non graphical) utility?
-        words = [x for x in text_too_long.split(" ")]
-        words_removed = []
-        tooLong = True
-        txt1 = txt2 = ""
-        while tooLong:
-            word = words.pop()
-            # Simple: cut the word and go on
-            while cls.wordTooLong(word, font, max_length, justify_chars=justify_chars):
-                word = word[:-1].strip()
-
-            words_removed.append(word)
-            txt1 = " ".join(words)
-            if font.size(txt1)[0] <= max_length:
-                tooLong = False
-        words_removed.reverse()
-        txt2 = (" " * justify_chars) + " ".join(words_removed)
-        if font.size(txt2)[0] <= max_length:
-            return [txt1, txt2]
-        else:
-            return [txt1] + cls.normalizeTextLength(txt2, font, max_length, justify_chars=justify_chars)
+        lines = []
+        text = text_too_long
+        while True:
+            words = text.split(" ")
+            words_removed = []
+            txt1 = text
+            while font.size(txt1)[0] > max_length and len(words) > 1:
+                word = words.pop()
+                # Simple: cut the word and go on
+                while cls.wordTooLong(word, font, max_length, justify_chars=justify_chars):
+                    word = word[:-1].strip()
+                words_removed.append(word)
+                txt1 = " ".join(words)
+            # A single word longer than the line is simply cut
+            while len(txt1) > 1 and font.size(txt1)[0] > max_length:
+                txt1 = txt1[:-1]
+            lines.append(txt1)
+            if len(words_removed) == 0:
+                return lines
+            words_removed.reverse()
+            text = (" " * justify_chars) + " ".join(words_removed)
+            if font.size(text)[0] <= max_length:
+                lines.append(text)
+                return lines
 
     def draw(self, surface):
         if self.force_render:
             self._render_texts = []
-            i = 0
-            msg_list = self._prepare_message_list()
-            for line, category in msg_list:
-                self._render_texts.append(self.font.render(line, 1, self.color[category], st.BGCOLOR))
-                i += 1
+            for line, category in self._prepare_message_list():
+                self._render_texts.append(FontManager.render(line, self.font_size, self.color[category], st.BGCOLOR))
+            self.force_render = False
 
         pg.draw.rect(surface, self.border_color, self.rect.inflate(self.border, self.border))
         surface.fill(st.BGCOLOR, rect=self.rect)
@@ -442,26 +504,45 @@ class LogBox:
             if not self.filters[key]:
                 pg.draw.rect(surface, st.BGCOLOR, self.filter_recs[key].inflate(-2, -2))
 
+    @property
+    def area(self):
+        """
+        The part of the screen covered by the box (border and filters included)
+        """
+        return self.rect.inflate(self.border, self.border).unionall(list(self.filter_recs.values()))
+
+    def _wrap(self, text):
+        """
+        Split a message in lines fitting in the box width
+        :param text: the message
+        :return: the list of lines
+        """
+        if self.font.size(text)[0] > self.rect.width:
+            return self.normalizeTextLength(text, self.font, self.rect.width, justify_chars=0)
+        return [text]
+
     def _prepare_message_list(self):
-        message_for_display = []
-        rw = self.rect.width
-        for message_info in self.messages:
-            text, category = message_info
+        """
+        Build the visible window: the messages are walked from the most recent one, and only the lines up to the
+        scroll position are looked at, so the cost does not depend on the history length.
+        :return: the list of [line, category] to be displayed, oldest first
+        """
+        needed = self.limit_lines - self.delta
+        lines = []
+        for text, category, wrapped in reversed(self.messages):
             if self.filters[category]:
-                lw, lh = self.font.size(text)
-                if lw>rw:
-                    text_list = self.normalizeTextLength(text,
-                                                         self.font,
-                                                         self.rect.width,
-                                                         justify_chars=0)
-                    for line in text_list:
-                        message_for_display.append([line, category])
-                else:
-                    message_for_display.append(message_info)
-
-        if self.delta < -len(message_for_display) + self.limit_lines:
-            self.delta = -len(message_for_display) + self.limit_lines
-        return message_for_display[- self.limit_lines + self.delta:len(message_for_display) + self.delta]
+                for line in reversed(wrapped):
+                    lines.append([line, category])
+                if len(lines) >= needed:
+                    break
+
+        # Not enough lines to scroll that far: stick to the oldest ones
+        if len(lines) < needed:
+            self.delta = min(0, self.limit_lines - len(lines))
+            needed = self.limit_lines - self.delta
+        lines = lines[-self.delta:needed]
+        lines.reverse()
+        return lines
 
     def get_event(self, event):
         if event.type == pg.MOUSEBUTTONUP:
@@ -493,7 +574,7 @@ class LogBox:
 
     def _record_message(self, text, category):
         text = text[0].capitalize() + text[1:]
-        self.messages.append([text, category])
+        self.messages.append((text, category, self._wrap(text)))
         self.force_render = True
         self.delta = 0
 
@@ -602,6 +683,11 @@ class LogBox:
                     self._record_message("{} entered {}".format(message["operator"].name, message["room"].name),
                                          c.P_CAT_ENV)
 
+            elif message["SUB_CATEGORY"] == c.AC_ENV_INTERRUPT:
+                self._record_message("{} stopped {}: {}".format(message["operator"].name, message["activity"],
+                                                                message["reason"]),
+                                     c.P_CAT_ENV)
+
             elif message["SUB_CATEGORY"] == c.AC_QUEST:
                 quest = message["quest"]
                 if message["result"] == c.QUEST_SUBSCRIBED:
@@ -633,6 +719,9 @@ class LogBox:
         for key in self.filter_recs:
             self.filter_recs[key].right += new_right - old_right
             self.filter_recs[key].y += new_height - old_height
+        if new_width != old_width:
+            self.messages = deque([(text, category, self._wrap(text)) for text, category, wrapped in self.messages],
+                                  maxlen=st.LOG_HISTORY_SIZE)
         self.delta = 0
         self.force_render = True
 
@@ -665,9 +754,7 @@ class Input:
                  limit_message=-1, focus=False, callback=None):
         self.game = game
 
-        game_folder = path.dirname(__file__)
-        font_folder = path.join(game_folder, st.FONT_FOLDER)
-        font = pg.font.Font(path.join(font_folder, font_name), font_size)
+        font = FontManager.get_font(font_size, font_name=font_name)
 
         self.x, self.y = pos
         self.font = font